@@ -0,0 +1,362 @@
+"""Замеры производительности горячих путей редактора.
+
+Буфер, документ и список последних файлов измеряются без дисплея, сам
+TextEditor — под виртуальным X-сервером (Xvfb запускается автоматически,
+если DISPLAY не задан). Результаты пишутся в JSON; при указании базового
+файла замедление больше допуска считается регрессией и завершает запуск
+с кодом 1.
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json --tolerance 0.25
+    python bench.py --sizes 1K,1M,1G --tabs 1,10,100,1000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import laba1
+
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+DEFAULT_SIZES = "1K,64K,1M,16M"
+DEFAULT_TABS = "1,10,100"
+# Разница меньше этой считается шумом и регрессией не бывает
+NOISE_FLOOR = 0.002
+
+
+def parse_size(text):
+    """Размер вида 1K, 16M, 1G в байтах"""
+    text = text.strip().upper()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def make_text_file(path, size, seed=0):
+    """Создает файл заданного размера из строк похожего на код текста"""
+    rng = random.Random(seed)
+    words = ["def", "return", "self", "value", "index", "buffer", "for", "in",
+             "if", "None", "print", "текст", "строка", "(x)", "[i]", "= 0", "#"]
+    lines = []
+    for _ in range(2000):
+        indent = "    " * rng.randint(0, 3)
+        lines.append(indent + " ".join(rng.choice(words) for _ in range(rng.randint(1, 12))))
+    block = ("\n".join(lines) + "\n").encode("utf-8")
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            data = block[:size - written]
+            f.write(data)
+            written += len(data)
+    return path
+
+
+def stats(samples):
+    """Сводка по замерам в секундах"""
+    samples = sorted(samples)
+    return {
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+        "runs": len(samples),
+    }
+
+
+def timed(func):
+    """Время выполнения func в секундах"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+class Bench:
+    """Набор результатов и пропущенных замеров"""
+    def __init__(self):
+        self.results = {}
+        self.skipped = {}
+
+    def record(self, name, samples):
+        if not isinstance(samples, list):
+            samples = [samples]
+        self.results[name] = stats(samples)
+        print(f"{name:45s} {self.results[name]['median'] * 1000:10.3f} мс")
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+        print(f"{name:45s} пропущено: {reason}")
+
+
+def bench_buffer(bench, label, text, ops):
+    """Таблица кусков без Tk: загрузка, набор, вставка, поиск строк"""
+    rng = random.Random(1)
+    bench.record(f"buffer.load.{label}", timed(lambda: laba1.PieceTable(text)))
+    buffer = laba1.PieceTable(text)
+    samples = []
+    offset = len(buffer) // 2
+    for _ in range(ops):
+        samples.append(timed(lambda: buffer.insert(offset, "x")))
+        offset += 1
+    bench.record(f"buffer.keystroke.{label}", samples)
+    paste = "вставка\n" * (128 << 10)
+    bench.record(f"buffer.paste.{label}", timed(lambda: buffer.insert(rng.randrange(len(buffer)), paste)))
+    lines = buffer.line_count
+
+    def lookups():
+        for _ in range(1000):
+            buffer.position_of(buffer.line_start(rng.randrange(lines)))
+
+    bench.record(f"buffer.line_lookup_x1000.{label}", timed(lookups))
+    bench.record(f"buffer.snapshot_text.{label}", timed(lambda: buffer.snapshot().get_text()))
+
+
+def bench_document(bench, label, path, ops):
+    """Документ без представления: открытие, набор и сохранение"""
+    doc = laba1.Document(None)
+    bench.record(f"document.open.{label}", timed(lambda: doc.open_file(path)))
+    bench.record(f"document.save_unchanged.{label}", timed(doc.save_file))
+    samples = []
+    offset = len(doc.buffer) // 2
+    for _ in range(ops):
+        samples.append(timed(lambda: doc.insert_text(offset, "x")))
+        offset += 1
+    bench.record(f"document.keystroke.{label}", samples)
+    bench.record(f"document.save_edited.{label}", timed(doc.save_file))
+    bench.record(f"document.undo_group.{label}", timed(doc.undo))
+
+
+def bench_recent(bench, workdir):
+    """Список последних файлов: добавление и запись на диск"""
+    recent = laba1.RecentList(os.path.join(workdir, "recent_files.json"), max_items=30)
+    paths = [os.path.join(workdir, f"file{i}.txt") for i in range(1000)]
+    bench.record("recent.add_x1000", timed(lambda: [recent.add(p) for p in paths]))
+    bench.record("recent.flush", timed(recent.flush))
+    bench.record("recent.load", timed(lambda: laba1.RecentList(recent.filename)))
+
+
+def start_display():
+    """Обеспечивает DISPLAY; возвращает (процесс Xvfb или None, причина пропуска)"""
+    if os.environ.get("DISPLAY"):
+        return None, None
+    xvfb = shutil.which("Xvfb")
+    if not xvfb:
+        return None, "нет DISPLAY и Xvfb не найден"
+    for number in range(99, 120):
+        if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            continue
+        process = subprocess.Popen(
+            [xvfb, f":{number}", "-screen", "0", "1280x800x24", "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for _ in range(50):
+            if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+                os.environ["DISPLAY"] = f":{number}"
+                return process, None
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+        process.kill()
+    return None, "не удалось запустить Xvfb"
+
+
+def pump(app, until=None, timeout=600.0):
+    """Обрабатывает события Tk, пока until() не станет истинным"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        app.root.update()
+        if until is None or until():
+            return
+        if time.perf_counter() > deadline:
+            raise TimeoutError("editor did not settle")
+        time.sleep(0.001)
+
+
+def quit_app(app):
+    """Закрывает редактор без вопросов о сохранении"""
+    for doc in app.documents:
+        doc.modified = False
+    app.exit_app()
+
+
+def bench_editor_file(bench, label, path, ops):
+    """Редактор: открытие, набор, вставка, масштаб, сохранение, закрытие"""
+    app = laba1.TextEditor()
+    pump(app)
+    try:
+        doc = None
+
+        def open_file():
+            nonlocal doc
+            doc = app.open_doc(path)
+            pump(app, lambda: not doc.loading)
+
+        bench.record(f"editor.open.{label}", timed(open_file))
+        if doc.read_only:
+            bench.skip(f"editor.keystroke.{label}", "файл открыт только для чтения")
+        else:
+            widget = doc.text_widget
+            widget.mark_set("insert", "1.0")
+            samples = []
+            for _ in range(ops):
+                samples.append(timed(lambda: (widget.insert("insert", "x"), widget.update_idletasks())))
+            bench.record(f"editor.keystroke.{label}", samples)
+            app.root.clipboard_clear()
+            app.root.clipboard_append("вставка\n" * (128 << 10))
+            bench.record(f"editor.paste_1M.{label}", timed(lambda: (app.paste(), pump(app))))
+            bench.record(f"editor.save.{label}", timed(lambda: app.save_doc(background=False)))
+        bench.record(f"editor.zoom.{label}", [
+            timed(lambda: (zoom(), app.root.update_idletasks()))
+            for zoom in (app.zoom_in, app.zoom_out) * 5
+        ])
+        bench.record(f"editor.close.{label}", timed(lambda: (app.close_doc_by_id(doc.tab_id), pump(app))))
+    finally:
+        quit_app(app)
+
+
+def bench_editor_tabs(bench, workdir, count):
+    """Редактор с count вкладками: пакетное открытие, переключение, закрытие
+    и запуск с восстановлением такого сеанса"""
+    directory = os.path.join(workdir, f"tabs{count}")
+    os.makedirs(directory, exist_ok=True)
+    paths = [make_text_file(os.path.join(directory, f"f{i}.py"), 4 << 10, seed=i)
+             for i in range(count)]
+    app = laba1.TextEditor()
+    pump(app)
+    try:
+        expected = len(app.documents) + count
+        bench.record(f"editor.open_tabs.{count}", timed(
+            lambda: (app.open_files(paths), pump(app, lambda: len(app.documents) >= expected))
+        ))
+        tabs = app.tab_control.tabs()
+        rng = random.Random(2)
+        bench.record(f"editor.tab_switch.{count}", [
+            timed(lambda: (app.tab_control.select(rng.choice(tabs)), pump(app)))
+            for _ in range(min(100, 5 * count))
+        ])
+        app.save_session()
+    finally:
+        quit_app(app)
+
+    # Сеанс с count вкладками записан в рабочий каталог; запуск его восстанавливает
+    started = time.perf_counter()
+    app = laba1.TextEditor()
+    pump(app, lambda: app.current_doc is not None and not app.current_doc.loading)
+    bench.record(f"editor.startup.{count}", time.perf_counter() - started)
+    try:
+        def close_all():
+            for doc in list(app.documents):
+                app.close_doc_by_id(doc.tab_id)
+            pump(app)
+
+        bench.record(f"editor.close_tabs.{count}", timed(close_all))
+    finally:
+        quit_app(app)
+    os.remove(app.session.filename)
+
+
+def compare(results, baseline, tolerance):
+    """Сравнивает медианы с базовыми; возвращает список регрессий"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        now, before = current["median"], base["median"]
+        if now > before * (1 + tolerance) and now - before > NOISE_FLOOR:
+            regressions.append((name, before, now))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности редактора")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="размеры файлов через запятую, например 1K,1M,1G")
+    parser.add_argument("--tabs", default=DEFAULT_TABS,
+                        help="числа вкладок через запятую, например 1,10,100,1000")
+    parser.add_argument("--ops", type=int, default=200, help="нажатий клавиш на замер")
+    parser.add_argument("--output", default="bench.json", help="файл результатов JSON")
+    parser.add_argument("--baseline", help="файл результатов для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="допустимое замедление медианы, доля")
+    parser.add_argument("--headless", action="store_true", help="без замеров TextEditor")
+    args = parser.parse_args(argv)
+
+    sizes = [(label.strip(), parse_size(label)) for label in args.sizes.split(",")]
+    tab_counts = [int(n) for n in args.tabs.split(",")]
+    bench = Bench()
+    workdir = tempfile.mkdtemp(prefix="editor-bench-")
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    xvfb = None
+    try:
+        # Редактор пишет сеанс, журналы и историю в текущий каталог
+        os.chdir(workdir)
+        files = {}
+        for label, size in sizes:
+            files[label] = make_text_file(os.path.join(workdir, f"bench_{label}.py"), size)
+
+        for label, size in sizes:
+            if size <= 64 << 20:
+                with open(files[label], encoding="utf-8") as f:
+                    bench_buffer(bench, label, f.read(), args.ops)
+            else:
+                bench.skip(f"buffer.*.{label}", "файл больше 64M читается только в редакторе")
+            if size < 1 << 30:
+                bench_document(bench, label, files[label], args.ops)
+            else:
+                bench.skip(f"document.*.{label}", "открывается в режиме большого файла")
+        bench_recent(bench, workdir)
+
+        reason = "--headless" if args.headless else None
+        if reason is None:
+            xvfb, reason = start_display()
+        if reason is None:
+            for label, _ in sizes:
+                bench_editor_file(bench, label, files[label], args.ops)
+            for count in tab_counts:
+                bench_editor_tabs(bench, workdir, count)
+        else:
+            bench.skip("editor.*", reason)
+    finally:
+        os.chdir(cwd)
+        if xvfb is not None:
+            xvfb.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "tk": laba1.tk.TkVersion,
+            "sizes": args.sizes,
+            "tabs": args.tabs,
+            "ops": args.ops,
+        },
+        "results": bench.results,
+        "skipped": bench.skipped,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(bench.results, baseline, args.tolerance)
+        for name, before, now in regressions:
+            print(f"РЕГРЕССИЯ {name}: {before * 1000:.3f} мс -> {now * 1000:.3f} мс")
+        if regressions:
+            return 1
+        print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
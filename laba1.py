@@ -1,144 +1,4157 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, font as tkfont
 import os
+import re
 import json
+import keyword
+import builtins
+import bisect
+import codecs
+import ctypes
+import hashlib
+import io
+import mmap
+import queue
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+import multiprocessing
+from functools import lru_cache, wraps
+from array import array
+from itertools import accumulate, islice, repeat
+from operator import add, sub
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Символы вне BMP: Tcl 8.6 считает каждый из них за два символа
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+
+
+@lru_cache(maxsize=None)
+def tcl_astral_width():
+    """Сколько символов Tcl занимает символ вне BMP (2 в Tcl 8.6, 1 в 8.7+)"""
+    return int(tk.Tcl().call("string", "length", "\U0001F600"))
+
+
+def tk_column(line_text, column):
+    """Столбец Tk для позиции column в строке (с учетом символов вне BMP)"""
+    if tcl_astral_width() == 1:
+        return column
+    return column + len(_ASTRAL_RE.findall(line_text, 0, column))
+
+
+def py_column(line_text, column):
+    """Позиция в строке для столбца Tk (с учетом символов вне BMP)"""
+    if tcl_astral_width() == 1:
+        return column
+    pos = tk_pos = 0
+    for match in _ASTRAL_RE.finditer(line_text):
+        start = match.start()
+        if tk_pos + start - pos >= column:
+            break
+        tk_pos += start - pos + 2
+        pos = start + 1
+        if tk_pos >= column:
+            return pos
+    return pos + column - tk_pos
+
+
+def newline_positions(text, base=0):
+    """Возвращает позиции символов перевода строки в тексте"""
+    pos = text.find("\n")
+    while pos != -1:
+        yield base + pos
+        pos = text.find("\n", pos + 1)
+
+
+class TextSource:
+    """Источник текста для таблицы кусков (исходный файл или добавленный текст).
+
+    У блока, прочитанного из файла, line_bytes хранит смещения в байтах
+    начал строк после каждого перевода строки — так позицию в тексте можно
+    перевести в байт исходного файла без перекодирования всего блока.
+    """
+    def __init__(self, text="", line_bytes=None):
+        self.text = text
+        self.newlines = array('q', newline_positions(text))
+        self.line_bytes = line_bytes
+
+    def __len__(self):
+        return len(self.text)
+
+    def append(self, text):
+        """Дописывает текст в конец источника (уже выданные куски не меняются)"""
+        self.newlines.extend(newline_positions(text, len(self.text)))
+        self.text += text
+
+    def count_newlines(self, start, end):
+        """Количество переводов строки в диапазоне [start, end)"""
+        return (bisect.bisect_left(self.newlines, end)
+                - bisect.bisect_left(self.newlines, start))
+
+    def nth_newline(self, start, n):
+        """Позиция n-го (с нуля) перевода строки, начиная с позиции start"""
+        return self.newlines[bisect.bisect_left(self.newlines, start) + n]
+
+    def byte_offset(self, pos, codec):
+        """Смещение позиции в байтах исходного файла от начала блока"""
+        k = bisect.bisect_left(self.newlines, pos)
+        line_start = self.newlines[k - 1] + 1 if k else 0
+        base = self.line_bytes[k - 1] if k else 0
+        return base + len(self.text[line_start:pos].encode(codec))
+
+
+class FenwickTree:
+    """Дерево Фенвика: префиксные суммы с изменением элемента за O(log n)"""
+    def __init__(self, values=()):
+        tree = [0]
+        tree.extend(values)
+        size = len(tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def copy(self):
+        copy = FenwickTree.__new__(FenwickTree)
+        copy.tree = list(self.tree)
+        return copy
+
+    def add(self, index, delta):
+        """Прибавляет delta к элементу index"""
+        tree = self.tree
+        i = index + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def append(self, value):
+        """Добавляет элемент в конец"""
+        i = len(self.tree)
+        # Узел i хранит сумму элементов (i - младший бит i, i]
+        self.tree.append(value + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def prefix(self, count):
+        """Сумма первых count элементов"""
+        tree = self.tree
+        total = 0
+        while count > 0:
+            total += tree[count]
+            count -= count & -count
+        return total
+
+    def search(self, value):
+        """Наибольшее count, при котором prefix(count) <= value, и эта сумма"""
+        tree = self.tree
+        count = total = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            i = count + step
+            if i < len(tree) and total + tree[i] <= value:
+                count = i
+                total += tree[i]
+            step >>= 1
+        return count, total
+
+
+class PieceTable:
+    """Текстовый буфер документа на основе таблицы кусков.
+
+    Текст хранится как список кусков (источник, начало, длина, число строк),
+    разбитый на блоки не длиннее BLOCK_SIZE кусков. Длины и число строк
+    блоков лежат в деревьях Фенвика, поэтому поиск позиции или строки и
+    правка стоят O(log блоков + BLOCK_SIZE), сколько бы кусков ни накопилось.
+    Буфер не зависит от Tk, поэтому его можно тестировать без дисплея.
+    """
+    ADD_SOURCE_LIMIT = 1 << 16
+    BLOCK_SIZE = 128
+
+    def __init__(self, text=""):
+        self.version = 0
+        self.load(text)
+
+    def load(self, text):
+        """Заменяет всё содержимое буфера"""
+        self._add = None
+        # Были ли в буфере символы вне BMP (столбцы Tk тогда не совпадают с позициями)
+        self.astral = _ASTRAL_RE.search(text) is not None
+        self._blocks = [[self._piece(TextSource(text), 0, len(text))]] if text else []
+        self._block_chars = [sum(p[2] for p in block) for block in self._blocks]
+        self._block_lines = [sum(p[3] for p in block) for block in self._blocks]
+        self._reindex()
+        self.version += 1
+
+    def _reindex(self):
+        """Строит деревья сумм заново (после деления или удаления блоков)"""
+        self._chars = FenwickTree(self._block_chars)
+        self._lines = FenwickTree(self._block_lines)
+        self._local = [None] * len(self._blocks)
+        self._length = sum(self._block_chars)
+        self._line_breaks = sum(self._block_lines)
+
+    def _block_index(self, b):
+        """Префиксные суммы длин и строк кусков внутри блока b"""
+        local = self._local[b]
+        if local is None:
+            block = self._blocks[b]
+            local = self._local[b] = (
+                [0, *accumulate(p[2] for p in block)],
+                [0, *accumulate(p[3] for p in block)],
+            )
+        return local
+
+    @staticmethod
+    def _piece(source, start, length):
+        return (source, start, length, source.count_newlines(start, start + length))
+
+    def _locate(self, offset):
+        """Возвращает (номер блока, номер куска в блоке, смещение внутри куска).
+
+        Для конца буфера — позиция после последнего куска.
+        """
+        if offset >= self._length:
+            if not self._blocks:
+                return 0, 0, 0
+            return len(self._blocks) - 1, len(self._blocks[-1]), 0
+        b, before = self._chars.search(offset)
+        starts = self._block_index(b)[0]
+        k = bisect.bisect_right(starts, offset - before) - 1
+        return b, k, offset - before - starts[k]
+
+    def _previous(self, b, k):
+        """Позиция куска перед (b, k) или None"""
+        if k:
+            return b, k - 1
+        if b:
+            return b - 1, len(self._blocks[b - 1]) - 1
+        return None
+
+    def _splice(self, b, k, count, pieces):
+        """Заменяет count кусков блока b начиная с k на pieces"""
+        if not self._blocks:
+            self._replace_blocks(0, 0, pieces)
+            return
+        block = self._blocks[b]
+        chars = lines = 0
+        for piece in block[k:k + count]:
+            chars -= piece[2]
+            lines -= piece[3]
+        for piece in pieces:
+            chars += piece[2]
+            lines += piece[3]
+        block[k:k + count] = pieces
+        if not block or len(block) > 2 * self.BLOCK_SIZE:
+            self._replace_blocks(b, b + 1, block)
+            return
+        self._block_chars[b] += chars
+        self._block_lines[b] += lines
+        self._chars.add(b, chars)
+        self._lines.add(b, lines)
+        self._local[b] = None
+        self._length += chars
+        self._line_breaks += lines
+
+    def _replace_blocks(self, first, last, pieces):
+        """Заменяет блоки [first, last) кусками pieces, нарезанными на блоки"""
+        size = self.BLOCK_SIZE
+        blocks = [pieces[i:i + size] for i in range(0, len(pieces), size)]
+        self._blocks[first:last] = blocks
+        self._block_chars[first:last] = [sum(p[2] for p in block) for block in blocks]
+        self._block_lines[first:last] = [sum(p[3] for p in block) for block in blocks]
+        self._reindex()
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def line_count(self):
+        """Количество строк в буфере"""
+        return self._line_breaks + 1
+
+    def insert(self, offset, text):
+        """Вставляет текст в позицию offset"""
+        if not text:
+            return
+        if not self.astral and _ASTRAL_RE.search(text):
+            self.astral = True
+        offset = max(0, min(offset, len(self)))
+        b, k, inner = self._locate(offset)
+        self.version += 1
+
+        # Набор текста подряд дописывается в предыдущий кусок без создания нового
+        previous = None if inner else self._previous(b, k)
+        if previous:
+            pb, pk = previous
+            source, start, length, lines = self._blocks[pb][pk]
+            if (source is self._add and start + length == len(source)
+                    and len(source) + len(text) <= self.ADD_SOURCE_LIMIT):
+                source.append(text)
+                self._splice(pb, pk, 1, [(source, start, length + len(text),
+                                          lines + text.count("\n"))])
+                return
+
+        if self._add is None or len(self._add) + len(text) > self.ADD_SOURCE_LIMIT:
+            self._add = TextSource()
+        start = len(self._add)
+        self._add.append(text)
+        new_pieces = [self._piece(self._add, start, len(text))]
+
+        if inner:
+            source, p_start, length, _ = self._blocks[b][k]
+            new_pieces.insert(0, self._piece(source, p_start, inner))
+            new_pieces.append(self._piece(source, p_start + inner, length - inner))
+            self._splice(b, k, 1, new_pieces)
+        else:
+            self._splice(b, k, 0, new_pieces)
+
+    def append(self, source):
+        """Дописывает в конец буфера весь текст источника"""
+        if not len(source):
+            return
+        if not self.astral and _ASTRAL_RE.search(source.text):
+            self.astral = True
+        piece = self._piece(source, 0, len(source))
+        self.version += 1
+        if self._blocks and len(self._blocks[-1]) < self.BLOCK_SIZE:
+            self._splice(len(self._blocks) - 1, len(self._blocks[-1]), 0, [piece])
+            return
+        self._blocks.append([piece])
+        self._block_chars.append(piece[2])
+        self._block_lines.append(piece[3])
+        self._chars.append(piece[2])
+        self._lines.append(piece[3])
+        self._local.append(None)
+        self._length += piece[2]
+        self._line_breaks += piece[3]
+
+    def delete(self, offset, length):
+        """Удаляет length символов начиная с позиции offset"""
+        total = len(self)
+        offset = max(0, offset)
+        end = min(offset + length, total)
+        if offset >= end:
+            return
+        b1, k1, a = self._locate(offset)
+        b2, k2, c = self._locate(end)
+        self.version += 1
+
+        new_pieces = []
+        if a:
+            source, start, _, _ = self._blocks[b1][k1]
+            new_pieces.append(self._piece(source, start, a))
+        if c:
+            source, start, p_length, _ = self._blocks[b2][k2]
+            new_pieces.append(self._piece(source, start + c, p_length - c))
+            k2 += 1
+        if b1 == b2:
+            self._splice(b1, k1, k2 - k1, new_pieces)
+        else:
+            # Удаление через несколько блоков: оставшиеся куски собираются заново
+            pieces = self._blocks[b1][:k1] + new_pieces + self._blocks[b2][k2:]
+            self._replace_blocks(b1, b2 + 1, pieces)
+
+    def iter_chunks(self, start=0, end=None):
+        """Последовательно выдаёт фрагменты текста из диапазона [start, end)"""
+        total = len(self)
+        end = total if end is None else min(end, total)
+        if start >= end:
+            return
+        b, k, inner = self._locate(start)
+        pos = start
+        while pos < end:
+            block = self._blocks[b]
+            if k == len(block):
+                b += 1
+                k = 0
+                continue
+            source, p_start, length, _ = block[k]
+            take = min(length - inner, end - pos)
+            yield source.text[p_start + inner:p_start + inner + take]
+            pos += take
+            k += 1
+            inner = 0
+
+    def iter_pieces(self):
+        """Выдает куски буфера как (источник, начало, длина)"""
+        for block in self._blocks:
+            for source, start, length, _ in block:
+                yield source, start, length
+
+    def get_text(self, start=0, end=None):
+        """Возвращает текст из диапазона [start, end)"""
+        return "".join(self.iter_chunks(start, end))
+
+    def snapshot(self):
+        """Возвращает неизменяемую копию буфера за O(число кусков).
+
+        Источники только дописываются, поэтому копия может безопасно
+        читаться из другого потока, пока исходный буфер редактируется.
+        """
+        copy = PieceTable.__new__(PieceTable)
+        copy._blocks = [list(block) for block in self._blocks]
+        copy._block_chars = list(self._block_chars)
+        copy._block_lines = list(self._block_lines)
+        copy._chars = self._chars.copy()
+        copy._lines = self._lines.copy()
+        copy._local = list(self._local)
+        copy._length = self._length
+        copy._line_breaks = self._line_breaks
+        copy._add = None
+        copy.astral = self.astral
+        copy.version = self.version
+        return copy
+
+    def line_start(self, line):
+        """Смещение начала строки line (нумерация с нуля)"""
+        if line <= 0:
+            return 0
+        if line >= self.line_count:
+            return len(self)
+        k = line - 1
+        b, before = self._lines.search(k)
+        starts, lines = self._block_index(b)
+        i = bisect.bisect_right(lines, k - before) - 1
+        source, start, _, _ = self._blocks[b][i]
+        pos = source.nth_newline(start, k - before - lines[i])
+        return self._chars.prefix(b) + starts[i] + pos - start + 1
+
+    def tk_offset(self, line, column):
+        """Смещение для строки и столбца индекса Tk"""
+        if self.astral and line < self.line_count:
+            column = py_column(self.line_text(line), column)
+        return self.offset_of(line, column)
+
+    def tk_position(self, offset):
+        """Строка и столбец индекса Tk для смещения"""
+        line, column = self.position_of(offset)
+        if self.astral:
+            column = tk_column(self.get_text(offset - column, offset), column)
+        return line, column
+
+    def offset_of(self, line, column):
+        """Переводит (строка, столбец) в смещение, с ограничением по концу строки"""
+        if line >= self.line_count:
+            return len(self)
+        start = self.line_start(line)
+        return min(start + column, self.line_start(line + 1) - 1
+                   if line + 1 < self.line_count else len(self))
+
+    def position_of(self, offset):
+        """Переводит смещение в (строка, столбец)"""
+        offset = max(0, min(offset, len(self)))
+        b, k, inner = self._locate(offset)
+        if b < len(self._blocks) and k < len(self._blocks[b]):
+            source, start, _, _ = self._blocks[b][k]
+            line = (self._lines.prefix(b) + self._block_index(b)[1][k]
+                    + source.count_newlines(start, start + inner))
+        else:
+            line = self._line_breaks
+        return line, offset - self.line_start(line)
+
+    def line_text(self, line):
+        """Возвращает текст строки без перевода строки"""
+        start = self.line_start(line)
+        if line + 1 < self.line_count:
+            return self.get_text(start, self.line_start(line + 1) - 1)
+        return self.get_text(start)
+
+
+class TextView:
+    """Представление документа в виджете tk.Text.
+
+    Перехватывает команды insert/delete/replace виджета (в том числе ввод с
+    клавиатуры и отмену Tk) и повторяет их в буфере документа, так что буфер
+    всегда совпадает с содержимым виджета.
+    """
+    def __init__(self, text_widget, document=None, scrollbar=None, container=None):
+        self.widget = text_widget
+        self.document = document
+        self.scrollbar = scrollbar
+        self.container = container
+        self._orig = text_widget._w + "_orig"
+        text_widget.tk.call("rename", text_widget._w, self._orig)
+        text_widget.tk.createcommand(text_widget._w, self._dispatch)
+        self._defaults = {
+            option: text_widget.cget(option) for option in ("wrap", "state", "yscrollcommand")
+        }
+        if scrollbar is not None:
+            self._defaults["scrollbar"] = scrollbar.cget("command")
+
+    def reset(self):
+        """Возвращает виджету исходные настройки перед повторным использованием"""
+        options = dict(self._defaults)
+        scroll_command = options.pop("scrollbar", None)
+        self.widget.config(**options)
+        if scroll_command is not None:
+            self.scrollbar.config(command=scroll_command)
+
+    def save_state(self):
+        """Запоминает курсор и прокрутку"""
+        return {
+            "cursor": self.raw("index", "insert"),
+            "yview": self.widget.yview()[0],
+        }
+
+    def restore_state(self, state):
+        """Восстанавливает курсор и прокрутку"""
+        if state:
+            self.widget.mark_set(tk.INSERT, state["cursor"])
+            self.widget.yview_moveto(state["yview"])
+
+    def raw(self, *args):
+        """Выполняет команду виджета без синхронизации с буфером"""
+        return self.widget.tk.call((self._orig,) + args)
+
+    def render(self, text):
+        """Показывает текст в виджете, не затрагивая буфер"""
+        self.raw("delete", "1.0", "end")
+        self.raw("insert", "1.0", text)
+        self.raw("edit", "modified", 0)
+
+    def offset(self, index):
+        """Переводит индекс Tk в смещение в буфере"""
+        line, column = map(int, self.raw("index", index).split("."))
+        return self.document.buffer.tk_offset(line - 1, column)
+
+    def _delete_range(self, index1, index2, end_line):
+        """Диапазон смещений, который Tk фактически удалит командой delete"""
+        line1, column1 = map(int, self.raw("index", index1).split("."))
+        line2 = int(self.raw("index", index2).split(".")[0])
+        buffer = self.document.buffer
+        start = buffer.tk_offset(line1 - 1, column1)
+        end = self.offset(index2)
+        # Удаление целых строк до конца текста Tk расширяет на предыдущий
+        # перевод строки, чтобы сохранить завершающую пустую строку
+        if line2 == end_line and line1 != line2 and column1 == 0 and line1 > 1:
+            start -= 1
+        return start, end
+
+    def _dispatch(self, command, *args):
+        if (self.document is None or command not in ("insert", "delete", "replace")
+                or str(self.raw("cget", "-state")) == tk.DISABLED):
+            return self.raw(command, *args)
+
+        document = self.document
+        if command == "insert":
+            offset = self.offset(args[0])
+            result = self.raw(command, *args)
+            document.insert_text(offset, "".join(args[1::2]))
+            return result
+
+        end_line = int(self.raw("index", "end").split(".")[0])
+        if command == "delete":
+            ranges = []
+            for k in range(0, len(args), 2):
+                index2 = args[k + 1] if k + 1 < len(args) else f"{args[k]} +1c"
+                start, end = self._delete_range(args[k], index2, end_line)
+                if start < end:
+                    ranges.append((start, end))
+            result = self.raw(command, *args)
+            for start, end in sorted(_merge_ranges(ranges), reverse=True):
+                document.delete_text(start, end)
+            return result
+
+        start, end = self._delete_range(args[0], args[1], end_line)
+        result = self.raw(command, *args)
+        if start < end:
+            document.delete_text(start, end)
+        document.insert_text(start, "".join(args[2::2]))
+        return result
+
+
+class TextViewPool:
+    """Ограниченный пул текстовых представлений.
+
+    Виджет tk.Text создается для документа только при первой активации
+    вкладки; когда пул заполнен, представление самой давно неактивной
+    вкладки отвязывается от документа (курсор и прокрутка запоминаются,
+    история отмены хранится в самом документе) и переиспользуется.
+    Документы, которые грузятся, открыты в режиме большого файла или
+    заняты долгой правкой, не вытесняются.
+    """
+    def __init__(self, factory, capacity=10):
+        self.factory = factory
+        self.capacity = capacity
+        self.active = OrderedDict()
+        self.free = []
+
+    @property
+    def views(self):
+        """Все созданные представления"""
+        return list(self.active.values()) + self.free
+
+    def acquire(self, doc):
+        """Возвращает представление документа, при необходимости создавая его"""
+        if doc.view is not None:
+            self.active.move_to_end(doc)
+            return doc.view
+        if self.free:
+            view = self.free.pop()
+        elif len(self.active) < self.capacity:
+            view = self.factory()
+        else:
+            view = self._evict() or self.factory()
+        doc.attach_view(view)
+        self.active[doc] = view
+        return view
+
+    def release(self, doc):
+        """Возвращает представление закрытого документа в пул"""
+        view = self.active.pop(doc, None)
+        if view is not None:
+            doc.detach_view()
+            view.reset()
+            self.free.append(view)
+
+    def _evict(self):
+        candidates = [doc for doc in self.active
+                      if not doc.loading and not doc.read_only and doc.bulk is None][:-1]
+        if not candidates:
+            return None
+        doc = candidates[0]
+        view = self.active.pop(doc)
+        doc.detach_view()
+        view.reset()
+        return view
+
+
+def _merge_ranges(ranges):
+    """Объединяет пересекающиеся диапазоны"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class UndoGroup:
+    """Шаг отмены: список правок [смещение, удаленный текст, вставленный текст]"""
+    __slots__ = ("ops",)
+
+    OVERHEAD = 64
+
+    def __init__(self, ops=None):
+        self.ops = ops or []
+
+    @property
+    def size(self):
+        """Оценка занимаемой памяти"""
+        return sum(len(removed) + len(inserted) + self.OVERHEAD for _, removed, inserted in self.ops)
+
+
+class UndoHistory:
+    """История отмены документа.
+
+    Хранит компактные правки относительно буфера, склеивает набор текста
+    и удаление по одному символу в один шаг и ограничена объемом хранимого
+    текста, а не числом шагов. Может сохраняться в отдельный файл и
+    восстанавливаться при повторном открытии документа.
+    """
+    MERGE_TIMEOUT = 1.0
+
+    def __init__(self, max_bytes=8 << 20):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+        self.applying = False
+        self.saved = None
+        self._group = None
+        self._depth = 0
+        self._can_merge = False
+        self._last_time = 0.0
+
+    def clear(self):
+        """Очищает историю (например, после загрузки файла)"""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.size = 0
+        self.saved = None
+        self._can_merge = False
+
+    def separator(self):
+        """Запрещает склеивать следующую правку с предыдущей"""
+        self._can_merge = False
+
+    def begin_group(self):
+        """Начинает группу правок, которая отменяется одним шагом"""
+        if self._depth == 0:
+            self._group = UndoGroup()
+        self._depth += 1
+
+    def end_group(self):
+        """Завершает группу правок"""
+        self._depth -= 1
+        if self._depth == 0:
+            group, self._group = self._group, None
+            if group.ops:
+                self._push(group)
+            self._can_merge = False
+
+    def discard_group(self):
+        """Завершает группу правок, не добавляя ее в историю"""
+        self._depth -= 1
+        if self._depth == 0:
+            self._group = None
+            self._can_merge = False
+
+    def mark_saved(self):
+        """Запоминает текущее состояние как сохраненное"""
+        self.saved = self.undo_stack[-1] if self.undo_stack else None
+        self._can_merge = False
+
+    def mark_unsaved(self):
+        """Отмечает, что ни одно состояние истории не совпадает с файлом"""
+        self.saved = UndoGroup()
+
+    def at_saved(self):
+        """Совпадает ли текущее состояние с сохраненным"""
+        return (self.undo_stack[-1] if self.undo_stack else None) is self.saved
+
+    def record(self, offset, removed, inserted):
+        """Записывает правку буфера"""
+        if self.applying:
+            return
+        if self.redo_stack:
+            self.redo_stack.clear()
+        op = [offset, removed, inserted]
+        if self._group is not None:
+            self._group.ops.append(op)
+            return
+        now = time.monotonic()
+        if (self._can_merge and self.undo_stack
+                and now - self._last_time < self.MERGE_TIMEOUT
+                and self._merge(self.undo_stack[-1], op)):
+            self.size += len(removed) + len(inserted)
+            self._trim()
+        else:
+            self._push(UndoGroup([op]))
+            self._can_merge = True
+        self._last_time = now
+
+    @staticmethod
+    def _merge(group, op):
+        """Склеивает набор или удаление по символу с последней правкой"""
+        if len(group.ops) != 1:
+            return False
+        last = group.ops[0]
+        offset, removed, inserted = op
+        if not removed and not last[1] and len(inserted) == 1 and inserted != "\n":
+            # Набор текста подряд; пробел после слова начинает новый шаг
+            if offset != last[0] + len(last[2]):
+                return False
+            if inserted.isspace() and not last[2][-1].isspace():
+                return False
+            last[2] += inserted
+            return True
+        if not inserted and not last[2] and len(removed) == 1 and removed != "\n":
+            if offset + 1 == last[0]:  # Backspace
+                last[0] = offset
+                last[1] = removed + last[1]
+                return True
+            if offset == last[0]:  # Delete
+                last[1] += removed
+                return True
+        return False
+
+    def _push(self, group):
+        self.undo_stack.append(group)
+        self.size += group.size
+        self._trim()
+
+    def _trim(self):
+        # Самые старые шаги вытесняются, пока история не уложится в лимит;
+        # последний шаг остается всегда, даже если он один больше лимита
+        while self.size > self.max_bytes and len(self.undo_stack) > 1:
+            group = self.undo_stack.popleft()
+            self.size -= group.size
+            # Сохраненное состояние вытеснено — к нему уже не вернуться
+            if self.saved is None or self.saved is group:
+                self.mark_unsaved()
+
+    def pop_undo(self):
+        """Снимает шаг для отмены; его правки применяются в обратную сторону"""
+        if not self.undo_stack:
+            return None
+        group = self.undo_stack.pop()
+        self.size -= group.size
+        self.redo_stack.append(group)
+        self._can_merge = False
+        return group
+
+    def pop_redo(self):
+        """Снимает шаг для повтора"""
+        if not self.redo_stack:
+            return None
+        group = self.redo_stack.pop()
+        self.undo_stack.append(group)
+        self.size += group.size
+        self._can_merge = False
+        return group
+
+    def to_dict(self):
+        """Представление истории для сохранения в JSON"""
+        return {
+            "undo": [group.ops for group in self.undo_stack],
+            "redo": [group.ops for group in self.redo_stack],
+        }
+
+    def load_dict(self, data):
+        """Восстанавливает историю из сохраненного представления"""
+        self.clear()
+        for ops in data.get("undo", []):
+            self._push(UndoGroup([list(op) for op in ops]))
+        self.redo_stack = [UndoGroup([list(op) for op in ops]) for ops in data.get("redo", [])]
+        self.mark_saved()
+
+
+# Каталог, где хранится история отмены закрытых файлов
+UNDO_DIR = 'undo_history'
+
+
+def undo_sidecar_path(filepath):
+    """Путь к файлу истории отмены для документа"""
+    key = hashlib.sha1(os.path.realpath(filepath).encode('utf-8', 'surrogatepass')).hexdigest()
+    return os.path.join(UNDO_DIR, key + ".json")
+
+
+# Кодировка, которой читаются файлы, не являющиеся корректным UTF-8
+FALLBACK_ENCODING = 'cp1251'
+SNIFF_SIZE = 1 << 16
+
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def sniff_encoding(prefix):
+    """Определяет кодировку по началу файла: BOM, затем UTF-8, иначе запасная"""
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        prefix.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Ошибка в последних байтах полного префикса — это оборванный
+        # многобайтовый символ; короче префикс только у файла целиком
+        if e.reason != "unexpected end of data" or len(prefix) < SNIFF_SIZE:
+            return FALLBACK_ENCODING
+    return 'utf-8'
+
+
+def is_binary(prefix):
+    """Похоже ли начало файла на двоичные данные"""
+    if any(prefix.startswith(bom) for bom, _ in _BOMS):
+        return False
+    return b"\0" in prefix
+
+
+def is_binary_file(filepath):
+    """Похож ли файл на двоичный по его началу"""
+    with open(filepath, 'rb') as f:
+        return is_binary(f.read(SNIFF_SIZE))
+
+
+# Кодеки без BOM для записи текста после BOM, по самому BOM
+_BOM_CODECS = {
+    codecs.BOM_UTF8: 'utf-8',
+    codecs.BOM_UTF16_LE: 'utf-16-le',
+    codecs.BOM_UTF16_BE: 'utf-16-be',
+    codecs.BOM_UTF32_LE: 'utf-32-le',
+    codecs.BOM_UTF32_BE: 'utf-32-be',
+}
+_DEFAULT_BOMS = {
+    'utf-8-sig': codecs.BOM_UTF8,
+    'utf-16': codecs.BOM_UTF16_LE,
+    'utf-32': codecs.BOM_UTF32_LE,
+}
+# Переводы строк в кодировках, совместимых с ASCII
+_LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+
+
+class TextFormat:
+    """Формат текста в файле: кодировка, BOM и перевод строки"""
+    __slots__ = ("encoding", "codec", "bom", "newline")
+
+    def __init__(self, encoding='utf-8', newline="\n", bom=None):
+        self.encoding = encoding
+        self.newline = newline
+        self.bom = _DEFAULT_BOMS.get(encoding, b"") if bom is None else bom
+        self.codec = _BOM_CODECS.get(self.bom, encoding)
+
+    @classmethod
+    def detect(cls, encoding, prefix):
+        """Формат для кодировки, определенной по началу файла"""
+        for bom, name in _BOMS:
+            if name == encoding and prefix.startswith(bom):
+                return cls(encoding, bom=bom)
+        return cls(encoding, bom=b"")
+
+    @property
+    def ascii_compatible(self):
+        """Совпадают ли байты переводов строк с ASCII"""
+        return not self.codec.startswith(('utf-16', 'utf-32'))
+
+    def encode(self, text):
+        """Кодирует текст буфера со стилем перевода строк файла"""
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        return text.encode(self.codec)
+
+
+class FileDecoder:
+    """Инкрементальный декодер файла, выдающий текст целыми строками.
+
+    Для кодировок, совместимых с ASCII, параллельно ищет переводы строк
+    в исходных байтах, и каждый выданный блок знает, с какого байта файла
+    начинается каждая его строка. Это позволяет при сохранении копировать
+    неизмененный текст прямо из файла. Стиль перевода строк определяется
+    по прочитанному тексту и доступен в format после последнего блока.
+    """
+    # Строка без переводов длиннее этого выдается частями без раскладки
+    MAX_PENDING = 4 << 20
+
+    def __init__(self, encoding, prefix):
+        self.format = TextFormat.detect(encoding, prefix)
+        self.decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(encoding)(), translate=True
+        )
+        self.scan = self.format.ascii_compatible
+        self.breaks = deque()  # Байты начал строк, еще не выданных
+        self.pending = ""
+        self.start = len(self.format.bom)  # Байт начала pending (None, если неизвестен)
+        self.offset = 0
+        self.cr = None
+
+    def feed(self, data, final=False):
+        """Декодирует блок байтов; возвращает (текст, первый байт, байт после
+        конца, байты начал строк после каждого перевода строки) или None"""
+        if self.scan:
+            self._scan(data, final)
+        self.offset += len(data)
+        text = self.pending + self.decoder.decode(data, final)
+        cut = len(text) if final else text.rfind("\n") + 1
+        if not cut and len(text) > self.MAX_PENDING:
+            cut = len(text)
+        chunk, self.pending = text[:cut], text[cut:]
+        if final:
+            newlines = self.decoder.newlines
+            if isinstance(newlines, tuple):
+                newlines = "\r\n" if "\r\n" in newlines else "\n"
+            self.format.newline = newlines or "\n"
+        if not chunk:
+            return None
+        starts = [self.breaks.popleft() for _ in range(chunk.count("\n"))] if self.scan else []
+        start, end, line_bytes = self.start, None, None
+        if chunk.endswith("\n") and starts:
+            end = self.start = starts[-1]
+        else:
+            self.start = None
+            if start is not None and self.scan:
+                tail = chunk[chunk.rfind("\n") + 1:]
+                end = (starts[-1] if starts else start) + len(tail.encode(self.format.codec))
+        if start is None or end is None:
+            return chunk, None, None, None
+        line_bytes = array('q', (s - start for s in starts))
+        return chunk, start, end, line_bytes
+
+    def _scan(self, data, final):
+        base = self.offset
+        positions = [base + m.end() for m in _LINE_BREAK_RE.finditer(data)]
+        # \r в конце прошлого блока мог быть началом \r\n
+        if self.cr is not None:
+            if not data.startswith(b"\n"):
+                self.breaks.append(self.cr)
+            self.cr = None
+        if data.endswith(b"\r") and not final:
+            self.cr = positions.pop()
+        self.breaks.extend(positions)
+
+
+def read_text_file(filepath):
+    """Читает и декодирует файл целиком; выполняется в рабочем потоке.
+
+    Возвращает (признаки версии, формат, блок текста с раскладкой по байтам)
+    или None для двоичных файлов.
+    """
+    signature = file_signature(filepath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    if is_binary(data[:SNIFF_SIZE]):
+        return None
+    encoding = sniff_encoding(data[:SNIFF_SIZE])
+    decoder = FileDecoder(encoding, data[:SNIFF_SIZE])
+    try:
+        chunk = decoder.feed(data, final=True)
+    except UnicodeDecodeError:
+        # Как и FileLoader: UTF-8, угаданный по началу, не подтвердился
+        if encoding != 'utf-8':
+            raise
+        decoder = FileDecoder(FALLBACK_ENCODING, data[:SNIFF_SIZE])
+        chunk = decoder.feed(data, final=True)
+    return signature, decoder.format, chunk
+
+
+class FileLoader:
+    """Потоковая загрузка файла в документ.
+
+    Фоновый поток читает файл блоками и декодирует их инкрементальным
+    декодером, а главный цикл Tk забирает готовые блоки через after()
+    и дописывает их в буфер и виджет, не блокируя интерфейс.
+    """
+    CHUNK_SIZE = 1 << 20
+    CHUNKS_PER_TICK = 4
+    POLL_MS = 15
+
+    def __init__(self, document, filepath, on_progress=None, on_done=None):
+        self.document = document
+        self.filepath = filepath
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.queue = queue.Queue(maxsize=16)
+        self.cancelled = threading.Event()
+        self.total = 0
+        self.loaded = 0
+        self.format = None
+
+    def start(self):
+        """Запускает загрузку"""
+        self.total = os.path.getsize(self.filepath)
+        threading.Thread(target=self._read, daemon=True).start()
+        self.document.master.after(self.POLL_MS, self._poll)
+
+    def cancel(self):
+        """Прерывает загрузку"""
+        self.cancelled.set()
+
+    def _put(self, item):
+        # Ограниченная очередь не даёт читателю уйти далеко вперёд интерфейса
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        """Чтение и декодирование файла (выполняется в фоновом потоке)"""
+        try:
+            with open(self.filepath, 'rb') as f:
+                prefix = f.read(SNIFF_SIZE)
+                encoding = sniff_encoding(prefix)
+                try:
+                    self._decode(f, encoding, prefix)
+                except UnicodeDecodeError:
+                    # UTF-8 угадан по началу файла, а дальше встретились байты
+                    # не из него: читаем файл заново запасной кодировкой
+                    if encoding != 'utf-8' or not self._put(("restart", None, None)):
+                        raise
+                    self._decode(f, FALLBACK_ENCODING, prefix)
+            self._put(("done", None, None))
+        except Exception as e:
+            self._put(("error", e, None))
+
+    def _decode(self, f, encoding, prefix):
+        """Декодирует файл с начала и отдает блоки в очередь"""
+        f.seek(0)
+        decoder = FileDecoder(encoding, prefix)
+        while not self.cancelled.is_set():
+            data = f.read(self.CHUNK_SIZE)
+            chunk = decoder.feed(data, final=not data)
+            if not self._put(("chunk", chunk, f.tell())) or not data:
+                break
+        self.format = decoder.format
+
+    def _poll(self):
+        """Переносит прочитанные блоки в документ (выполняется в потоке Tk)"""
+        if self.cancelled.is_set():
+            self._finish(False)
+            return
+        for _ in range(self.CHUNKS_PER_TICK):
+            try:
+                kind, payload, position = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "chunk":
+                if payload:
+                    self.document.append_loaded(*payload)
+                self.loaded = position
+            elif kind == "restart":
+                self.document.restart_loading()
+                self.loaded = 0
+            elif kind == "done":
+                self.document.format = self.format
+                self.document.image.format = self.format
+                self._finish(True)
+                return
+            else:
+                messagebox.showerror("Ошибка", f"Не удалось открыть файл: {payload}")
+                self._finish(False)
+                return
+        if self.on_progress:
+            self.on_progress(self.loaded / self.total if self.total else 1.0)
+        self.document.master.after(self.POLL_MS, self._poll)
+
+    def _finish(self, success):
+        self.document.end_loading(success)
+        if self.on_done:
+            self.on_done(success)
+
+
+class LineIndex:
+    """Индекс смещений начал строк файла, отображенного в память.
+
+    Строится блоками в фоновом потоке; пока построение идет, доступны уже
+    найденные строки, а общее число строк оценивается по прочитанной доле.
+    Текст начинается с байта start (после BOM), newline — перевод строки
+    в кодировке файла.
+    """
+    BLOCK_SIZE = 8 << 20
+
+    def __init__(self, data, start=0, newline=b"\n"):
+        self.data = data
+        self.size = len(data)
+        self.start = start
+        self.newline = newline
+        self.offsets = array('Q', [start])
+        self.scanned = 0
+        self.done = False
+        self.cancelled = threading.Event()
+
+    def build(self):
+        """Строит индекс (выполняется в фоновом потоке)"""
+        pos = self.start
+        try:
+            while pos < self.size and not self.cancelled.is_set():
+                block = self.data[pos:pos + self.BLOCK_SIZE]
+                if len(self.newline) == 1:
+                    parts = block.split(self.newline)
+                    # Начала строк — накопленные длины частей плюс переводы строк
+                    starts = accumulate(map(add, map(len, parts[:-1]), repeat(1)), initial=pos)
+                    self.offsets.extend(islice(starts, 1, None))
+                else:
+                    self.offsets.extend(self._unit_breaks(block, pos))
+                pos += len(block)
+                self.scanned = pos
+        except (ValueError, OSError):
+            return
+        self.done = not self.cancelled.is_set()
+
+    def _unit_breaks(self, block, base):
+        """Начала строк в блоке кодировки с многобайтовыми единицами (UTF-16/32).
+
+        Блоки начинаются на границе единицы, поэтому перевод строки засчитывается
+        только на кратном ей смещении и не может попасть на стык блоков.
+        """
+        unit = len(self.newline)
+        pos = block.find(self.newline)
+        while pos != -1:
+            if pos % unit:
+                pos = block.find(self.newline, pos + 1)
+                continue
+            yield base + pos + unit
+            pos = block.find(self.newline, pos + unit)
+
+    @property
+    def line_count(self):
+        """Количество строк, границы которых уже известны"""
+        return len(self.offsets) if self.done else len(self.offsets) - 1
+
+    @property
+    def estimated_lines(self):
+        """Оценка общего числа строк"""
+        if self.done or not self.scanned:
+            return max(self.line_count, 1)
+        return max(int(len(self.offsets) * self.size / self.scanned), self.line_count, 1)
+
+    def line_range(self, line):
+        """Байтовый диапазон строки без перевода строки"""
+        start = self.offsets[line]
+        if line + 1 < len(self.offsets):
+            return start, self.offsets[line + 1] - len(self.newline)
+        return start, self.size
+
+
+class LargeFileViewport:
+    """Режим большого файла: только для чтения, файл отображается в память.
+
+    В виджете находится лишь окно строк вокруг видимой области, полоса
+    прокрутки управляется индексом строк, а не содержимым виджета.
+    """
+    WINDOW_LINES = 400
+    EDGE = 0.2
+    MAX_LINE_BYTES = 16384
+    POLL_MS = 200
+    STATUS = "Большой файл (только чтение): {} строк"
+
+    def __init__(self, document, filepath, on_status=None):
+        self.document = document
+        self.path = filepath
+        self.on_status = on_status
+        self.widget = None
+        self.scrollbar = None
+        with open(filepath, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        prefix = self.data[:SNIFF_SIZE]
+        self.format = TextFormat.detect(sniff_encoding(prefix), prefix)
+        self.index = LineIndex(self.data, len(self.format.bom), "\n".encode(self.format.codec))
+        self.first = 0
+        self.last = 0
+        self._rendering = False
+        threading.Thread(target=self.index.build, daemon=True).start()
+
+    def start(self):
+        """Начинает показ в представлении документа (при его появлении)"""
+        self.widget = self.document.text_widget
+        self.scrollbar = self.document.scrollbar
+        self.first = self.last = 0
+        self.widget.config(wrap=tk.NONE, state=tk.DISABLED, yscrollcommand=self.on_widget_scroll)
+        if self.scrollbar:
+            self.scrollbar.config(command=self.on_scrollbar)
+        self._poll()
+
+    def close(self):
+        """Освобождает отображение файла"""
+        self.index.cancelled.set()
+        self.data.close()
+
+    def _poll(self):
+        # Представление вытеснили из пула — показ продолжится при новом
+        if self.index.cancelled.is_set() or self.document.view is None:
+            return
+        if self.first == self.last or self.last < self.WINDOW_LINES:
+            self.render(self.first)
+        self._update_scrollbar()
+        if self.on_status:
+            if self.index.done:
+                self.on_status(self.STATUS.format(self.index.line_count))
+            else:
+                self.on_status(f"Индексация строк: {self.index.scanned / self.index.size:.0%}")
+        if not self.index.done:
+            self.document.master.after(self.POLL_MS, self._poll)
+
+    def _line_text(self, line):
+        start, end = self.index.line_range(line)
+        text = self.data[start:min(end, start + self.MAX_LINE_BYTES)].decode(
+            self.format.codec, errors='replace'
+        )
+        return text if end - start <= self.MAX_LINE_BYTES else text + " …"
+
+    def render(self, first):
+        """Загружает в виджет окно строк, начиная с first"""
+        total = self.index.line_count
+        first = max(0, min(int(first), total - self.WINDOW_LINES))
+        last = min(total, first + self.WINDOW_LINES)
+        text = "\n".join(self._line_text(i) for i in range(first, last))
+        self._rendering = True
+        try:
+            self.widget.config(state=tk.NORMAL)
+            self.document.view.raw("delete", "1.0", "end")
+            self.document.view.raw("insert", "1.0", text)
+            self.widget.config(state=tk.DISABLED)
+        finally:
+            self._rendering = False
+        self.first, self.last = first, last
+
+    def scroll_to_line(self, line):
+        """Прокручивает так, чтобы строка line оказалась вверху"""
+        if not self.first <= line < self.last - self.WINDOW_LINES * self.EDGE:
+            self.render(line - self.WINDOW_LINES // 2)
+        span = max(self.last - self.first, 1)
+        self.widget.yview_moveto((line - self.first) / span)
+
+    def on_scrollbar(self, *args):
+        """Команда полосы прокрутки"""
+        if args and args[0] == "moveto":
+            self.scroll_to_line(int(float(args[1]) * self.index.estimated_lines))
+        else:
+            self.widget.yview(*args)
+
+    def on_widget_scroll(self, lo, hi):
+        """Сдвигает окно строк, когда видимая область подходит к его краю"""
+        if self._rendering:
+            return
+        lo, hi = float(lo), float(hi)
+        span = max(self.last - self.first, 1)
+        top = self.first + lo * span
+        near_start = lo < self.EDGE and self.first > 0
+        near_end = hi > 1 - self.EDGE and self.last < self.index.line_count
+        if near_start or near_end:
+            self.render(top - self.WINDOW_LINES // 2)
+            span = max(self.last - self.first, 1)
+            self.widget.yview_moveto((top - self.first) / span)
+            return
+        self._update_scrollbar(lo, hi)
+
+    def _update_scrollbar(self, lo=None, hi=None):
+        if not self.scrollbar:
+            return
+        if lo is None:
+            lo, hi = self.widget.yview()
+        span = max(self.last - self.first, 1)
+        total = self.index.estimated_lines
+        self.scrollbar.set((self.first + lo * span) / total, (self.first + hi * span) / total)
+
+
+class DisplayRows:
+    """Разбиение текста буфера на экранные строки фиксированной ширины.
+
+    Строки длиннее WIDTH делятся мягкими переносами, которые существуют
+    только на экране. Интерфейс совпадает с LineIndex, поэтому окно строк
+    LargeFileViewport работает и поверх буфера в памяти.
+    """
+    def __init__(self, buffer, width):
+        self.buffer = buffer
+        self.width = width
+        self.size = len(buffer)
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.scanned = 0
+        self.done = False
+        self.cancelled = threading.Event()
+
+    def build(self):
+        """Строит разбиение по снимку буфера (выполняется в фоновом потоке)"""
+        pos = 0
+        line_start = 0
+        for source, start, length in self.buffer.iter_pieces():
+            if self.cancelled.is_set():
+                return
+            first = bisect.bisect_left(source.newlines, start)
+            last = bisect.bisect_left(source.newlines, start + length)
+            for newline in source.newlines[first:last]:
+                line_end = pos + newline - start
+                self._add_line(line_start, line_end)
+                line_start = line_end + 1
+            pos += length
+            self.scanned = pos
+        self._add_line(line_start, pos)
+        self.done = True
+
+    def _add_line(self, start, end):
+        width = self.width
+        self.starts.extend(range(start, max(end, start + 1), width))
+        self.ends.extend(range(start + width, end, width))
+        self.ends.append(end)
+
+    @property
+    def line_count(self):
+        """Количество уже разбитых экранных строк"""
+        return len(self.ends)
+
+    @property
+    def estimated_lines(self):
+        """Оценка общего числа экранных строк"""
+        if self.done or not self.scanned:
+            return max(self.line_count, 1)
+        return max(int(self.line_count * self.size / self.scanned), 1)
+
+    def line_range(self, row):
+        """Диапазон смещений буфера, показанный в экранной строке"""
+        return self.starts[row], self.ends[row]
+
+
+class SoftBreakViewport(LargeFileViewport):
+    """Режим длинных строк для минифицированных и однострочных файлов.
+
+    Tk раскладывает логическую строку целиком, и строка в несколько
+    мегабайт делает прокрутку непригодной. В этом режиме виджет без
+    переноса показывает окно экранных строк шириной не больше WIDTH,
+    поэтому ни по вертикали, ни по горизонтали Tk не раскладывает больше
+    видимого. Буфер документа не меняется и сохраняется как есть. Чтобы
+    править документ, пользователь подтверждает переход к обычному показу
+    (TextEditor.unlock_soft_breaks).
+    """
+    # Строка длиннее этого включает режим длинных строк: на таких строках
+    # раскладка Tk тормозит заметно
+    LONG_LINE = 1 << 18
+    WIDTH = 160
+    STATUS = "Длинные строки (только просмотр): {} экранных строк"
+
+    def __init__(self, document, on_status=None):
+        self.document = document
+        self.path = document.filepath
+        self.on_status = on_status
+        self.widget = None
+        self.scrollbar = None
+        self.buffer = document.buffer.snapshot()
+        self.index = DisplayRows(self.buffer, self.WIDTH)
+        self.first = 0
+        self.last = 0
+        self._rendering = False
+        threading.Thread(target=self.index.build, daemon=True).start()
+
+    def close(self):
+        """Прерывает разбиение на экранные строки"""
+        self.index.cancelled.set()
+
+    def _line_text(self, row):
+        return self.buffer.get_text(*self.index.line_range(row))
+
+    def offset(self, index):
+        """Смещение в буфере для индекса Tk в окне экранных строк"""
+        line, column = map(int, self.document.view.raw("index", index).split("."))
+        row = min(self.first + line - 1, self.index.line_count - 1)
+        if row < 0:
+            return 0
+        start, end = self.index.line_range(row)
+        if self.buffer.astral:
+            column = py_column(self._line_text(row), column)
+        return min(start + column, end)
+
+
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="editor")
+# Пул для параллельного чтения файлов при открытии нескольких сразу
+_readers = ThreadPoolExecutor(max_workers=8, thread_name_prefix="reader")
+
+
+def run_in_background(master, func, on_done, poll_ms=20):
+    """Выполняет func в рабочем потоке и передает Future в on_done в потоке Tk"""
+    future = _background.submit(func)
+
+    def poll():
+        if future.done():
+            on_done(future)
+        else:
+            master.after(poll_ms, poll)
+
+    master.after(poll_ms, poll)
+    return future
+
+
+@lru_cache(maxsize=64)
+def compile_pattern(text, regex=False, ignore_case=False):
+    """Компилирует шаблон поиска (скомпилированные шаблоны кэшируются)"""
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    return re.compile(text if regex else re.escape(text), flags)
+
+
+class SearchEngine:
+    """Поиск и замена по тексту: обычная строка или регулярное выражение"""
+    def __init__(self):
+        self.pattern = None
+        self.regex = False
+
+    def set_pattern(self, text, regex=False, ignore_case=False):
+        """Задает шаблон поиска; при ошибке в выражении бросает re.error"""
+        self.pattern = compile_pattern(text, regex, ignore_case) if text else None
+        self.regex = regex
+
+    def search(self, text, start, backwards=False):
+        """Ищет ближайшее совпадение от позиции start с переходом через край"""
+        if self.pattern is None:
+            return None
+        if backwards:
+            last = None
+            for match in self.pattern.finditer(text, 0, start):
+                if match.end() > match.start():
+                    last = match
+            if last is None:
+                for match in self.pattern.finditer(text, start):
+                    if match.end() > match.start():
+                        last = match
+            return (last.start(), last.end()) if last else None
+        for begin in (start, 0):
+            for match in self.pattern.finditer(text, begin):
+                if match.end() > match.start():
+                    return match.start(), match.end()
+        return None
+
+    def iter_matches(self, text, limit=None):
+        """Выдает непустые совпадения в тексте"""
+        count = 0
+        for match in self.pattern.finditer(text):
+            if match.end() > match.start():
+                yield match
+                count += 1
+                if limit and count >= limit:
+                    return
+
+    def expand(self, match, replacement):
+        """Текст замены для совпадения"""
+        return match.expand(replacement) if self.regex else replacement
+
+    def replace_all(self, text, replacement):
+        """Готовит замену всех совпадений.
+
+        Возвращает список (начало, конец, новый текст) по порядку совпадений;
+        пустой, если совпадений нет.
+        """
+        return [
+            (match.start(), match.end(), self.expand(match, replacement))
+            for match in self.iter_matches(text)
+        ]
+
+
+def file_keys(filepath):
+    """Ключи, по которым один и тот же файл узнается под разными путями"""
+    keys = [("path", os.path.normcase(os.path.realpath(filepath)))]
+    try:
+        stat = os.stat(filepath)
+        keys.append(("inode", stat.st_dev, stat.st_ino))
+    except OSError:
+        pass
+    return keys
+
+
+class DocumentRegistry:
+    """Реестр открытых документов.
+
+    Документы хранятся по идентификатору вкладки блокнота, а для проверки
+    «файл уже открыт» есть индекс по нормализованному пути и по inode,
+    так что поиск, закрытие и проверка дубликатов выполняются за O(1).
+    """
+    def __init__(self):
+        self.by_tab = {}
+        self.by_file = {}
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.by_tab)
+
+    def __iter__(self):
+        return iter(list(self.by_tab.values()))
+
+    def __contains__(self, doc):
+        return self.by_tab.get(doc.tab_id) is doc
+
+    def add(self, tab_id, doc):
+        """Регистрирует документ открытой вкладки"""
+        doc.tab_id = tab_id
+        self.by_tab[tab_id] = doc
+        self.reindex(doc)
+
+    def remove(self, doc):
+        """Удаляет документ из реестра"""
+        self.by_tab.pop(doc.tab_id, None)
+        self._unindex(doc)
+
+    def get(self, tab_id):
+        """Возвращает документ вкладки"""
+        return self.by_tab.get(str(tab_id))
+
+    def last(self):
+        """Последний добавленный документ"""
+        return next(reversed(self.by_tab.values()), None)
+
+    def find(self, filepath):
+        """Возвращает документ, в котором уже открыт этот файл"""
+        for key in file_keys(filepath):
+            doc = self.by_file.get(key)
+            if doc is not None:
+                return doc
+        return None
+
+    def reindex(self, doc):
+        """Обновляет индекс путей после смены имени файла документа"""
+        self._unindex(doc)
+        if doc.has_name:
+            self.keys[doc] = file_keys(doc.filepath)
+            for key in self.keys[doc]:
+                self.by_file[key] = doc
+
+    def _unindex(self, doc):
+        for key in self.keys.pop(doc, ()):
+            if self.by_file.get(key) is doc:
+                del self.by_file[key]
+
 
 class Document:
     """Класс для представления документа"""
-    def __init__(self, master, text_widget, filepath=None):
+    def __init__(self, master, text_widget=None, filepath=None):
         self.master = master
-        self.text_widget = text_widget
         self.filepath = filepath
         self.modified = False
-        self.tab_index = None
-        
-    @property
-    def has_name(self):
-        """Проверяет, есть ли у документа имя файла"""
-        return self.filepath is not None and self.filepath != ""
+        self.tab_id = None
+        self.frame = None
+        self.buffer = PieceTable()
+        self.history = UndoHistory()
+        self.listeners = [self._record_edit]
+        self.highlighter = None
+        self.format = TextFormat()
+        self.image = None  # Раскладка файла на диске по источникам буфера
+        self.pending_cursor = None
+        self.pending_yview = None
+        self.deferred = False  # Файл загрузится при первой активации вкладки
+        self.disk_stat = None  # Версия файла на диске, которой соответствует буфер
+        self.saving = 0  # Число незавершенных фоновых сохранений
+        self.follow = False  # Режим слежения за концом файла (tail -f)
+        self.view = None
+        self.view_state = None
+        self.loader = None
+        self.bulk = None  # Долгая правка, применяемая частями
+        self.large = None
+        self.soft_breaks = None  # Режим длинных строк
+        self.longest_line = 0  # Длина самой длинной строки загруженного текста
+        self.line_tail = 0  # Длина незавершенной последней строки при загрузке
+        if text_widget is not None:
+            self.attach_view(TextView(text_widget))
+        
+    @property
+    def text_widget(self):
+        """Виджет документа или None, если вкладка еще не активировалась"""
+        return self.view.widget if self.view else None
+    
+    @property
+    def scrollbar(self):
+        """Полоса прокрутки представления документа"""
+        return self.view.scrollbar if self.view else None
+    
+    @property
+    def cursor(self):
+        """Позиция курсора в формате индекса Tk"""
+        if self.view and self.soft_breaks:
+            return self.index_of(self.soft_breaks.offset(tk.INSERT))
+        if self.view:
+            return self.text_widget.index(tk.INSERT)
+        return self.view_state["cursor"] if self.view_state else "1.0"
+    
+    def index_of(self, offset):
+        """Переводит смещение в буфере в индекс Tk"""
+        line, column = self.buffer.tk_position(offset)
+        return f"{line + 1}.{column}"
+    
+    def attach_view(self, view):
+        """Связывает документ с представлением и показывает в нем текст"""
+        view.document = self
+        self.view = view
+        # Режимы большого файла и длинных строк сами заполняют виджет
+        viewport = self.large or self.soft_breaks
+        if viewport is None:
+            view.render(self.buffer.get_text())
+        if self.frame is not None and view.container is not None:
+            view.container.pack(in_=self.frame, fill=tk.BOTH, expand=True)
+            view.container.lift()
+        if viewport is not None:
+            viewport.start()
+            return
+        view.restore_state(self.view_state)
+        if self.highlighter:
+            self.highlighter.reset_tags()
+    
+    def detach_view(self):
+        """Отвязывает представление, запоминая курсор и прокрутку"""
+        if self.view is None:
+            return
+        self.view_state = self.view.save_state()
+        if self.soft_breaks:
+            self.view_state["cursor"] = self.cursor
+        if self.view.container is not None:
+            self.view.container.pack_forget()
+        self.view.document = None
+        self.view = None
+        
+    @property
+    def has_name(self):
+        """Проверяет, есть ли у документа имя файла"""
+        return self.filepath is not None and self.filepath != ""
+    
+    @property
+    def short_name(self):
+        """Возвращает короткое имя файла для отображения на вкладке"""
+        if self.has_name:
+            return os.path.basename(self.filepath)
+        return "Без имени"
+    
+    @property
+    def full_name(self):
+        """Возвращает полное имя файла"""
+        return self.filepath if self.has_name else "Без имени"
+    
+    @property
+    def encoding(self):
+        """Кодировка файла документа"""
+        return self.format.encoding
+
+    @encoding.setter
+    def encoding(self, encoding):
+        self.format = TextFormat(encoding)
+
+    def get_text(self):
+        """Возвращает текст документа из буфера"""
+        return self.buffer.get_text()
+
+    def set_text(self, text):
+        """Заменяет текст документа и обновляет представление"""
+        self.buffer.load(text)
+        self.image = None
+        self.longest_line = self.line_tail = 0
+        self.history.clear()
+        if self.soft_breaks:
+            self.leave_soft_breaks()
+        elif self.view:
+            self.view.render(text)
+        if self.highlighter:
+            self.highlighter.reset()
+
+    def insert_text(self, offset, text):
+        """Вставляет текст в буфер и уведомляет подписчиков правок"""
+        if not text:
+            return
+        self.buffer.insert(offset, text)
+        for listener in self.listeners:
+            listener(self, offset, "", text)
+
+    def delete_text(self, start, end):
+        """Удаляет диапазон из буфера и уведомляет подписчиков правок"""
+        removed = self.buffer.get_text(start, end) if self.listeners else ""
+        self.buffer.delete(start, end - start)
+        for listener in self.listeners:
+            listener(self, start, removed, "")
+
+    def _record_edit(self, doc, offset, removed, inserted):
+        self.history.record(offset, removed, inserted)
+
+    def replace_range(self, start, end, text):
+        """Заменяет диапазон текста через представление (или прямо в буфере)"""
+        if self.soft_breaks:
+            self.leave_soft_breaks()
+        if self.view:
+            first = self.index_of(start)
+            if start < end:
+                self.text_widget.delete(first, self.index_of(end))
+            if text:
+                self.text_widget.insert(first, text)
+        else:
+            if start < end:
+                self.delete_text(start, end)
+            self.insert_text(start, text)
+
+    def replace_matches(self, matches):
+        """Заменяет диапазоны (начало, конец, текст) одним шагом отмены.
+
+        Каждое совпадение заменяется отдельно, с конца, чтобы смещения
+        остальных не сдвигались, а в истории был только измененный текст.
+        """
+        self.history.begin_group()
+        try:
+            for start, end, text in reversed(matches):
+                self.replace_range(start, end, text)
+        finally:
+            self.history.end_group()
+
+    def undo(self):
+        """Отменяет последний шаг правки"""
+        return self._apply_history(self.history.pop_undo(), undo=True)
+
+    def redo(self):
+        """Повторяет отмененный шаг правки"""
+        return self._apply_history(self.history.pop_redo(), undo=False)
+
+    def _apply_history(self, group, undo):
+        if group is None:
+            return False
+        self.history.applying = True
+        try:
+            if undo:
+                for offset, removed, inserted in reversed(group.ops):
+                    self.replace_range(offset, offset + len(inserted), removed)
+                cursor = group.ops[0][0] + len(group.ops[0][1])
+            else:
+                for offset, removed, inserted in group.ops:
+                    self.replace_range(offset, offset + len(removed), inserted)
+                cursor = group.ops[-1][0] + len(group.ops[-1][2])
+        finally:
+            self.history.applying = False
+        if self.view:
+            self.text_widget.mark_set(tk.INSERT, self.index_of(cursor))
+            self.text_widget.see(tk.INSERT)
+        self.modified = not self.history.at_saved()
+        return True
+
+    def save_history(self):
+        """Сохраняет историю отмены неизмененного документа в файл"""
+        if not self.has_name or self.modified or not self.history.undo_stack:
+            return
+        try:
+            stat = os.stat(self.filepath)
+            data = dict(self.history.to_dict(), size=stat.st_size, mtime=stat.st_mtime)
+            os.makedirs(UNDO_DIR, exist_ok=True)
+            write_atomic(undo_sidecar_path(self.filepath), [json.dumps(data, ensure_ascii=False)])
+        except (OSError, ValueError):
+            pass
+
+    def load_history(self):
+        """Восстанавливает историю, если файл не менялся с момента ее записи"""
+        try:
+            with open(undo_sidecar_path(self.filepath), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            stat = os.stat(self.filepath)
+        except (OSError, ValueError):
+            return False
+        if data.get("size") != stat.st_size or data.get("mtime") != stat.st_mtime:
+            return False
+        self.history.load_dict(data)
+        return True
+
+    def set_highlighter(self, highlighter):
+        """Включает или выключает подсветку синтаксиса"""
+        if self.highlighter:
+            self.listeners.remove(self.highlighter.on_edit)
+            self.highlighter.clear()
+        self.highlighter = highlighter
+        if highlighter:
+            self.listeners.append(highlighter.on_edit)
+            highlighter.reset()
+
+    def open_file(self, filepath):
+        """Открывает файл"""
+        try:
+            result = read_text_file(filepath)
+            if result is None:
+                raise ValueError("двоичный файл")
+            self.open_loaded(filepath, *result)
+            return True
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл: {e}")
+            return False
+    
+    @property
+    def loading(self):
+        """Идёт ли фоновая загрузка файла"""
+        return self.loader is not None
+
+    def open_file_async(self, filepath, on_progress=None, on_done=None):
+        """Открывает файл в фоновом режиме, не блокируя интерфейс"""
+        try:
+            self.disk_stat = file_signature(filepath)
+            self.loader = FileLoader(self, filepath, on_progress, on_done)
+            self.set_text("")
+            self.image = FileImage(filepath, signature=self.disk_stat)
+            self.filepath = filepath
+            if self.view:
+                self.text_widget.config(state=tk.DISABLED)
+            self.loader.start()
+            return True
+        except Exception as e:
+            self.loader = None
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл: {e}")
+            return False
+
+    @property
+    def read_only(self):
+        """Открыт ли документ только для чтения"""
+        return self.large is not None
+
+    @property
+    def long_lines(self):
+        """Есть ли в загруженном тексте строки, опасные для раскладки Tk"""
+        return self.longest_line >= SoftBreakViewport.LONG_LINE
+
+    def open_large(self, filepath, on_status=None):
+        """Открывает очень большой файл в режиме просмотра через mmap"""
+        try:
+            self.large = LargeFileViewport(self, filepath, on_status)
+            self.format = self.large.format
+            self.filepath = filepath
+            self.modified = False
+            # Документ пакетного открытия получит представление при активации
+            if self.view:
+                self.large.start()
+            return True
+        except Exception as e:
+            self.large = None
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл: {e}")
+            return False
+
+    def open_soft_breaks(self, on_status=None):
+        """Показывает загруженный документ в режиме длинных строк"""
+        self.soft_breaks = SoftBreakViewport(self, on_status)
+        if self.view:
+            self.soft_breaks.start()
+
+    def leave_soft_breaks(self):
+        """Возвращает обычный показ документа (перед правкой).
+
+        Виджет остается без переноса: перенос строки в мегабайты Tk
+        раскладывает дольше всего.
+        """
+        viewport, self.soft_breaks = self.soft_breaks, None
+        if viewport is None:
+            return
+        viewport.close()
+        if self.view:
+            cursor = viewport.offset(tk.INSERT)
+            selection = [viewport.offset(index) for index in self.text_widget.tag_ranges(tk.SEL)]
+            self.view.reset()
+            self.text_widget.config(wrap=tk.NONE)
+            self.view.render(self.buffer.get_text())
+            if selection:
+                self.text_widget.tag_add(tk.SEL, *map(self.index_of, selection))
+            self.text_widget.mark_set(tk.INSERT, self.index_of(cursor))
+            self.text_widget.see(tk.INSERT)
+            if self.highlighter:
+                self.highlighter.reset_tags()
+
+    def close(self):
+        """Освобождает ресурсы документа"""
+        self.cancel_loading()
+        if self.bulk:
+            self.bulk.stop()
+        if self.large:
+            self.large.close()
+            self.large = None
+        if self.soft_breaks:
+            self.soft_breaks.close()
+            self.soft_breaks = None
+
+    def _append_source(self, text, byte_start, byte_end, line_bytes):
+        """Дописывает в буфер блок файла, запоминая его место в файле"""
+        source = TextSource(text, line_bytes)
+        self._measure_lines(source)
+        self.buffer.append(source)
+        if byte_start is not None and self.image is not None:
+            self.image.add(source, 0, len(text), byte_start, byte_end)
+
+    def _measure_lines(self, source):
+        """Обновляет длину самой длинной строки по новому блоку"""
+        newlines = source.newlines
+        if not newlines:
+            self.line_tail += len(source)
+            self.longest_line = max(self.longest_line, self.line_tail)
+            return
+        inner = max(map(sub, newlines[1:], newlines), default=1) - 1
+        self.longest_line = max(self.longest_line, self.line_tail + newlines[0], inner)
+        self.line_tail = len(source) - newlines[-1] - 1
+        self.longest_line = max(self.longest_line, self.line_tail)
+
+    def restart_loading(self):
+        """Отбрасывает уже загруженный текст, чтобы загрузить файл заново"""
+        if self.view:
+            self.text_widget.config(state=tk.NORMAL)
+        self.set_text("")
+        self.image = FileImage(self.filepath, signature=self.disk_stat)
+        if self.view:
+            self.text_widget.config(state=tk.DISABLED)
+
+    def append_loaded(self, text, byte_start=None, byte_end=None, line_bytes=None):
+        """Дописывает загруженный блок текста в конец документа"""
+        if not text:
+            return
+        was_long = self.long_lines
+        self._append_source(text, byte_start, byte_end, line_bytes)
+        if self.view and not was_long:
+            self.text_widget.config(state=tk.NORMAL)
+            if self.long_lines:
+                # Дальше текст покажет режим длинных строк после загрузки
+                self.view.raw("delete", "1.0", "end")
+            else:
+                self.view.raw("insert", "end-1c", text)
+            self.text_widget.config(state=tk.DISABLED)
+
+    def append_from_disk(self, text):
+        """Дописывает текст, появившийся в конце файла (режим слежения).
+
+        Документ остается соответствующим файлу, поэтому правка не попадает
+        ни в историю отмены, ни в журнал восстановления.
+        """
+        offset = len(self.buffer)
+        self.buffer.insert(offset, text)
+        if self.view:
+            self.view.raw("insert", "end-1c", text)
+        if self.highlighter:
+            self.highlighter.on_edit(self, offset, "", text)
+
+    def open_loaded(self, filepath, signature, fmt, chunk):
+        """Заполняет документ текстом файла, прочитанным в фоне"""
+        self.set_text("")
+        self.filepath = filepath
+        self.format = fmt
+        self.disk_stat = signature
+        self.image = FileImage(filepath, fmt, signature)
+        if chunk:
+            self._append_source(*chunk)
+            if self.view and not self.long_lines:
+                self.view.render(chunk[0])
+            if self.highlighter:
+                self.highlighter.reset()
+        self.modified = False
+
+    def end_loading(self, success):
+        """Завершает фоновую загрузку"""
+        self.loader = None
+        self.history.clear()
+        if self.view:
+            self.text_widget.config(state=tk.NORMAL)
+            self.view.raw("edit", "modified", 0)
+        self.modified = False
+
+    def cancel_loading(self):
+        """Прерывает фоновую загрузку, если она идёт"""
+        if self.loader:
+            self.loader.cancel()
+
+    def save_file(self, saver=None, on_done=None):
+        """Сохраняет файл (в фоне, если передан saver)"""
+        if not self.has_name:
+            return False
+        return self._write(self.filepath, saver, on_done)
+    
+    def save_as(self, filepath, saver=None, on_done=None):
+        """Сохраняет файл с новым именем"""
+        if self.large:
+            try:
+                shutil.copyfile(self.large.path, filepath)
+                self.filepath = filepath
+                return True
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {e}")
+                return False
+        if self._write(filepath, saver, on_done):
+            self.filepath = filepath
+            return True
+        return False
+
+    def _write(self, filepath, saver, on_done):
+        """Записывает снимок буфера в файл"""
+        snapshot = self.buffer.snapshot()
+        # Неизмененные участки копируются байтами из прочитанного файла
+        image = FileImage(filepath, self.format)
+        chunks = encode_snapshot(snapshot, self.format, self.image, image)
+        if saver is None:
+            try:
+                write_atomic(filepath, chunks, None)
+                self.disk_stat = image.signature = file_signature(filepath)
+                self.image = image
+                self.modified = False
+                self.history.mark_saved()
+                return True
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {e}")
+                return False
+
+        def done(error):
+            self.saving -= 1
+            if error is not None:
+                self.modified = True
+                self.history.mark_unsaved()
+                messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {error}")
+            else:
+                self.disk_stat = image.signature = file_signature(filepath)
+                self.image = image
+            if on_done:
+                on_done(error is None)
+
+        # Документ считается сохраненным сразу: правки после снимка снова
+        # пометят его измененным, а при ошибке записи пометка вернется
+        self.modified = False
+        self.history.mark_saved()
+        self.saving += 1
+        saver.save(filepath, chunks, done)
+        return True
+
+
+def write_atomic(filepath, chunks, encoding='utf-8'):
+    """Атомарно записывает текст (или байты при encoding=None):
+    временный файл, fsync и os.replace"""
+    # Через символическую ссылку пишем в ее цель, а не заменяем саму ссылку
+    filepath = os.path.realpath(filepath)
+    directory = os.path.dirname(filepath)
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix="." + os.path.basename(filepath) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, 'w' if encoding else 'wb', encoding=encoding) as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, temp_path)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FileImage:
+    """Раскладка файла на диске по источникам текста буфера.
+
+    Запоминает, какие участки каких источников с какого байта лежат в файле.
+    При сохранении такие участки копируются байтами из этого файла, поэтому
+    кодировка, BOM и переводы строк в них остаются в точности исходными,
+    а перекодируется только текст, добавленный пользователем.
+    """
+    COPY_SIZE = 1 << 20
+
+    def __init__(self, filepath, fmt=None, signature=None):
+        self.filepath = filepath
+        self.format = fmt
+        self.signature = signature
+        self.segments = {}  # источник -> [(начало, конец, первый байт, байт после конца)]
+
+    def add(self, source, start, end, byte_start, byte_end):
+        """Отмечает, что участок источника лежит в файле в [byte_start, byte_end)"""
+        segments = self.segments.setdefault(source, [])
+        if segments and segments[-1][1] == start and segments[-1][3] == byte_start:
+            segments[-1] = (segments[-1][0], end, segments[-1][2], byte_end)
+        else:
+            bisect.insort(segments, (start, end, byte_start, byte_end))
+
+    def find(self, source, start, end):
+        """Байты файла, где лежит участок источника, или None"""
+        segments = self.segments.get(source)
+        if not segments:
+            return None
+        i = bisect.bisect_right(segments, (start, float("inf"))) - 1
+        if i < 0 or segments[i][1] < end:
+            return None
+        seg_start, seg_end, byte_start, byte_end = segments[i]
+        if start == seg_start and end == seg_end:
+            return byte_start, byte_end
+        codec = self.format.codec
+        base = byte_start - source.byte_offset(seg_start, codec)
+        return base + source.byte_offset(start, codec), base + source.byte_offset(end, codec)
+
+
+def encode_snapshot(snapshot, fmt, image, new_image):
+    """Выдает байты снимка буфера для записи; выполняется в рабочем потоке.
+
+    Участки, которые лежат в файле image без изменений, копируются из него,
+    остальной текст кодируется. В new_image собирается раскладка нового файла.
+    """
+    if image is not None and (image.format is not fmt
+                              or file_signature(image.filepath) != image.signature):
+        image = None  # Файл изменили извне — копировать из него нельзя
+    original = open(image.filepath, 'rb') if image is not None else None
+    try:
+        yield fmt.bom
+        position = len(fmt.bom)
+        for source, start, length in snapshot.iter_pieces():
+            end = start + length
+            span = image.find(source, start, end) if image is not None else None
+            if span is None:
+                data = fmt.encode(source.text[start:end])
+                yield data
+                position += len(data)
+                continue
+            original.seek(span[0])
+            remaining = span[1] - span[0]
+            while remaining:
+                data = original.read(min(remaining, FileImage.COPY_SIZE))
+                if not data:
+                    raise OSError(f"Файл {image.filepath} изменился во время записи")
+                yield data
+                remaining -= len(data)
+            new_image.add(source, start, end, position, position + span[1] - span[0])
+            position += span[1] - span[0]
+    finally:
+        if original is not None:
+            original.close()
+
+
+class BackgroundSaver:
+    """Фоновая запись документов на диск.
+
+    Запись выполняется в рабочем потоке; повторные сохранения одного файла,
+    поставленные до начала записи, объединяются в одно с последним снимком.
+    Результат возвращается в поток Tk через after().
+    """
+    POLL_MS = 50
+
+    def __init__(self, master):
+        self.master = master
+        self.pending = {}
+        self.busy = False
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+        self.outstanding = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def save(self, filepath, chunks, on_done, encoding=None):
+        """Ставит содержимое документа в очередь на запись.
+
+        chunks — ленивый итератор фрагментов (байтов при encoding=None),
+        он вычисляется уже в рабочем потоке.
+        """
+        with self.condition:
+            if filepath in self.pending:
+                _, _, callbacks = self.pending.pop(filepath)
+            else:
+                callbacks = []
+            callbacks.append(on_done)
+            self.pending[filepath] = (chunks, encoding, callbacks)
+            self.condition.notify()
+        if not self.outstanding:
+            self.master.after(self.POLL_MS, self._poll)
+        self.outstanding += 1
+
+    def flush(self):
+        """Дожидается завершения всех поставленных записей"""
+        with self.condition:
+            while self.pending or self.busy:
+                self.condition.wait()
+        self._deliver()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                filepath = next(iter(self.pending))
+                chunks, encoding, callbacks = self.pending.pop(filepath)
+                self.busy = True
+            try:
+                write_atomic(filepath, chunks, encoding)
+                error = None
+            except Exception as e:
+                error = e
+            self.results.put((callbacks, error))
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def _deliver(self):
+        while True:
+            try:
+                callbacks, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            for callback in callbacks:
+                self.outstanding -= 1
+                callback(error)
+
+    def _poll(self):
+        self._deliver()
+        if self.outstanding:
+            self.master.after(self.POLL_MS, self._poll)
+
+
+def file_signature(filepath):
+    """Признаки версии файла на диске: (устройство, inode, mtime, размер)"""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class Inotify:
+    """Минимальная обертка над inotify (Linux) через ctypes.
+
+    Следит за каталогами, а не за файлами: атомарная запись и git checkout
+    заменяют файл новым inode, и наблюдение за старым потерялось бы.
+    """
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+            | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    @classmethod
+    def create(cls):
+        """Возвращает обертку или None, если inotify недоступен"""
+        # На других системах ctypes.CDLL(None) падает с TypeError
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError, TypeError):
+            return None
+
+    def add(self, directory):
+        """Начинает следить за каталогом; возвращает дескриптор наблюдения"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch", directory)
+        return wd
+
+    def remove(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Ждет событий; возвращает множество дескрипторов, где они были"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        wds = set()
+        if not ready:
+            return wds
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return wds
+        pos = 0
+        while pos + self.EVENT.size <= len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, pos)
+            wds.add(wd)
+            pos += self.EVENT.size + length
+        return wds
+
+
+class FileWatcher:
+    """Отслеживание изменений открытых файлов другими программами.
+
+    Один рабочий поток хранит для каждого пути признаки версии файла и
+    сравнивает их с текущими: по событиям inotify для каталогов, где они
+    есть, и периодическим опросом всех путей разом в остальных случаях.
+    Для путей в режиме слежения (tail -f) дописанные в конец байты читаются
+    и декодируются прямо в потоке. Изменения передаются в поток Tk через
+    after(): on_change(путь, старые признаки, новые признаки, дописанный текст).
+    """
+    POLL_MS = 200
+    POLL_INTERVAL = 1.0
+    # При работающем inotify полный опрос нужен только для сетевых дисков
+    FULL_POLL_INTERVAL = 10.0
+    FOLLOW_LIMIT = 16 << 20
+
+    def __init__(self, master, on_change):
+        self.master = master
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.paths = {}  # путь -> [признаки, слежение, кодировка, декодер]
+        self.dirs = {}  # каталог -> [дескриптор наблюдения, число путей]
+        self.results = queue.Queue()
+        self.stopped = False
+        self.inotify = Inotify.create()
+        threading.Thread(target=self._run, daemon=True).start()
+        self.master.after(self.POLL_MS, self._poll)
+
+    def watch(self, filepath, signature, follow=False, encoding='utf-8'):
+        """Начинает (или продолжает) следить за файлом с известной версией"""
+        with self.lock:
+            if filepath not in self.paths:
+                self._add_dir(os.path.dirname(os.path.abspath(filepath)))
+            self.paths[filepath] = [signature, follow, encoding, None]
+
+    def unwatch(self, filepath):
+        """Прекращает следить за файлом"""
+        with self.lock:
+            if self.paths.pop(filepath, None) is not None:
+                self._remove_dir(os.path.dirname(os.path.abspath(filepath)))
+
+    def stop(self):
+        """Останавливает рабочий поток"""
+        self.stopped = True
+
+    def _add_dir(self, directory):
+        entry = self.dirs.get(directory)
+        if entry is None:
+            wd = None
+            if self.inotify:
+                try:
+                    wd = self.inotify.add(directory)
+                except OSError:
+                    pass
+            entry = self.dirs[directory] = [wd, 0]
+        entry[1] += 1
+
+    def _remove_dir(self, directory):
+        entry = self.dirs[directory]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.dirs[directory]
+            if entry[0] is not None:
+                self.inotify.remove(entry[0])
+
+    def _run(self):
+        last_full = 0.0
+        while not self.stopped:
+            if self.inotify:
+                wds = self.inotify.read(self.POLL_INTERVAL)
+            else:
+                time.sleep(self.POLL_INTERVAL)
+                wds = set()
+            full = time.monotonic() - last_full >= self.FULL_POLL_INTERVAL
+            if full:
+                last_full = time.monotonic()
+            with self.lock:
+                # Каталоги, за которыми inotify не следит, опрашиваются всегда
+                changed = {d for d, (wd, _) in self.dirs.items() if wd is None or wd in wds}
+                items = [(path, list(state)) for path, state in self.paths.items()
+                         if full or self.inotify is None
+                         or os.path.dirname(os.path.abspath(path)) in changed]
+            for path, (old, follow, encoding, decoder) in items:
+                new = file_signature(path)
+                if new == old:
+                    continue
+                appended = None
+                if follow and old and new and old[:2] == new[:2] and 0 < new[3] - old[3] <= self.FOLLOW_LIMIT:
+                    appended, decoder = self._read_appended(path, old[3], new[3], encoding, decoder)
+                with self.lock:
+                    state = self.paths.get(path)
+                    if state is None or state[0] != old:
+                        continue  # Путь перестали отслеживать или обновили из Tk
+                    state[0] = new
+                    state[3] = decoder
+                self.results.put((path, old, new, appended))
+
+    @staticmethod
+    def _read_appended(path, start, end, encoding, decoder):
+        """Читает и декодирует только байты, дописанные в конец файла"""
+        if decoder is None:
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder(encoding)(errors='replace'), translate=True
+            )
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start)
+        except OSError:
+            return None, None
+        if len(data) != end - start:
+            return None, None
+        return decoder.decode(data), decoder
+
+    def _poll(self):
+        while True:
+            try:
+                change = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.on_change(*change)
+        if not self.stopped:
+            self.master.after(self.POLL_MS, self._poll)
+
+
+# Каталог журналов восстановления несохраненных документов
+JOURNAL_DIR = 'recovery'
+
+
+class RecoveryJournal:
+    """Журнал восстановления несохраненных документов.
+
+    Правки каждого документа дописываются в журнал на диске; время от
+    времени записывается полный снимок, и журнал начинается заново от него.
+    В потоке Tk правка только ставится в очередь, а запись пачками выполняет
+    рабочий поток. После аварийного завершения документ восстанавливается
+    из снимка (или исходного файла) повтором правок из журнала.
+    """
+    FLUSH_INTERVAL = 0.5
+    CHECKPOINT_BYTES = 1 << 20
+
+    def __init__(self, directory=JOURNAL_DIR):
+        self.directory = directory
+        self.owner = f"{os.getpid()}-{time.time_ns()}"
+        self.entries = {}  # документ -> [имя журнала, байт после снимка]
+        self.counter = 0
+        self.queue = queue.Queue()
+        self.wakeup = threading.Event()
+        self.lock_file = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Блокировка показывает другим экземплярам, что журналы заняты
+            self.lock_file = open(self._path(self.owner + ".lock"), 'w')
+            if fcntl:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            pass
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def on_edit(self, doc, offset, removed, inserted):
+        """Подписчик правок документа; вызывается в потоке Tk"""
+        if doc.loading or doc.read_only:
+            return
+        entry = self.entries.get(doc)
+        if entry is None:
+            # Первая правка: основой служит файл на диске или пустой текст
+            entry = self._open(doc)
+            self.queue.put(("start", entry[0], self._header(doc), None))
+        self.queue.put(("edit", entry[0], [offset, len(removed), inserted], None))
+        entry[1] += len(removed) + len(inserted)
+        # Порог растет с документом, чтобы объем снимков оставался
+        # пропорциональным объему правок
+        if entry[1] >= max(self.CHECKPOINT_BYTES, len(doc.buffer)):
+            self.checkpoint(doc)
+
+    def checkpoint(self, doc):
+        """Записывает полный снимок документа и начинает журнал заново"""
+        entry = self.entries.get(doc) or self._open(doc)
+        entry[1] = 0
+        header = dict(self._header(doc), base="snapshot")
+        self.queue.put(("checkpoint", entry[0], header, doc.buffer.snapshot()))
+
+    def discard(self, doc):
+        """Удаляет журнал документа (после сохранения или закрытия)"""
+        entry = self.entries.pop(doc, None)
+        if entry is not None:
+            self.queue.put(("discard", entry[0], None, None))
+
+    def flush(self):
+        """Дожидается записи всех поставленных в очередь правок"""
+        self.wakeup.set()
+        self.queue.join()
+
+    def close(self):
+        """Записывает очередь и снимает блокировку при штатном выходе"""
+        self.flush()
+        if self.lock_file:
+            self.lock_file.close()
+            try:
+                os.remove(self._path(self.owner + ".lock"))
+            except OSError:
+                pass
+
+    def _open(self, doc):
+        self.counter += 1
+        entry = self.entries[doc] = [f"{self.owner}-{self.counter}", 0]
+        return entry
+
+    @staticmethod
+    def _header(doc):
+        return {
+            "path": doc.filepath,
+            "encoding": doc.encoding,
+            "base": "file" if doc.has_name else "empty",
+        }
+
+    def _run(self):
+        logs = {}
+        while True:
+            batch = [self.queue.get()]
+            # Собираем правки за интервал, чтобы писать их одной пачкой
+            self.wakeup.wait(self.FLUSH_INTERVAL)
+            self.wakeup.clear()
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Снимок заменяет все, что было в журнале до него, поэтому из
+            # пачки пишется только последний снимок каждого журнала
+            last_restart = {
+                item[1]: i for i, item in enumerate(batch) if item[0] in ("start", "checkpoint")
+            }
+            touched = set()
+            for i, (kind, name, data, snapshot) in enumerate(batch):
+                if kind != "discard" and i < last_restart.get(name, -1):
+                    continue
+                try:
+                    if kind == "edit":
+                        if name in logs:
+                            logs[name].write(json.dumps(data, ensure_ascii=False) + "\n")
+                            touched.add(name)
+                    elif kind == "discard":
+                        self._remove(logs.pop(name, None), name)
+                    else:
+                        logs[name] = self._restart(logs.pop(name, None), name, data, snapshot)
+                        touched.add(name)
+                except (OSError, ValueError):
+                    logs.pop(name, None)
+            for name in touched:
+                if name in logs:
+                    try:
+                        logs[name].flush()
+                    except (OSError, ValueError):
+                        pass
+            for _ in batch:
+                self.queue.task_done()
+
+    def _restart(self, log, name, header, snapshot):
+        """Начинает журнал заново: новый снимок, затем новый заголовок"""
+        if log:
+            log.close()
+        old_snapshots = [n for n in os.listdir(self.directory)
+                         if n.startswith(name + ".") and n.endswith(".snap")]
+        if snapshot is not None:
+            # Имя снимка уникально, поэтому после сбоя на любом шаге
+            # заголовок журнала ссылается на целый снимок
+            header["snapshot"] = f"{name}.{time.time_ns()}.snap"
+            write_atomic(self._path(header["snapshot"]), snapshot.iter_chunks())
+        elif header["base"] == "file":
+            stat = os.stat(header["path"])
+            header.update(size=stat.st_size, mtime=stat.st_mtime)
+        write_atomic(self._path(name + ".log"), [json.dumps(header, ensure_ascii=False) + "\n"])
+        for old in old_snapshots:
+            os.remove(self._path(old))
+        return open(self._path(name + ".log"), 'a', encoding='utf-8')
+
+    def _remove(self, log, name):
+        if log:
+            log.close()
+        for n in os.listdir(self.directory):
+            if n == name + ".log" or (n.startswith(name + ".") and n.endswith(".snap")):
+                os.remove(self._path(n))
+
+    def pending(self):
+        """Журналы, оставшиеся от аварийно завершенных экземпляров"""
+        try:
+            names = [n[:-4] for n in os.listdir(self.directory) if n.endswith(".log")]
+        except OSError:
+            return []
+        alive = {}
+        result = []
+        for name in sorted(names):
+            owner = name.rsplit("-", 1)[0]
+            if owner not in alive:
+                alive[owner] = self._owner_alive(owner)
+            if not alive[owner]:
+                result.append(name)
+        return result
+
+    def _owner_alive(self, owner):
+        if owner == self.owner:
+            return True
+        if not fcntl:
+            return False
+        try:
+            with open(self._path(owner + ".lock"), 'r+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        return False
+
+    def recover(self, name):
+        """Восстанавливает текст документа: (путь, кодировка, текст) или None"""
+        try:
+            with open(self._path(name + ".log"), 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                buffer = PieceTable()
+                buffer.load(self._base_text(header))
+                for line in f:
+                    try:
+                        offset, removed, inserted = json.loads(line)
+                    except ValueError:
+                        break  # Оборванная при сбое последняя запись
+                    if offset + removed > len(buffer):
+                        break
+                    if removed:
+                        buffer.delete(offset, removed)
+                    if inserted:
+                        buffer.insert(offset, inserted)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return header["path"], header["encoding"], buffer.get_text()
+
+    def _base_text(self, header):
+        if header["base"] == "snapshot":
+            with open(self._path(header["snapshot"]), 'r', encoding='utf-8') as f:
+                return f.read()
+        if header["base"] == "file":
+            # Файл изменился после начала журнала — правки к нему не применить
+            stat = os.stat(header["path"])
+            if stat.st_size != header["size"] or stat.st_mtime != header["mtime"]:
+                raise ValueError("file changed")
+            with open(header["path"], 'r', encoding=header["encoding"]) as f:
+                return f.read()
+        return ""
+
+    def remove(self, name):
+        """Удаляет журнал аварийно завершенного экземпляра"""
+        try:
+            self._remove(None, name)
+            owner = name.rsplit("-", 1)[0]
+            if not any(n.startswith(owner + "-") and n.endswith(".log")
+                       for n in os.listdir(self.directory)):
+                os.remove(self._path(owner + ".lock"))
+        except OSError:
+            pass
+
+
+class RecentList:
+    """Класс для работы со списком последних файлов.
+
+    Список хранится в памяти как упорядоченный словарь (путь -> метаданные),
+    а запись на диск откладывается и выполняется атомарно в фоне. При записи
+    список объединяется с тем, что на диске сохранили другие экземпляры:
+    для каждого пути побеждает запись с более поздним изменением (updated),
+    а порядок списка задает время открытия (time).
+    """
+    def __init__(self, filename='recent_files.json', max_items=30, save_delay=1.0):
+        self.filename = filename
+        self.max_items = max_items
+        self.save_delay = save_delay
+        self.lock = threading.RLock()
+        # Чтение и запись файла идут под отдельной блокировкой, чтобы
+        # add/update в потоке Tk не ждали диска и других экземпляров
+        self._io_lock = threading.Lock()
+        # Отложенную запись выполняет один поток на серию изменений
+        self._wakeup = threading.Condition(self.lock)
+        self._due = None
+        self._worker = None
+        self.items = OrderedDict(
+            (entry["path"], entry) for entry in self.load_data()[:self.max_items]
+        )
     
-    @property
-    def short_name(self):
-        """Возвращает короткое имя файла для отображения на вкладке"""
-        if self.has_name:
-            return os.path.basename(self.filepath)
-        return "Без имени"
+    def load_data(self):
+        """Загружает список последних файлов с диска"""
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return []
+            entries = []
+            for i, item in enumerate(data):
+                # Старый формат: просто список путей, от новых к старым
+                if isinstance(item, str):
+                    item = {"path": item, "time": -i}
+                if isinstance(item, dict) and item.get("path"):
+                    entries.append(item)
+            return entries
+        return []
     
-    @property
-    def full_name(self):
-        """Возвращает полное имя файла"""
-        return self.filepath if self.has_name else "Без имени"
+    def save_data(self, entries):
+        """Сохраняет список последних файлов"""
+        try:
+            write_atomic(self.filename, [json.dumps(entries, ensure_ascii=False, indent=2)])
+        except OSError:
+            pass
     
-    def open_file(self, filepath):
-        """Открывает файл"""
+    def files(self):
+        """Возвращает пути файлов, от последних к более старым"""
+        with self.lock:
+            return list(self.items)
+    
+    def get(self, filepath):
+        """Возвращает сохраненные метаданные файла"""
+        with self.lock:
+            return self.items.get(filepath)
+    
+    def add(self, filepath, **metadata):
+        """Добавляет файл в начало списка недавних"""
+        now = time.time()
+        entry = {"path": filepath, "time": now, "updated": now}
+        try:
+            stat = os.stat(filepath)
+            entry.update(size=stat.st_size, mtime=stat.st_mtime)
+        except OSError:
+            pass
+        with self.lock:
+            old = self.items.pop(filepath, None)
+            if old and "cursor" in old:
+                entry["cursor"] = old["cursor"]
+            entry.update(metadata)
+            self.items[filepath] = entry
+            self.items.move_to_end(filepath, last=False)
+            
+            # Ограничиваем размер списка
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=True)
+        self.schedule_save()
+    
+    def update(self, filepath, **metadata):
+        """Обновляет метаданные файла, не меняя его место в списке"""
+        with self.lock:
+            if filepath not in self.items:
+                return
+            self.items[filepath].update(metadata, updated=time.time())
+        self.schedule_save()
+    
+    def schedule_save(self):
+        """Откладывает запись, чтобы серия изменений дала одну запись"""
+        with self.lock:
+            self._due = time.monotonic() + self.save_delay
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._save_loop, daemon=True)
+                self._worker.start()
+    
+    def _save_loop(self):
+        """Ждет, пока изменения не затихнут на save_delay, и записывает список"""
+        while True:
+            with self.lock:
+                if self._due is None:
+                    self._worker = None
+                    return
+                delay = self._due - time.monotonic()
+                if delay > 0:
+                    self._wakeup.wait(delay)
+                    continue
+            self.flush()
+    
+    def flush(self):
+        """Объединяет список со списком на диске и записывает его"""
+        with self.lock:
+            self._due = None
+            self._wakeup.notify()
+            pending = [dict(entry) for entry in self.items.values()]
+        with self._io_lock:
+            lock_file = None
+            if fcntl:
+                try:
+                    lock_file = open(self.filename + ".lock", 'w')
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                except OSError:
+                    lock_file = None
+            try:
+                entries = self._merge(self.load_data(), pending)
+                self.save_data(entries)
+            finally:
+                if lock_file:
+                    lock_file.close()
+        with self.lock:
+            # Изменения, сделанные во время записи, не теряются: они свежее
+            # записанных и попадут на диск при следующей записи
+            self.items = OrderedDict(
+                (entry["path"], entry) for entry in self._merge(entries, self.items.values())
+            )
+
+    def _merge(self, entries, pending):
+        """Объединяет записи; для каждого пути побеждает последняя измененная"""
+        merged = {entry["path"]: entry for entry in entries}
+        for entry in pending:
+            path = entry["path"]
+            if path not in merged or self._changed(merged[path]) <= self._changed(entry):
+                merged[path] = entry
+        entries = sorted(merged.values(), key=lambda e: e.get("time", 0), reverse=True)
+        return entries[:self.max_items]
+
+    @staticmethod
+    def _changed(entry):
+        # В записях старого формата нет времени изменения
+        return entry.get("updated", entry.get("time", 0))
+
+
+class Session:
+    """Файл сеанса: открытые документы, их курсоры и прокрутка,
+    активная вкладка и масштаб"""
+    def __init__(self, filename='session.json'):
+        self.filename = filename
+
+    def load(self):
+        """Загружает сеанс; при отсутствии или повреждении файла — пустой"""
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self, data):
+        """Атомарно записывает сеанс"""
+        try:
+            write_atomic(self.filename, [json.dumps(data, ensure_ascii=False, indent=2)])
+        except OSError:
+            pass
+
+
+class PythonLexer:
+    """Построчный лексер Python.
+
+    Состояние между строками — открытая тройная кавычка (или None), поэтому
+    строку можно разобрать, зная только состояние конца предыдущей.
+    """
+    KEYWORDS = frozenset(keyword.kwlist + getattr(keyword, "softkwlist", []))
+    BUILTINS = frozenset(name for name in dir(builtins) if not name.startswith("_"))
+    TOKEN_RE = re.compile("|".join([
+        r"(?P<comment>#.*)",
+        r"(?P<string>[rRbBuUfF]{0,2}(?:'{3}|\"{3}|'(?:\\.|[^'\\])*'?|\"(?:\\.|[^\"\\])*\"?))",
+        r"(?P<number>\b(?:0[xXoObB][0-9a-fA-F_]+|[0-9][0-9_]*(?:\.[0-9_]*)?(?:[eE][+-]?[0-9]+)?[jJ]?))",
+        r"(?P<decorator>@[\w.]+)",
+        r"(?P<word>[A-Za-z_]\w*)",
+    ]))
+
+    def lex(self, line, state=None):
+        """Разбирает строку; возвращает ([(тег, начало, конец)], состояние)"""
+        tokens = []
+        pos = 0
+        if state:
+            end = self._closing(line, 0, state)
+            if end < 0:
+                return [("string", 0, len(line))] if line else [], state
+            tokens.append(("string", 0, end))
+            pos = end
+        definition = False
+        for match in self.TOKEN_RE.finditer(line, pos):
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == "string":
+                quote = match.group().lstrip("rRbBuUfF")[:3]
+                if quote in ('"""', "'''"):
+                    close = self._closing(line, end, quote)
+                    if close < 0:
+                        tokens.append(("string", start, len(line)))
+                        return tokens, quote
+                    end = close
+                    tokens.append(("string", start, end))
+                    # Продолжаем разбор после закрывающих кавычек
+                    return self._continue(line, end, tokens)
+            elif kind == "word":
+                word = match.group()
+                if definition:
+                    kind = "definition"
+                elif word in self.KEYWORDS:
+                    kind = "keyword"
+                elif word in self.BUILTINS:
+                    kind = "builtin"
+                else:
+                    definition = False
+                    continue
+                definition = word in ("def", "class")
+            tokens.append((kind, start, end))
+        return tokens, None
+
+    def _continue(self, line, pos, tokens):
+        rest, state = self.lex(line[pos:])
+        tokens.extend((kind, start + pos, end + pos) for kind, start, end in rest)
+        return tokens, state
+
+    @staticmethod
+    def _closing(line, pos, quote):
+        """Позиция сразу после закрывающей тройной кавычки или -1"""
+        while True:
+            found = line.find(quote, pos)
+            if found < 0:
+                return -1
+            backslashes = len(line[:found]) - len(line[:found].rstrip("\\"))
+            if backslashes % 2 == 0:
+                return found + 3
+            pos = found + 1
+
+
+_UNKNOWN = object()
+
+
+class SyntaxHighlighter:
+    """Инкрементальная подсветка синтаксиса документа.
+
+    Для каждой строки кэшируется состояние лексера на ее конце. После правки
+    разбор начинается с измененной строки и останавливается, как только
+    состояние совпадет с кэшированным; теги ставятся только видимым строкам.
+    """
+    # Цвета тегов задаются темой в StyleRegistry
+    TAGS = ("keyword", "builtin", "string", "comment", "number", "decorator", "definition")
+
+    def __init__(self, document, lexer=None):
+        self.document = document
+        self.lexer = lexer or PythonLexer()
+        self.states = []
+        self.dirty = None
+        self.tagged = set()
+        self._pending = False
+
+    def reset(self):
+        """Сбрасывает кэш (после полной замены текста)"""
+        self.states = []
+        self.dirty = None
+        self.reset_tags()
+
+    def reset_tags(self):
+        """Помечает все строки как неподсвеченные (например, новый виджет)"""
+        self.tagged = set()
+        self.schedule()
+
+    def clear(self):
+        """Убирает теги подсветки из виджета"""
+        widget = self.document.text_widget
+        if widget is not None:
+            for tag in self.TAGS:
+                widget.tag_remove(tag, "1.0", tk.END)
+        self.tagged = set()
+
+    def on_edit(self, document, offset, removed, inserted):
+        """Учитывает правку: сдвигает кэш состояний и помечает строки"""
+        line = document.buffer.position_of(offset)[0]
+        removed_lines = removed.count("\n")
+        added_lines = inserted.count("\n")
+        delta = added_lines - removed_lines
+        if line < len(self.states):
+            self.states[line:line + removed_lines + 1] = [_UNKNOWN] * (added_lines + 1)
+        last = line + added_lines
+        if self.dirty is None:
+            self.dirty = (line, last)
+        else:
+            lo, hi = self.dirty
+            hi = hi + delta if hi >= line else hi
+            self.dirty = (min(lo, line), max(hi, last))
+        if delta:
+            self.tagged = {n if n < line else n + delta for n in self.tagged if n < line or n > line + removed_lines}
+        else:
+            self.tagged.difference_update(range(line, last + 1))
+        self.schedule()
+
+    def schedule(self):
+        """Откладывает обновление подсветки до простоя цикла событий"""
+        if not self._pending and self.document.view is not None:
+            self._pending = True
+            self.document.master.after_idle(self.update)
+
+    def _line_state(self, line):
+        return self.states[line - 1] if line > 0 else None
+
+    def _relex(self):
+        """Переразбирает строки от места правки до схождения состояний"""
+        lo, hi = self.dirty
+        self.dirty = None
+        line = lo
+        line_count = self.document.buffer.line_count
+        del self.states[line_count:]
+        while line < len(self.states):
+            _, state = self.lexer.lex(self.document.buffer.line_text(line), self._line_state(line))
+            old = self.states[line]
+            self.states[line] = state
+            self.tagged.discard(line)
+            if line >= hi and old is not _UNKNOWN and old == state:
+                break
+            line += 1
+
+    def _extend(self, last_line):
+        """Разбирает строки, до которых подсветка еще не доходила"""
+        buffer = self.document.buffer
+        last_line = min(last_line, buffer.line_count - 1)
+        while len(self.states) <= last_line:
+            line = len(self.states)
+            _, state = self.lexer.lex(buffer.line_text(line), self._line_state(line))
+            self.states.append(state)
+
+    def update(self):
+        """Обновляет кэш состояний и подсвечивает видимые строки"""
+        self._pending = False
+        widget = self.document.text_widget
+        # В режиме длинных строк виджет показывает не строки буфера
+        if widget is None or self.document.soft_breaks:
+            return
+        if self.dirty is not None:
+            self._relex()
+        first = int(widget.index("@0,0").split(".")[0]) - 1
+        last = int(widget.index(f"@0,{widget.winfo_height()}").split(".")[0]) - 1
+        self._extend(last)
+        buffer = self.document.buffer
+        for line in range(first, min(last, buffer.line_count - 1) + 1):
+            if line in self.tagged:
+                continue
+            text = buffer.line_text(line)
+            tokens, _ = self.lexer.lex(text, self._line_state(line))
+            for tag in self.TAGS:
+                widget.tag_remove(tag, f"{line + 1}.0", f"{line + 1}.end")
+            if buffer.astral:
+                tokens = [(tag, tk_column(text, start), tk_column(text, end))
+                          for tag, start, end in tokens]
+            for tag, start, end in tokens:
+                widget.tag_add(tag, f"{line + 1}.{start}", f"{line + 1}.{end}")
+            self.tagged.add(line)
+
+
+# Построчные преобразования: вид -> (название, применимо к блокам строк по отдельности)
+TRANSFORMS = {
+    "sort": ("Сортировать строки", False),
+    "dedupe": ("Удалить повторяющиеся строки", False),
+    "reindent": ("Табуляции в отступах — в пробелы", True),
+    "upper": ("ВЕРХНИЙ РЕГИСТР", True),
+    "lower": ("нижний регистр", True),
+}
+
+
+def transform_text(text, kind, tab_size=4):
+    """Построчное преобразование текста; выполняется в рабочем процессе"""
+    if kind == "upper":
+        return text.upper()
+    if kind == "lower":
+        return text.lower()
+    body = text[:-1] if text.endswith("\n") else text
+    lines = body.split("\n")
+    if kind == "sort":
+        lines.sort()
+    elif kind == "dedupe":
+        lines = list(dict.fromkeys(lines))
+    elif kind == "reindent":
+        lines = [_reindent(line, tab_size) for line in lines]
+    else:
+        raise ValueError(f"неизвестное преобразование: {kind}")
+    return "\n".join(lines) + text[len(body):]
+
+
+def _reindent(line, tab_size):
+    code = line.lstrip(" \t")
+    return line[:len(line) - len(code)].expandtabs(tab_size) + code
+
+
+def split_blocks(text, size):
+    """Делит текст на блоки примерно по size символов на границах строк"""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start + size)
+        end = len(text) if end == -1 else end + 1
+        yield text[start:end]
+        start = end
+
+
+class BulkEdit:
+    """Большая правка документа, применяемая частями между событиями Tk.
+
+    Заменяет диапазон [first, last) текстом, который поступает частями:
+    готовыми строками (вставка из буфера обмена) или результатами Future
+    рабочих процессов (преобразования) — каждая часть вставляется, как
+    только готова, по CHUNK_SIZE символов за раз. Все правки входят в одну
+    группу истории, поэтому операция отменяется одним шагом; при отмене
+    во время выполнения документ возвращается к исходному тексту.
+    """
+    CHUNK_SIZE = 64 << 10
+    TICK_BUDGET = 0.03
+    POLL_MS = 15
+    # Вставки и преобразования меньше этого выполняются сразу
+    INLINE_LIMIT = 1 << 20
+    BLOCK_SIZE = 4 << 20
+
+    def __init__(self, document, first, last, parts, label, on_status=None, on_done=None):
+        self.document = document
+        self.first = first
+        self.last = last
+        self.parts = deque(parts)
+        self.total = len(self.parts)
+        self.label = label
+        self.on_status = on_status
+        self.on_done = on_done
+        self.pos = first
+        self.current = None
+        self.inner = 0
+        self.removed = ""
+        self.cancelled = False
+
+    def start(self):
+        """Удаляет заменяемый диапазон и начинает вставку частей"""
+        doc = self.document
+        doc.bulk = self
+        doc.history.begin_group()
+        self.removed = doc.buffer.get_text(self.first, self.last)
+        self._replace(self.first, self.last, "")
+        self._tick()
+
+    def cancel(self):
+        """Отменяет операцию; документ вернется к исходному тексту"""
+        self.cancelled = True
+
+    def stop(self):
+        """Прерывает операцию без отката (документ закрывается)"""
+        self._cancel_futures()
+        self.document.history.discard_group()
+        self.document.bulk = None
+
+    @property
+    def progress(self):
+        """Доля выполненной работы"""
+        done = self.total - len(self.parts)
+        if self.current is not None:
+            done -= 1 - self.inner / max(len(self.current), 1)
+        return done / max(self.total, 1)
+
+    def _cancel_futures(self):
+        for part in self.parts:
+            if not isinstance(part, str):
+                part.cancel()
+
+    def _replace(self, start, end, text):
+        # Виджет закрыт от ввода на время операции; правки самой операции
+        # проходят через представление, чтобы буфер оставался синхронным
+        widget = self.document.text_widget
+        if widget is not None:
+            widget.config(state=tk.NORMAL)
+        try:
+            self.document.replace_range(start, end, text)
+        finally:
+            if widget is not None:
+                widget.config(state=tk.DISABLED)
+
+    def _tick(self):
+        if self.document.bulk is not self:
+            return
+        if self.cancelled:
+            self._finish(False)
+            return
+        waiting = False
+        deadline = time.perf_counter() + self.TICK_BUDGET
+        while time.perf_counter() < deadline:
+            if self.current is None:
+                if not self.parts:
+                    self._finish(True)
+                    return
+                part = self.parts[0]
+                if not isinstance(part, str):
+                    if not part.done():
+                        waiting = True
+                        break
+                    try:
+                        part = part.result()
+                    except Exception as e:
+                        messagebox.showerror("Ошибка", f"Не удалось выполнить операцию: {e}")
+                        self._finish(False)
+                        return
+                self.parts.popleft()
+                self.current, self.inner = part, 0
+            chunk = self.current[self.inner:self.inner + self.CHUNK_SIZE]
+            self._replace(self.pos, self.pos, chunk)
+            self.pos += len(chunk)
+            self.inner += len(chunk)
+            if self.inner >= len(self.current):
+                self.current = None
+        if self.on_status:
+            self.on_status(f"{self.label}: {self.progress:.0%} (Esc или щелчок здесь — отмена)")
+        self.document.master.after(self.POLL_MS if waiting else 1, self._tick)
+
+    def _finish(self, success):
+        doc = self.document
+        if success:
+            doc.history.end_group()
+        else:
+            # Откат не записывается в историю: группа операции отбрасывается
+            self._cancel_futures()
+            doc.history.applying = True
+            try:
+                self._replace(self.first, self.pos, self.removed)
+            finally:
+                doc.history.applying = False
+            doc.history.discard_group()
+        doc.bulk = None
+        if doc.view:
+            doc.text_widget.config(state=tk.NORMAL)
+            doc.text_widget.mark_set(tk.INSERT, doc.index_of(self.pos if success else self.first))
+            doc.text_widget.see(tk.INSERT)
+        if self.on_done:
+            self.on_done(success)
+
+
+class FindReplace:
+    """Поиск и замена в текущем документе.
+
+    Для больших документов поиск идет в рабочем потоке по снимку буфера.
+    Подсветка совпадений ставится только на видимые строки и обновляется
+    при прокрутке и правке текста.
+    """
+    THREAD_THRESHOLD = 1 << 20
+    HIGHLIGHT_LIMIT = 2000
+    TAG = "search_match"
+
+    def __init__(self, editor):
+        self.editor = editor
+        self.engine = SearchEngine()
+        self.dialog = None
+        self.find_var = tk.StringVar(editor.root)
+        self.replace_var = tk.StringVar(editor.root)
+        self.regex_var = tk.BooleanVar(editor.root, value=False)
+        self.case_var = tk.BooleanVar(editor.root, value=False)
+        self._highlight_pending = False
+        self._highlighted = None
+        self._task = None
+
+    def show(self, replace=False):
+        """Показывает окно поиска (и замены)"""
+        if self.dialog is None:
+            self._create_dialog()
+        self.replace_frame.pack_forget()
+        if replace:
+            self.replace_frame.pack(fill=tk.X, padx=5, after=self.find_frame)
+        self.dialog.title("Заменить" if replace else "Найти")
+        self.dialog.deiconify()
+        self.dialog.lift()
+        self.find_entry.focus_set()
+        self.find_entry.select_range(0, tk.END)
+
+    def _create_dialog(self):
+        dialog = tk.Toplevel(self.editor.root)
+        dialog.transient(self.editor.root)
+        dialog.resizable(False, False)
+        dialog.protocol("WM_DELETE_WINDOW", self.hide)
+        
+        self.find_frame = tk.Frame(dialog)
+        self.find_frame.pack(fill=tk.X, padx=5, pady=(5, 0))
+        tk.Label(self.find_frame, text="Найти:", width=12, anchor=tk.W).pack(side=tk.LEFT)
+        self.find_entry = tk.Entry(self.find_frame, textvariable=self.find_var, width=40)
+        self.find_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        self.replace_frame = tk.Frame(dialog)
+        tk.Label(self.replace_frame, text="Заменить на:", width=12, anchor=tk.W).pack(side=tk.LEFT)
+        tk.Entry(self.replace_frame, textvariable=self.replace_var, width=40).pack(
+            side=tk.LEFT, fill=tk.X, expand=True
+        )
+        
+        options = tk.Frame(dialog)
+        options.pack(fill=tk.X, padx=5, pady=5)
+        tk.Checkbutton(options, text="Регулярное выражение", variable=self.regex_var,
+                       command=self.on_pattern_changed).pack(side=tk.LEFT)
+        tk.Checkbutton(options, text="Без учета регистра", variable=self.case_var,
+                       command=self.on_pattern_changed).pack(side=tk.LEFT)
+        
+        buttons = tk.Frame(dialog)
+        buttons.pack(fill=tk.X, padx=5, pady=(0, 5))
+        tk.Button(buttons, text="Найти далее", command=self.find_next).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Найти назад",
+                  command=lambda: self.find_next(backwards=True)).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Заменить", command=self.replace).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Заменить все", command=self.replace_all).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Закрыть", command=self.hide).pack(side=tk.RIGHT)
+        
+        dialog.bind("<Return>", lambda e: self.find_next())
+        dialog.bind("<Escape>", lambda e: self.hide())
+        self.find_var.trace_add("write", lambda *args: self.on_pattern_changed())
+        self.dialog = dialog
+
+    def hide(self):
+        """Скрывает окно поиска и убирает подсветку"""
+        if self.dialog is not None:
+            self.dialog.withdraw()
+        self.engine.pattern = None
+        self.schedule_highlight()
+
+    def _compile(self):
+        try:
+            self.engine.set_pattern(self.find_var.get(), self.regex_var.get(), self.case_var.get())
+            return True
+        except re.error as e:
+            self.engine.pattern = None
+            self.editor.ui.set_status(f"Неверное регулярное выражение: {e}")
+            return False
+
+    def on_pattern_changed(self):
+        """Перекомпилирует шаблон и обновляет подсветку"""
+        self._compile()
+        self.schedule_highlight()
+
+    def _target(self):
+        doc = self.editor.current_doc
+        if doc is None or doc.view is None or doc.loading or doc.read_only or doc.bulk:
+            return None
+        if doc.soft_breaks:
+            return None
+        return doc
+
+    def _run(self, doc, func, on_result):
+        """Выполняет func(текст) сразу или в фоне, в зависимости от размера"""
+        if len(doc.buffer) < self.THREAD_THRESHOLD:
+            on_result(func(doc.get_text()))
+            return
+        snapshot = doc.buffer.snapshot()
+        self.editor.ui.set_status("Поиск...")
+
+        def done(future):
+            self._task = None
+            if doc.buffer.version != snapshot.version:
+                self.editor.ui.set_status("Документ изменился во время поиска")
+                return
+            on_result(future.result())
+
+        if self._task is None:
+            self._task = run_in_background(
+                self.editor.root, lambda: func(snapshot.get_text()), done
+            )
+
+    def find_next(self, backwards=False):
+        """Находит следующее (или предыдущее) совпадение"""
+        doc = self._target()
+        if doc is None:
+            return
+        if self.engine.pattern is None and not (self.find_var.get() and self._compile()):
+            self.show()
+            return
+        widget = doc.text_widget
+        if widget.tag_ranges(tk.SEL):
+            start = doc.view.offset(tk.SEL_FIRST if backwards else tk.SEL_LAST)
+        else:
+            start = doc.view.offset(tk.INSERT)
+        self._run(doc, lambda text: self.engine.search(text, start, backwards),
+                  lambda match: self._show_match(doc, match))
+
+    def _show_match(self, doc, match):
+        if doc.view is None:
+            return
+        if match is None:
+            self.editor.ui.set_status("Совпадений не найдено")
+            return
+        widget = doc.text_widget
+        first, last = doc.index_of(match[0]), doc.index_of(match[1])
+        widget.tag_remove(tk.SEL, "1.0", tk.END)
+        widget.tag_add(tk.SEL, first, last)
+        widget.mark_set(tk.INSERT, last)
+        widget.see(first)
+        self.editor.ui.set_status(f"Найдено: строка {first.split('.')[0]}")
+
+    def replace(self):
+        """Заменяет выделенное совпадение и ищет следующее"""
+        doc = self._target()
+        if doc is None or not self._compile() or self.engine.pattern is None:
+            return
+        widget = doc.text_widget
+        if widget.tag_ranges(tk.SEL):
+            selected = widget.get(tk.SEL_FIRST, tk.SEL_LAST)
+            match = self.engine.pattern.fullmatch(selected)
+            if match:
+                first = widget.index(tk.SEL_FIRST)
+                doc.history.begin_group()
+                try:
+                    widget.replace(tk.SEL_FIRST, tk.SEL_LAST,
+                                   self.engine.expand(match, self.replace_var.get()))
+                finally:
+                    doc.history.end_group()
+                widget.mark_set(tk.INSERT, first)
+        self.find_next()
+
+    def replace_all(self):
+        """Заменяет все совпадения одним шагом отмены"""
+        doc = self._target()
+        if doc is None or not self._compile() or self.engine.pattern is None:
+            return
+        replacement = self.replace_var.get()
+        self._run(doc, lambda text: self.engine.replace_all(text, replacement),
+                  lambda result: self._apply_replace_all(doc, result))
+
+    def _apply_replace_all(self, doc, matches):
+        if not matches or doc.view is None:
+            self.editor.ui.set_status("Совпадений не найдено")
+            return
+        doc.replace_matches(matches)
+        self.editor.ui.set_status(f"Заменено: {len(matches)}")
+
+    def schedule_highlight(self):
+        """Откладывает обновление подсветки до простоя цикла событий"""
+        if not self._highlight_pending:
+            self._highlight_pending = True
+            self.editor.root.after_idle(self._highlight)
+
+    def _highlight(self):
+        """Подсвечивает совпадения только в видимых строках"""
+        self._highlight_pending = False
+        # Подсвечены только видимые строки, поэтому снятие тега дешевое
+        previous, self._highlighted = self._highlighted, None
+        if previous is not None and previous.view is not None:
+            previous.text_widget.tag_remove(self.TAG, "1.0", tk.END)
+        doc = self._target()
+        if doc is None or self.engine.pattern is None:
+            return
+        widget = doc.text_widget
+        first = widget.index("@0,0 linestart")
+        last = widget.index(f"@0,{widget.winfo_height()} lineend")
+        start = doc.view.offset(first)
+        text = doc.buffer.get_text(start, doc.view.offset(last))
+        widget.tag_lower(self.TAG, tk.SEL)
+        for match in self.engine.iter_matches(text, self.HIGHLIGHT_LIMIT):
+            if doc.buffer.astral:
+                widget.tag_add(self.TAG, doc.index_of(start + match.start()),
+                               doc.index_of(start + match.end()))
+            else:
+                widget.tag_add(self.TAG, f"{first}+{match.start()}c", f"{first}+{match.end()}c")
+        self._highlighted = doc
+
+
+class IgnoreRules:
+    """Правила исключения файлов в духе .gitignore"""
+    ALWAYS = (".git", ".hg", ".svn", "__pycache__")
+
+    def __init__(self, patterns=()):
+        self.rules = []
+        for pattern in patterns:
+            self.add("", pattern)
+
+    def add(self, base, line):
+        """Добавляет правило из строки .gitignore каталога base"""
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+        negate = line.startswith("!")
+        line = line.lstrip("!")
+        dir_only = line.endswith("/")
+        line = line.strip("/")
+        if line:
+            self.rules.append((base, line, negate, dir_only))
+
+    def load(self, directory, base):
+        """Читает .gitignore каталога, если он есть"""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            self.text_widget.delete(1.0, tk.END)
-            self.text_widget.insert(1.0, content)
-            self.filepath = filepath
-            self.modified = False
+            with open(os.path.join(directory, ".gitignore"), 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    self.add(base, line)
+        except OSError:
+            pass
+
+    def ignored(self, relpath, is_dir):
+        """Проверяет, исключен ли путь (относительно корня поиска)"""
+        name = os.path.basename(relpath)
+        if name in self.ALWAYS:
             return True
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось открыть файл: {e}")
-            return False
-    
-    def save_file(self):
-        """Сохраняет файл"""
-        if not self.has_name:
-            return False
-        
+        result = False
+        for base, pattern, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base and not relpath.startswith(base + "/"):
+                continue
+            local = relpath[len(base) + 1:] if base else relpath
+            if fnmatch(local, pattern) if "/" in pattern else fnmatch(name, pattern):
+                result = not negate
+        return result
+
+
+def iter_files(root_dir, rules):
+    """Обходит дерево каталогов, пропуская исключенные файлы"""
+    for directory, dirs, files in os.walk(root_dir):
+        base = os.path.relpath(directory, root_dir).replace(os.sep, "/")
+        base = "" if base == "." else base
+        rules.load(directory, base)
+        prefix = base + "/" if base else ""
+        dirs[:] = [d for d in dirs if not rules.ignored(prefix + d, True)]
+        for name in files:
+            if not rules.ignored(prefix + name, False):
+                yield os.path.join(directory, name)
+
+
+def search_files(paths, pattern_text, regex, ignore_case, max_matches=1000):
+    """Ищет шаблон в файлах; выполняется в рабочем процессе.
+
+    Возвращает список (путь, [(номер строки, столбец, текст строки)]).
+    """
+    pattern = compile_pattern(pattern_text, regex, ignore_case)
+    found = []
+    for path in paths:
         try:
-            content = self.text_widget.get(1.0, tk.END)
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            self.modified = False
-            return True
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {e}")
-            return False
-    
-    def save_as(self, filepath):
-        """Сохраняет файл с новым именем"""
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        if is_binary(data[:8192]):
+            continue
+        text = data.decode(sniff_encoding(data[:SNIFF_SIZE]), errors='replace')
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        matches = []
+        line, position, last_line = 1, 0, 0
+        for match in pattern.finditer(text):
+            if match.end() == match.start():
+                continue
+            line += text.count("\n", position, match.start())
+            position = match.start()
+            if line == last_line:
+                continue
+            start = text.rfind("\n", 0, position) + 1
+            end = text.find("\n", position)
+            end = len(text) if end == -1 else end
+            matches.append((line, position - start, text[start:end].strip()[:200]))
+            last_line = line
+            if len(matches) >= max_matches:
+                break
+        if matches:
+            found.append((path, matches))
+    return found
+
+
+class FileSearch:
+    """Поиск по файлам каталога в пуле процессов.
+
+    Обход дерева идет в фоновом потоке, файлы пачками отправляются в пул,
+    найденное по мере готовности складывается в очередь results.
+    """
+    BATCH_FILES = 16
+
+    def __init__(self, executor, workers, root_dir, pattern_text, regex, ignore_case, ignore=()):
+        self.executor = executor
+        self.workers = workers
+        self.root_dir = root_dir
+        self.args = (pattern_text, regex, ignore_case)
+        self.rules = IgnoreRules(ignore)
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.files = 0
+
+    def start(self):
+        """Запускает поиск"""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self):
+        """Останавливает поиск"""
+        self.cancelled.set()
+
+    def _drain(self, futures):
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                for path, matches in future.result():
+                    self.results.put(("file", path, matches))
+
+    def _run(self):
+        in_flight = set()
+        batch = []
         try:
-            content = self.text_widget.get(1.0, tk.END)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            self.filepath = filepath
-            self.modified = False
-            return True
+            for path in iter_files(self.root_dir, self.rules):
+                if self.cancelled.is_set():
+                    break
+                batch.append(path)
+                self.files += 1
+                if len(batch) < self.BATCH_FILES:
+                    continue
+                in_flight.add(self.executor.submit(search_files, batch, *self.args))
+                batch = []
+                # Ограничиваем число пачек в работе, чтобы отмена была быстрой
+                while len(in_flight) >= self.workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._drain(done)
+            if batch and not self.cancelled.is_set():
+                in_flight.add(self.executor.submit(search_files, batch, *self.args))
+            while in_flight:
+                if self.cancelled.is_set():
+                    for future in in_flight:
+                        future.cancel()
+                done, in_flight = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                self._drain(done)
         except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить файл: {e}")
-            return False
+            self.results.put(("error", e, None))
+        self.results.put(("done", None, None))
 
 
-class RecentList:
-    """Класс для работы со списком последних файлов"""
-    def __init__(self, filename='recent_files.json'):
-        self.filename = filename
-        self.max_items = 5
-    
-    def load_data(self):
-        """Загружает список последних файлов"""
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
-    
-    def save_data(self, files):
-        """Сохраняет список последних файлов"""
+class FindInFiles:
+    """Окно «Поиск в файлах» с панелью результатов"""
+    POLL_MS = 50
+
+    def __init__(self, editor):
+        self.editor = editor
+        self.window = None
+        self.search = None
+        self.executor = None
+        self.workers = os.cpu_count() or 1
+        self.locations = {}
+
+    def show(self):
+        """Показывает окно поиска в файлах"""
+        if self.window is None:
+            self._create_window()
+        self.window.deiconify()
+        self.window.lift()
+        self.pattern_entry.focus_set()
+
+    def _create_window(self):
+        window = tk.Toplevel(self.editor.root)
+        window.title("Поиск в файлах")
+        window.geometry("800x400")
+        window.protocol("WM_DELETE_WINDOW", self.hide)
+        
+        self.pattern_var = tk.StringVar(window)
+        self.dir_var = tk.StringVar(window, value=os.getcwd())
+        self.ignore_var = tk.StringVar(window)
+        self.regex_var = tk.BooleanVar(window, value=False)
+        self.case_var = tk.BooleanVar(window, value=False)
+        
+        form = tk.Frame(window)
+        form.pack(fill=tk.X, padx=5, pady=5)
+        form.columnconfigure(1, weight=1)
+        tk.Label(form, text="Найти:").grid(row=0, column=0, sticky=tk.W)
+        self.pattern_entry = tk.Entry(form, textvariable=self.pattern_var)
+        self.pattern_entry.grid(row=0, column=1, sticky=tk.EW)
+        tk.Label(form, text="Каталог:").grid(row=1, column=0, sticky=tk.W)
+        tk.Entry(form, textvariable=self.dir_var).grid(row=1, column=1, sticky=tk.EW)
+        tk.Button(form, text="Обзор...", command=self.choose_dir).grid(row=1, column=2)
+        tk.Label(form, text="Исключить:").grid(row=2, column=0, sticky=tk.W)
+        tk.Entry(form, textvariable=self.ignore_var).grid(row=2, column=1, sticky=tk.EW)
+        
+        options = tk.Frame(window)
+        options.pack(fill=tk.X, padx=5)
+        tk.Checkbutton(options, text="Регулярное выражение", variable=self.regex_var).pack(side=tk.LEFT)
+        tk.Checkbutton(options, text="Без учета регистра", variable=self.case_var).pack(side=tk.LEFT)
+        tk.Button(options, text="Остановить", command=self.stop).pack(side=tk.RIGHT)
+        tk.Button(options, text="Найти", command=self.start).pack(side=tk.RIGHT)
+        
+        results = tk.Frame(window)
+        results.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.tree = ttk.Treeview(results, columns=("line", "text"), show="tree headings")
+        self.tree.heading("#0", text="Файл")
+        self.tree.heading("line", text="Строка")
+        self.tree.heading("text", text="Текст")
+        self.tree.column("line", width=60, stretch=False, anchor=tk.E)
+        scrollbar = tk.Scrollbar(results, command=self.tree.yview)
+        self.tree.config(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.bind("<Double-1>", self.on_activate)
+        self.tree.bind("<Return>", self.on_activate)
+        
+        self.status = tk.Label(window, text="", anchor=tk.W)
+        self.status.pack(fill=tk.X, padx=5)
+        window.bind("<Escape>", lambda e: self.stop())
+        self.pattern_entry.bind("<Return>", lambda e: self.start())
+        self.window = window
+
+    def hide(self):
+        """Скрывает окно и останавливает поиск"""
+        self.stop()
+        self.window.withdraw()
+
+    def choose_dir(self):
+        """Выбор каталога поиска"""
+        directory = filedialog.askdirectory(title="Каталог поиска", initialdir=self.dir_var.get())
+        if directory:
+            self.dir_var.set(directory)
+
+    def start(self):
+        """Запускает поиск по файлам"""
+        self.stop()
+        pattern = self.pattern_var.get()
+        directory = self.dir_var.get()
+        if not pattern or not os.path.isdir(directory):
+            self.status.config(text="Укажите строку поиска и существующий каталог")
+            return
         try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(files, f, ensure_ascii=False, indent=2)
-        except:
-            pass
-    
-    def add(self, filepath):
-        """Добавляет файл в список недавних"""
-        files = self.load_data()
+            compile_pattern(pattern, self.regex_var.get(), self.case_var.get())
+        except re.error as e:
+            self.status.config(text=f"Неверное регулярное выражение: {e}")
+            return
         
-        # Удаляем файл, если он уже есть в списке
-        if filepath in files:
-            files.remove(filepath)
+        if self.executor is None:
+            # spawn: рабочие процессы не наследуют состояние Tk
+            self.executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.tree.delete(*self.tree.get_children())
+        self.locations.clear()
+        self.matches = 0
+        ignore = self.ignore_var.get().replace(",", " ").split()
+        self.search = FileSearch(self.executor, self.workers, directory, pattern,
+                                 self.regex_var.get(), self.case_var.get(), ignore)
+        self.search.start()
+        self.window.after(self.POLL_MS, self._poll, self.search)
+
+    def stop(self):
+        """Останавливает текущий поиск"""
+        if self.search:
+            self.search.cancel()
+
+    def _poll(self, search):
+        if search is not self.search:
+            return
+        finished = False
+        try:
+            for _ in range(200):
+                kind, path, matches = search.results.get_nowait()
+                if kind == "file":
+                    self._add_file(path, matches)
+                elif kind == "error":
+                    self.status.config(text=f"Ошибка поиска: {path}")
+                else:
+                    finished = True
+                    break
+        except queue.Empty:
+            pass
+        state = "остановлен" if search.cancelled.is_set() else ("завершен" if finished else "идет")
+        self.status.config(
+            text=f"Поиск {state}: файлов просмотрено {search.files}, совпадений {self.matches}"
+        )
+        if finished:
+            self.search = None
+        else:
+            self.window.after(self.POLL_MS, self._poll, search)
+
+    def _add_file(self, path, matches):
+        parent = self.tree.insert("", tk.END, text=path, values=(len(matches), ""), open=True)
+        self.locations[parent] = (path, 1, 0)
+        for line, column, text in matches:
+            item = self.tree.insert(parent, tk.END, text="", values=(line, text))
+            self.locations[item] = (path, line, column)
+        self.matches += len(matches)
+
+    def on_activate(self, event=None):
+        """Открывает выбранный результат и переходит к строке"""
+        location = self.locations.get(self.tree.focus())
+        if location:
+            self.editor.goto_location(*location)
+
+    def shutdown(self):
+        """Останавливает пул процессов"""
+        self.stop()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Переменная окружения, включающая трассировку: 1 или путь к файлу трассы
+TRACE_ENV = 'EDITOR_TRACE'
+
+
+class Tracer:
+    """Трассировка обработчиков и обнаружение зависаний главного цикла Tk.
+
+    Включается переменной окружения EDITOR_TRACE и без нее ничего не стоит.
+    Обернутые обработчики (команды меню, горячие клавиши, события вкладок
+    и правок) записывают время выполнения. Цикл Tk отмечается таймером,
+    а сторожевой поток, заметив, что отметки нет дольше порога, снимает
+    стек главного потока — он показывает, чем цикл занят. Все события
+    выгружаются в формате Chrome trace (chrome://tracing, Perfetto).
+    """
+    MAX_EVENTS = 100000
+    HEARTBEAT_MS = 50
+    STALL_THRESHOLD = 0.25
+
+    def __init__(self, master, path, threshold=STALL_THRESHOLD, on_stall=None):
+        self.master = master
+        self.path = path
+        self.threshold = threshold
+        self.on_stall = on_stall
+        self.events = deque(maxlen=self.MAX_EVENTS)  # (имя, категория, начало, длительность, поток, данные)
+        self.stats = {}  # обработчик -> [вызовы, общее время, максимум]
+        self.stalls = deque(maxlen=100)
+        self.origin = time.perf_counter()
+        self.main_thread = threading.get_ident()
+        self.lock = threading.Lock()
+        self.beat = time.perf_counter()
+        self.stall_stack = None
+        self.stopped = False
+        master.after(self.HEARTBEAT_MS, self._heartbeat)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    @classmethod
+    def from_environment(cls, master, on_stall=None):
+        """Создает трассировщик, если он включен в окружении, иначе None"""
+        value = os.environ.get(TRACE_ENV)
+        if not value:
+            return None
+        return cls(master, 'editor_trace.json' if value == "1" else value, on_stall=on_stall)
+
+    def wrap(self, name, func):
+        """Оборачивает обработчик замером времени"""
+        @wraps(func)
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter() - start)
+        return traced
+
+    def instrument(self, obj, names):
+        """Заменяет методы объекта обернутыми (до того, как их привяжут)"""
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+    def record(self, name, start, duration, category="handler", data=None):
+        """Добавляет событие трассы"""
+        self.events.append((name, category, start, duration, threading.get_ident(), data))
+        if category == "handler":
+            entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+    def stop(self):
+        """Останавливает сторожевой поток"""
+        self.stopped = True
+
+    def _heartbeat(self):
+        now = time.perf_counter()
+        start = self.beat + self.HEARTBEAT_MS / 1000
+        self.beat = now
+        with self.lock:
+            stack, self.stall_stack = self.stall_stack, None
+        if now - start >= self.threshold:
+            stall = {"stack": "".join(stack) if stack else ""}
+            self.record("stall", start, now - start, "stall", stall)
+            self.stalls.append((start, now - start, stall["stack"]))
+            if self.on_stall:
+                self.on_stall(now - start, stack[-1].strip().splitlines()[0] if stack else "")
+        if not self.stopped:
+            self.master.after(self.HEARTBEAT_MS, self._heartbeat)
+
+    def _watch(self):
+        while not self.stopped:
+            time.sleep(self.threshold / 4)
+            late = time.perf_counter() - self.beat - self.HEARTBEAT_MS / 1000
+            if late < self.threshold or self.stall_stack is not None:
+                continue
+            frame = sys._current_frames().get(self.main_thread)
+            if frame is not None:
+                with self.lock:
+                    self.stall_stack = traceback.format_stack(frame)
+
+    def summary(self):
+        """Обработчики по убыванию общего времени: (имя, вызовы, всего, максимум)"""
+        rows = [(name, count, total, peak) for name, (count, total, peak) in self.stats.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def export(self, path=None):
+        """Записывает трассу в формате Chrome trace; возвращает путь"""
+        path = path or self.path
+        pid = os.getpid()
+        events = [{
+            "name": "thread_name", "ph": "M", "pid": pid, "tid": self.main_thread,
+            "args": {"name": "Tk"},
+        }]
+        for name, category, start, duration, tid, data in list(self.events):
+            event = {
+                "name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+            }
+            if data:
+                event["args"] = data
+            events.append(event)
+        write_atomic(path, [json.dumps({"traceEvents": events}, ensure_ascii=False)])
+        return path
+
+
+class TraceSummary:
+    """Окно сводки трассировки: время обработчиков и зависания цикла Tk"""
+    def __init__(self, editor):
+        self.editor = editor
+        self.window = None
+
+    def show(self):
+        """Показывает окно со свежими данными трассы"""
+        if self.window is None:
+            self._create_window()
+        self.refresh()
+        self.window.deiconify()
+        self.window.lift()
+
+    def _create_window(self):
+        window = tk.Toplevel(self.editor.root)
+        window.title("Трассировка")
+        window.geometry("800x500")
+        window.protocol("WM_DELETE_WINDOW", window.withdraw)
         
-        # Добавляем файл в начало списка
-        files.insert(0, filepath)
+        buttons = tk.Frame(window)
+        buttons.pack(fill=tk.X, padx=5, pady=5)
+        tk.Button(buttons, text="Обновить", command=self.refresh).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Сохранить трассу", command=self.editor.export_trace).pack(side=tk.LEFT)
         
-        # Ограничиваем размер списка
-        files = files[:self.max_items]
+        columns = ("count", "total", "mean", "max")
+        self.tree = ttk.Treeview(window, columns=columns, show="tree headings", height=12)
+        self.tree.heading("#0", text="Обработчик")
+        for column, title in zip(columns, ("Вызовы", "Всего, мс", "Среднее, мс", "Максимум, мс")):
+            self.tree.heading(column, text=title)
+            self.tree.column(column, width=100, stretch=False, anchor=tk.E)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5)
         
-        # Сохраняем обновленный список
-        self.save_data(files)
+        tk.Label(window, text="Зависания главного цикла", anchor=tk.W).pack(fill=tk.X, padx=5)
+        self.stalls_text = tk.Text(window, height=12, wrap=tk.NONE)
+        self.stalls_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.window = window
+
+    def refresh(self):
+        """Перечитывает статистику трассировщика"""
+        tracer = self.editor.tracer
+        self.tree.delete(*self.tree.get_children())
+        for name, count, total, peak in tracer.summary():
+            self.tree.insert("", tk.END, text=name, values=(
+                count, f"{total * 1000:.1f}", f"{total / count * 1000:.2f}", f"{peak * 1000:.1f}"
+            ))
+        self.stalls_text.delete("1.0", tk.END)
+        for start, duration, stack in reversed(tracer.stalls):
+            self.stalls_text.insert(
+                tk.END, f"+{start - tracer.origin:.1f} с: {duration * 1000:.0f} мс\n{stack}\n"
+            )
+
+
+class StyleRegistry:
+    """Шрифты, темы и цвета тегов редактора в одном месте.
+
+    Текстовые поля и теги ссылаются на общие объекты tkinter.font.Font,
+    поэтому масштаб меняется одной правкой шрифта, сколько бы ни было
+    открыто вкладок.
+    """
+    FAMILY = "Consolas"
+    DEFAULT_SIZE = 12
+    MIN_SIZE = 6
+    THEMES = {
+        "light": {
+            "text": {
+                "background": "white", "foreground": "black",
+                "insertbackground": "black", "selectbackground": "#c0d8f0",
+                "selectforeground": "black",
+            },
+            "tags": {
+                "keyword": {"foreground": "#0000c0", "font": "bold"},
+                "builtin": {"foreground": "#900090"},
+                "string": {"foreground": "#008000"},
+                "comment": {"foreground": "#808080", "font": "italic"},
+                "number": {"foreground": "#c06000"},
+                "decorator": {"foreground": "#a05000"},
+                "definition": {"foreground": "#0060a0"},
+                "search_match": {"background": "yellow"},
+            },
+        },
+        "dark": {
+            "text": {
+                "background": "#1e1e1e", "foreground": "#d4d4d4",
+                "insertbackground": "#d4d4d4", "selectbackground": "#264f78",
+                "selectforeground": "#d4d4d4",
+            },
+            "tags": {
+                "keyword": {"foreground": "#569cd6", "font": "bold"},
+                "builtin": {"foreground": "#c586c0"},
+                "string": {"foreground": "#ce9178"},
+                "comment": {"foreground": "#6a9955", "font": "italic"},
+                "number": {"foreground": "#b5cea8"},
+                "decorator": {"foreground": "#dcdcaa"},
+                "definition": {"foreground": "#4ec9b0"},
+                "search_match": {"background": "#613214"},
+            },
+        },
+    }
+
+    def __init__(self, master, size=DEFAULT_SIZE, theme="light"):
+        self.fonts = {
+            "normal": tkfont.Font(master, family=self.FAMILY, size=size),
+            "bold": tkfont.Font(master, family=self.FAMILY, size=size, weight="bold"),
+            "italic": tkfont.Font(master, family=self.FAMILY, size=size, slant="italic"),
+        }
+        self.theme = theme if theme in self.THEMES else "light"
+
+    @property
+    def size(self):
+        """Текущий размер шрифта"""
+        return self.fonts["normal"].cget("size")
+
+    def set_size(self, size):
+        """Меняет масштаб всех текстовых полей и тегов сразу"""
+        size = max(self.MIN_SIZE, size)
+        for font in self.fonts.values():
+            font.configure(size=size)
+
+    def text_options(self):
+        """Параметры нового текстового поля"""
+        return dict(self.THEMES[self.theme]["text"], font=self.fonts["normal"])
+
+    def apply(self, widget):
+        """Применяет тему к текстовому полю и настраивает теги подсветки"""
+        widget.config(**self.text_options())
+        for tag, options in self.THEMES[self.theme]["tags"].items():
+            options = dict(options)
+            if "font" in options:
+                options["font"] = self.fonts[options["font"]]
+            widget.tag_config(tag, **options)
+
+
+class UiUpdater:
+    """Отложенное обновление интерфейса.
+
+    Заголовки вкладок, текст статус бара и другие обновления только
+    отмечаются как устаревшие и применяются один раз за цикл простоя через
+    after_idle. Серия правок, вставка большого текста или пакетная операция
+    дают одну перерисовку, а не вызов Tcl на каждое событие.
+    """
+    def __init__(self, master, set_title, set_status):
+        self.master = master
+        self._set_title = set_title
+        self._set_status = set_status
+        self.titles = {}  # вкладка -> новый заголовок
+        self.shown = {}  # вкладка -> показанный заголовок
+        self.status = None
+        self.tasks = OrderedDict()  # ключ -> функция
+        self._scheduled = None
+
+    def set_title(self, tab_id, text):
+        """Отмечает новый заголовок вкладки"""
+        self.titles[tab_id] = text
+        self._schedule()
+
+    def set_status(self, text):
+        """Отмечает новый текст статус бара"""
+        self.status = text
+        self._schedule()
+
+    def call(self, key, func):
+        """Откладывает вызов; повторные вызовы с тем же ключом объединяются"""
+        self.tasks[key] = func
+        self._schedule()
+
+    def forget(self, tab_id):
+        """Забывает закрытую вкладку"""
+        self.titles.pop(tab_id, None)
+        self.shown.pop(tab_id, None)
+
+    def _schedule(self):
+        if self._scheduled is None:
+            self._scheduled = self.master.after_idle(self.flush)
+
+    def flush(self):
+        """Применяет все накопленные обновления"""
+        self._scheduled = None
+        while self.tasks:
+            _, func = self.tasks.popitem(last=False)
+            func()
+        titles, self.titles = self.titles, {}
+        for tab_id, text in titles.items():
+            # Не трогаем вкладку, если заголовок не изменился
+            if self.shown.get(tab_id) != text:
+                try:
+                    self._set_title(tab_id, text)
+                except tk.TclError:
+                    continue  # Вкладку успели закрыть
+                self.shown[tab_id] = text
+        if self.status is not None:
+            self._set_status(self.status)
+            self.status = None
 
 
 class TextEditor:
     """Основной класс текстового редактора"""
+    # Обработчики, время которых записывается при включенной трассировке
+    TRACED = (
+        "new_doc", "open_doc", "open_folder", "save_doc", "save_doc_as", "close_doc",
+        "exit_app", "undo", "redo", "cut", "copy", "paste", "select_all", "find",
+        "find_next", "replace", "find_in_files", "zoom_in", "zoom_out", "zoom_reset",
+        "set_theme", "toggle_follow", "open_doc_by_recent_index", "activate_doc",
+        "on_tab_changed", "on_text_modified", "update_modified", "on_view_scrolled",
+        "on_doc_loaded", "on_doc_saved", "on_file_changed", "cancel_operation",
+        "transform",
+    )
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Текстовый редактор")
         self.root.geometry("1000x600")
+        # Закрытие окна проходит через exit_app, чтобы сеанс был сохранен
+        self.root.protocol("WM_DELETE_WINDOW", self.exit_app)
+        
+        # Файлы больше этого размера открываются в режиме большого файла
+        self.large_file_threshold = 1 << 30
+        # При открытии нескольких файлов меньшие читаются целиком в пуле потоков,
+        # большие загружаются по частям как обычно
+        self.bulk_read_limit = 8 << 20
+        self.max_folder_files = 500
         
         # Инициализация компонентов
         self.recent_list = RecentList()
-        self.documents = []  # Список открытых документов
+        self.session = Session()
+        self.saver = BackgroundSaver(self.root)
+        self.journal = RecoveryJournal()
+        self.watcher = FileWatcher(self.root, self.on_file_changed)
+        self.styles = StyleRegistry(self.root)
+        self.view_pool = TextViewPool(self.create_view)
+        self.find_replace = FindReplace(self)
+        self.file_search = FindInFiles(self)
+        self.documents = DocumentRegistry()  # Открытые документы по вкладкам
         self.current_doc = None
+        self.transform_pool = None  # Процессы для преобразований больших текстов
+        
+        # Трассировка включается переменной окружения EDITOR_TRACE; методы
+        # оборачиваются до того, как их привяжут к меню и событиям
+        self.tracer = Tracer.from_environment(self.root, on_stall=self.on_stall)
+        self.trace_summary = TraceSummary(self)
+        if self.tracer:
+            self.tracer.instrument(self, self.TRACED)
         
         # Создание интерфейса
         self.create_menu()
         self.create_widgets()
+        if self.tracer:
+            self.tracer.instrument(self.ui, ("flush",))
         
         # Загрузка списка последних файлов
         self.load_recent_files()
         
-        # Создание первого документа
-        self.new_doc()
+        # Восстановление вкладок прошлого сеанса (или первый документ)
+        self.restore_session()
         
         # Привязка горячих клавиш
         self.bind_hotkeys()
         
+        # После аварийного завершения предлагаем восстановить документы
+        self.root.after_idle(self.recover_documents)
+        
     def create_menu(self):
         """Создает главное меню"""
         menubar = tk.Menu(self.root)
@@ -150,6 +4163,7 @@ class TextEditor:
         
         file_menu.add_command(label="Новый", command=self.new_doc, accelerator="Ctrl+N")
         file_menu.add_command(label="Открыть", command=self.open_doc, accelerator="Ctrl+O")
+        file_menu.add_command(label="Открыть папку...", command=self.open_folder)
         file_menu.add_command(label="Сохранить", command=self.save_doc, accelerator="Ctrl+S")
         file_menu.add_command(label="Сохранить как...", command=self.save_doc_as)
         file_menu.add_command(label="Закрыть", command=self.close_doc, accelerator="Ctrl+W")
@@ -174,6 +4188,17 @@ class TextEditor:
         edit_menu.add_command(label="Вставить", command=self.paste, accelerator="Ctrl+V")
         edit_menu.add_command(label="Выделить все", command=self.select_all, accelerator="Ctrl+A")
         
+        # Подменю построчных преобразований (выделенных строк или всего текста)
+        transform_menu = tk.Menu(edit_menu, tearoff=0)
+        edit_menu.add_cascade(label="Преобразовать строки", menu=transform_menu)
+        for kind, (label, _) in TRANSFORMS.items():
+            transform_menu.add_command(label=label, command=lambda kind=kind: self.transform(kind))
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Найти...", command=self.find, accelerator="Ctrl+F")
+        edit_menu.add_command(label="Найти далее", command=self.find_next, accelerator="F3")
+        edit_menu.add_command(label="Заменить...", command=self.replace, accelerator="Ctrl+H")
+        edit_menu.add_command(label="Найти в файлах...", command=self.find_in_files, accelerator="Ctrl+Shift+F")
+        
         # Меню "Вид"
         view_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Вид", menu=view_menu)
@@ -181,6 +4206,20 @@ class TextEditor:
         view_menu.add_command(label="Увеличить шрифт", command=self.zoom_in, accelerator="Ctrl++")
         view_menu.add_command(label="Уменьшить шрифт", command=self.zoom_out, accelerator="Ctrl+-")
         view_menu.add_command(label="Сбросить масштаб", command=self.zoom_reset, accelerator="Ctrl+0")
+        view_menu.add_separator()
+        self.theme_var = tk.StringVar(value=self.styles.theme)
+        view_menu.add_radiobutton(label="Светлая тема", variable=self.theme_var,
+                                  value="light", command=self.set_theme)
+        view_menu.add_radiobutton(label="Темная тема", variable=self.theme_var,
+                                  value="dark", command=self.set_theme)
+        view_menu.add_separator()
+        self.follow_var = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="Следить за концом файла", variable=self.follow_var,
+                                  command=self.toggle_follow)
+        if self.tracer:
+            view_menu.add_separator()
+            view_menu.add_command(label="Сводка трассировки...", command=self.trace_summary.show)
+            view_menu.add_command(label="Сохранить трассировку", command=self.export_trace)
         
     def create_widgets(self):
         """Создает виджеты интерфейса"""
@@ -195,52 +4234,196 @@ class TextEditor:
         self.status_bar = tk.Label(self.root, text="Готово", bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         
-    def new_doc(self):
-        """Создает новый документ"""
-        # Создаем фрейм для вкладки
-        frame = tk.Frame(self.tab_control)
+        # Заголовки вкладок и статус бар обновляются один раз за цикл простоя
+        self.ui = UiUpdater(
+            self.root,
+            lambda tab_id, text: self.tab_control.tab(tab_id, text=text),
+            lambda text: self.status_bar.config(text=text)
+        )
+        
+    def create_view(self):
+        """Создает текстовое поле с полосой прокрутки для пула представлений"""
+        # Контейнер принадлежит панели вкладок, чтобы его можно было
+        # размещать во фрейме любой вкладки
+        container = tk.Frame(self.tab_control)
         
         # Создаем текстовое поле
         text_widget = tk.Text(
-            frame,
+            container,
             wrap=tk.WORD,
-            font=("Consolas", 12),
-            undo=True,
-            maxundo=100
+            undo=False
         )
+        self.styles.apply(text_widget)
+        
+        # Добавляем полосу прокрутки; при прокрутке обновляем подсветку
+        scrollbar = tk.Scrollbar(container, command=text_widget.yview)
         
-        # Добавляем полосу прокрутки
-        scrollbar = tk.Scrollbar(frame, command=text_widget.yview)
-        text_widget.config(yscrollcommand=scrollbar.set)
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            self.on_view_scrolled(view)
+        
+        text_widget.config(yscrollcommand=on_scroll)
         
         # Размещаем виджеты
         text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Создаем документ
-        doc = Document(self.root, text_widget)
+        view = TextView(text_widget, scrollbar=scrollbar, container=container)
         
-        # Добавляем вкладку
-        index = len(self.documents)
-        self.tab_control.add(frame, text=doc.short_name)
-        doc.tab_index = index
+        # Привязываем обработчик изменений текста
+        text_widget.bind(
+            "<<Modified>>",
+            lambda e: view.document and self.on_text_modified(view.document)
+        )
+        # Правка в режиме длинных строк требует подтверждения; привязки
+        # виджета срабатывают раньше привязок класса Text
+        text_widget.bind("<Key>", lambda e: view.document and self.on_view_key(view.document, e))
+        text_widget.bind("<<Cut>>", lambda e: view.document and self.on_view_cut(view.document))
+        return view
+    
+    def on_view_key(self, doc, event):
+        """Перед вводом текста в режиме длинных строк спрашивает о переходе к правке"""
+        if not doc.soft_breaks or doc.loading or doc.bulk:
+            return
+        # Сочетания с Control не вводят текст
+        if event.state & 0x4:
+            return
+        if event.char and event.char.isprintable() or event.keysym in ("BackSpace", "Delete", "Return", "Tab"):
+            if not self.unlock_soft_breaks(doc):
+                return "break"
+    
+    def on_view_cut(self, doc):
+        """Перед вырезанием в режиме длинных строк спрашивает о переходе к правке"""
+        if doc.soft_breaks and doc.text_widget.tag_ranges(tk.SEL) and not self.unlock_soft_breaks(doc):
+            return "break"
+    
+    def unlock_soft_breaks(self, doc):
+        """Переводит документ из режима длинных строк в обычный с согласия пользователя.
+
+        Возвращает True, если документ можно править.
+        """
+        if not doc.soft_breaks:
+            return True
+        if not messagebox.askyesno(
+            "Длинные строки",
+            f"В документе есть строка длиной {doc.longest_line} символов. "
+            "В обычном показе редактор может надолго подвиснуть. "
+            "Перейти к обычному показу для правки?"
+        ):
+            return False
+        doc.leave_soft_breaks()
+        return True
+    
+    def on_view_scrolled(self, view):
+        """Обновляет подсветку видимой области после прокрутки"""
+        self.find_replace.schedule_highlight()
+        if view.document is not None and view.document.highlighter:
+            view.document.highlighter.schedule()
+    
+    def restore_session(self):
+        """Восстанавливает вкладки прошлого сеанса.
+
+        Вкладки создаются сразу, а файлы загружаются только при активации
+        вкладки, поэтому запуск не зависит от числа документов в сеансе.
+        """
+        data = self.session.load()
+        if isinstance(data.get("zoom"), int):
+            self.styles.set_size(data["zoom"])
+        if data.get("theme") in StyleRegistry.THEMES:
+            self.styles.theme = data["theme"]
+            self.theme_var.set(self.styles.theme)
+        docs = []
+        for entry in data.get("documents", []):
+            if not isinstance(entry, dict) or not entry.get("path"):
+                continue
+            doc = self.new_doc(activate=False)
+            doc.filepath = entry["path"]
+            doc.deferred = True
+            doc.pending_cursor = entry.get("cursor")
+            doc.pending_yview = entry.get("yview")
+            self.documents.reindex(doc)
+            self.ui.set_title(doc.tab_id, doc.short_name)
+            docs.append(doc)
+        if not docs:
+            self.new_doc()
+            return
+        active = data.get("active", 0)
+        doc = docs[active] if isinstance(active, int) and 0 <= active < len(docs) else docs[0]
+        self.tab_control.select(doc.tab_id)
+        self.activate_doc(doc)
+    
+    def save_session(self):
+        """Записывает открытые документы, активную вкладку и масштаб"""
+        entries = []
+        active = 0
+        for tab_id in self.tab_control.tabs():
+            doc = self.documents.get(str(tab_id))
+            if doc is None or not doc.has_name:
+                continue
+            if doc is self.current_doc:
+                active = len(entries)
+            if doc.deferred:
+                cursor, yview = doc.pending_cursor, doc.pending_yview
+            elif doc.view:
+                cursor, yview = doc.cursor, doc.text_widget.yview()[0]
+            else:
+                state = doc.view_state or {}
+                cursor, yview = state.get("cursor"), state.get("yview")
+            entries.append({"path": doc.filepath, "cursor": cursor, "yview": yview})
+        self.session.save({
+            "documents": entries,
+            "active": active,
+            "zoom": self.styles.size,
+            "theme": self.styles.theme,
+        })
+    
+    def update_highlighter(self, doc):
+        """Включает подсветку синтаксиса для файлов Python"""
+        is_python = doc.has_name and doc.filepath.lower().endswith((".py", ".pyw"))
+        if is_python and not doc.read_only:
+            if doc.highlighter is None:
+                doc.set_highlighter(SyntaxHighlighter(doc))
+        elif doc.highlighter is not None:
+            doc.set_highlighter(None)
+    
+    def new_doc(self, activate=True):
+        """Создает новый документ"""
+        # Создаем пустой фрейм для вкладки; текстовое поле появится
+        # в нем при активации вкладки
+        frame = tk.Frame(self.tab_control)
         
-        # Добавляем документ в список
-        self.documents.append(doc)
+        # Создаем документ; его правки пишутся в журнал восстановления
+        doc = Document(self.root)
+        doc.frame = frame
+        doc.listeners.append(self.journal.on_edit)
         
-        # Делаем новую вкладку активной
-        self.tab_control.select(index)
+        # Добавляем вкладку и регистрируем документ
+        self.tab_control.add(frame, text=doc.short_name)
+        self.documents.add(str(frame), doc)
         
-        # Привязываем обработчик изменений текста
-        text_widget.bind("<<Modified>>", lambda e: self.on_text_modified(doc))
+        # Делаем новую вкладку активной
+        if activate:
+            self.tab_control.select(frame)
+            self.activate_doc(doc)
+        return doc
+    
+    def activate_doc(self, doc):
+        """Делает документ текущим и создает для него представление"""
+        self.current_doc = doc
+        self.view_pool.acquire(doc)
         
         # Устанавливаем фокус на текстовое поле
-        text_widget.focus_set()
+        doc.text_widget.focus_set()
+        
+        # Документ из прошлого сеанса загружается при первой активации
+        if doc.deferred:
+            doc.deferred = False
+            self.load_doc(doc, doc.filepath)
         
     def open_doc(self, filepath=None):
-        """Открывает существующий документ"""
+        """Открывает существующий документ и возвращает его (или None)"""
         if not filepath:
-            filepath = filedialog.askopenfilename(
+            filepaths = filedialog.askopenfilenames(
                 title="Открыть файл",
                 filetypes=[
                     ("Текстовые файлы", "*.txt"),
@@ -248,6 +4431,10 @@ class TextEditor:
                     ("Все файлы", "*.*")
                 ]
             )
+            if len(filepaths) > 1:
+                self.open_files(filepaths)
+                return None
+            filepath = filepaths[0] if filepaths else None
             
         if filepath:
             # Проверяем, не открыт ли уже файл
@@ -256,44 +4443,237 @@ class TextEditor:
                 return
             
             # Создаем новый документ
-            self.new_doc()
-            doc = self.current_doc
+            return self.load_doc(self.new_doc(), filepath)
+        return None
+    
+    def open_folder(self):
+        """Открывает все текстовые файлы папки (с учетом .gitignore)"""
+        directory = filedialog.askdirectory(title="Открыть папку")
+        if not directory:
+            return
+        limit = self.max_folder_files
+        self.ui.set_status("Поиск файлов...")
+        
+        def on_listed(future):
+            paths = future.result()
+            if len(paths) > limit and not messagebox.askyesno(
+                "Открыть папку",
+                f"В папке больше {limit} файлов. Открыть первые {limit}?"
+            ):
+                self.ui.set_status("Готово")
+                return
+            self.open_files(paths[:limit])
+        
+        run_in_background(
+            self.root,
+            lambda: list(islice(iter_files(directory, IgnoreRules()), limit + 1)),
+            on_listed
+        )
+    
+    def open_files(self, filepaths):
+        """Открывает несколько файлов.
+
+        Файлы читаются и декодируются параллельно в пуле потоков, а вкладки
+        создаются пачками по мере готовности; меню недавних файлов
+        обновляется один раз в конце.
+        """
+        pending = []
+        seen = set()
+        skipped = 0
+        for filepath in filepaths:
+            key = os.path.realpath(filepath)
+            if key in seen or self.doc_opened(filepath):
+                continue
+            seen.add(key)
+            try:
+                size = os.path.getsize(filepath)
+            except OSError:
+                continue
+            if size > self.bulk_read_limit:
+                # Большие файлы грузятся потоком; двоичные среди них
+                # пропускаем по началу файла, как и при чтении целиком
+                try:
+                    binary = is_binary_file(filepath)
+                except OSError:
+                    binary = True
+                if binary:
+                    skipped += 1
+                    continue
+                self.load_doc(self.new_doc(activate=False), filepath)
+            else:
+                pending.append((filepath, _readers.submit(read_text_file, filepath)))
+        self.ui.set_status(f"Открытие файлов: {len(pending)}...")
+        self.collect_opened(pending, [], skipped)
+    
+    def collect_opened(self, pending, opened, skipped):
+        """Создает вкладки для уже прочитанных файлов пакетного открытия"""
+        waiting = []
+        for filepath, future in pending:
+            if not future.done():
+                waiting.append((filepath, future))
+                continue
+            try:
+                result = future.result()
+            except (OSError, UnicodeDecodeError):
+                result = None
+            if result is None:
+                skipped += 1
+                continue
+            doc = self.new_doc(activate=False)
+            doc.open_loaded(filepath, *result)
+            self.documents.reindex(doc)
+            self.on_doc_loaded(doc, True, batch=True)
+            opened.append(doc)
+        if waiting:
+            self.root.after(20, self.collect_opened, waiting, opened, skipped)
+            return
+        
+        self.update_recent_menu()
+        if opened:
+            self.tab_control.select(opened[0].tab_id)
+            self.activate_doc(opened[0])
+        text = f"Открыто файлов: {len(opened)}"
+        if skipped:
+            text += f", пропущено (двоичные или ошибка чтения): {skipped}"
+        self.ui.set_status(text)
+    
+    def load_doc(self, doc, filepath):
+        """Загружает файл в документ; при ошибке закрывает его вкладку"""
+        # Очень большие файлы открываем в режиме просмотра
+        try:
+            large = os.path.getsize(filepath) >= self.large_file_threshold
+        except OSError:
+            large = False
+        if large:
+            if doc.open_large(filepath, on_status=lambda text: self.ui.set_status(text)):
+                self.documents.reindex(doc)
+                self.on_doc_loaded(doc, True)
+                return doc
+            self.close_doc_by_id(doc.tab_id)
+            return None
+        
+        # Открываем файл в фоновом режиме
+        started = doc.open_file_async(
+            filepath,
+            on_progress=lambda fraction: self.on_doc_progress(doc, fraction),
+            on_done=lambda success: self.on_doc_loaded(doc, success)
+        )
+        if started:
+            self.documents.reindex(doc)
+            self.ui.set_title(doc.tab_id, doc.short_name)
+            return doc
+        
+        # Если не удалось открыть файл, закрываем его вкладку
+        self.close_doc_by_id(doc.tab_id)
+        return None
+    
+    def on_doc_progress(self, doc, fraction):
+        """Показывает ход загрузки документа в статус баре"""
+        self.ui.set_status(
+            f"Загрузка {doc.short_name}: {fraction:.0%} (Esc — отмена)"
+        )
+    
+    def on_doc_loaded(self, doc, success, batch=False):
+        """Обработчик завершения фоновой загрузки документа.
+
+        При пакетном открытии (batch) статус бар и меню недавних файлов
+        обновляет вызывающий код один раз для всех документов.
+        """
+        if doc not in self.documents:
+            return
+        
+        if success:
+            # Обновляем заголовок вкладки
+            self.ui.set_title(doc.tab_id, doc.short_name)
             
-            # Открываем файл
-            if doc.open_file(filepath):
-                # Обновляем заголовок вкладки
-                self.tab_control.tab(doc.tab_index, text=doc.short_name)
-                
-                # Добавляем в список последних файлов
-                self.recent_list.add(filepath)
+            # Добавляем в список последних файлов
+            self.recent_list.add(doc.filepath)
+            if not batch:
+                self.ui.set_status("Файл открыт")
                 self.update_recent_menu()
-            else:
-                # Если не удалось открыть файл, закрываем созданную вкладку
-                self.close_doc_by_index(doc.tab_index)
+            
+            # Минифицированные и однострочные файлы показываем с мягкими
+            # переносами, не передавая Tk строки в мегабайты
+            if doc.long_lines and not doc.read_only:
+                doc.open_soft_breaks(on_status=lambda text: self.ui.set_status(text))
+            
+            self.update_highlighter(doc)
+            doc.load_history()
+            
+            # Ставим курсор в запрошенное место или туда, где он был
+            # при прошлом закрытии
+            entry = self.recent_list.get(doc.filepath) or {}
+            cursor = doc.pending_cursor or entry.get("cursor")
+            doc.pending_cursor = None
+            if doc.read_only or doc.soft_breaks:
+                # Окно показа не совпадает со строками буфера
+                cursor = None
+            if cursor and doc.view:
+                doc.text_widget.mark_set(tk.INSERT, cursor)
+                doc.text_widget.see(tk.INSERT)
+            elif cursor:
+                # Представление еще не создано: курсор восстановится при активации
+                doc.view_state = {"cursor": cursor, "yview": 0.0}
+            if doc.pending_yview is not None and not doc.read_only and doc.view:
+                doc.text_widget.yview_moveto(doc.pending_yview)
+            doc.pending_yview = None
+            
+            # Следим за изменениями файла другими программами
+            if not doc.read_only:
+                self.watcher.watch(doc.filepath, doc.disk_stat, doc.follow, doc.encoding)
+        else:
+            # Если загрузка не удалась или отменена, закрываем вкладку
+            self.ui.set_status("Загрузка отменена")
+            self.close_doc_by_id(doc.tab_id)
+    
+    def cancel_operation(self):
+        """Отменяет загрузку или долгую правку текущего документа"""
+        doc = self.current_doc
+        if doc and doc.loading:
+            doc.cancel_loading()
+        elif doc and doc.bulk:
+            doc.bulk.cancel()
     
-    def save_doc(self):
+    def save_doc(self, background=True):
         """Сохраняет текущий документ"""
         if self.current_doc:
+            if self.current_doc.loading:
+                self.ui.set_status("Файл еще загружается")
+                return
+            if self.current_doc.bulk:
+                self.ui.set_status("Документ занят операцией")
+                return
+            if self.current_doc.read_only:
+                self.ui.set_status("Файл открыт только для чтения")
+                return
             if self.current_doc.has_name:
-                if self.current_doc.save_file():
+                doc = self.current_doc
+                # Не перезаписываем молча файл, измененный другой программой
+                if (doc.disk_stat is not None and not doc.saving
+                        and file_signature(doc.filepath) != doc.disk_stat
+                        and not messagebox.askyesno(
+                            "Файл изменен",
+                            f"Файл '{doc.short_name}' изменен другой программой. Перезаписать его?"
+                        )):
+                    return
+                saver = self.saver if background else None
+                if doc.save_file(saver, lambda success: self.on_doc_saved(doc, success)):
                     # Обновляем заголовок вкладки
-                    self.tab_control.tab(
-                        self.current_doc.tab_index, 
-                        text=self.current_doc.short_name
-                    )
-                    self.status_bar.config(text="Файл сохранен")
-                    
-                    # Добавляем в список последних файлов
-                    self.recent_list.add(self.current_doc.filepath)
-                    self.update_recent_menu()
+                    self.ui.set_title(doc.tab_id, doc.short_name)
+                    self.ui.set_status("Сохранение...")
+                    if not background:
+                        self.on_doc_saved(doc, True)
                 else:
-                    self.status_bar.config(text="Ошибка сохранения")
+                    self.ui.set_status("Ошибка сохранения")
             else:
                 # Если у документа нет имени, вызываем "Сохранить как"
-                self.save_doc_as()
+                self.save_doc_as(background)
     
-    def save_doc_as(self):
+    def save_doc_as(self, background=True):
         """Сохраняет документ с новым именем"""
+        if self.current_doc and self.current_doc.bulk:
+            self.ui.set_status("Документ занят операцией")
+            return
         if self.current_doc:
             filepath = filedialog.asksaveasfilename(
                 title="Сохранить как",
@@ -306,19 +4686,124 @@ class TextEditor:
             )
             
             if filepath:
-                if self.current_doc.save_as(filepath):
-                    # Обновляем заголовок вкладки
-                    self.tab_control.tab(
-                        self.current_doc.tab_index, 
-                        text=self.current_doc.short_name
-                    )
-                    self.status_bar.config(text="Файл сохранен")
+                doc = self.current_doc
+                if doc.has_name:
+                    self.watcher.unwatch(doc.filepath)
+                saver = self.saver if background and not doc.read_only else None
+                if doc.save_as(filepath, saver, lambda success: self.on_doc_saved(doc, success)):
+                    self.documents.reindex(doc)
+                    self.update_highlighter(doc)
                     
-                    # Добавляем в список последних файлов
-                    self.recent_list.add(filepath)
-                    self.update_recent_menu()
+                    # Обновляем заголовок вкладки
+                    self.ui.set_title(doc.tab_id, doc.short_name)
+                    self.ui.set_status("Сохранение...")
+                    if saver is None:
+                        self.on_doc_saved(doc, True)
                 else:
-                    self.status_bar.config(text="Ошибка сохранения")
+                    self.ui.set_status("Ошибка сохранения")
+    
+    def on_doc_saved(self, doc, success):
+        """Обработчик завершения записи документа"""
+        if not success:
+            self.ui.set_status("Ошибка сохранения")
+            if doc in self.documents:
+                self.ui.set_title(doc.tab_id, "*" + doc.short_name)
+            return
+        
+        self.ui.set_status("Файл сохранен")
+        
+        if not doc.read_only:
+            self.watcher.watch(doc.filepath, doc.disk_stat, doc.follow, doc.encoding)
+        
+        # Журнал больше не нужен; если документ успели изменить во время
+        # записи, журнал начинается заново со снимка
+        if doc.modified:
+            self.journal.checkpoint(doc)
+        else:
+            self.journal.discard(doc)
+        
+        # Добавляем в список последних файлов
+        self.recent_list.add(doc.filepath)
+        self.update_recent_menu()
+    
+    def on_file_changed(self, filepath, old, new, appended):
+        """Обрабатывает изменение открытого файла другой программой"""
+        doc = self.documents.find(filepath)
+        if (doc is None or doc.loading or doc.read_only or doc.deferred
+                or doc.saving or doc.bulk):
+            return
+        if new == doc.disk_stat:
+            return
+        if new is None:
+            doc.disk_stat = None
+            self.ui.set_status(f"Файл {doc.short_name} удален или переименован")
+            return
+        if not doc.modified:
+            # Неизмененный документ: дописываем хвост или перечитываем файл
+            if appended is not None and old == doc.disk_stat:
+                doc.append_from_disk(appended)
+                doc.disk_stat = new
+                if doc.view:
+                    doc.text_widget.see(tk.END)
+            else:
+                self.reload_doc(doc)
+                self.ui.set_status(f"Файл {doc.short_name} изменен на диске и перезагружен")
+            return
+        # Об одной версии файла предупреждаем один раз
+        doc.disk_stat = new
+        if messagebox.askyesno(
+            "Файл изменен",
+            f"Файл '{doc.short_name}' изменен другой программой.\n"
+            "Перезагрузить его? Несохраненные изменения будут потеряны."
+        ):
+            self.reload_doc(doc)
+    
+    def reload_doc(self, doc):
+        """Перечитывает документ с диска, сохраняя курсор и прокрутку"""
+        if doc.view:
+            doc.pending_cursor = tk.END if doc.follow else doc.cursor
+            doc.pending_yview = None if doc.follow else doc.text_widget.yview()[0]
+        self.journal.discard(doc)
+        self.load_doc(doc, doc.filepath)
+    
+    def toggle_follow(self):
+        """Включает или выключает слежение за концом файла (tail -f)"""
+        doc = self.current_doc
+        if not doc or not doc.has_name or doc.loading or doc.read_only:
+            self.follow_var.set(False)
+            return
+        doc.follow = self.follow_var.get()
+        self.watcher.watch(doc.filepath, doc.disk_stat, doc.follow, doc.encoding)
+        if doc.follow and doc.view:
+            doc.text_widget.mark_set(tk.INSERT, tk.END)
+            doc.text_widget.see(tk.END)
+    
+    def recover_documents(self):
+        """Предлагает восстановить документы, не сохраненные из-за сбоя"""
+        names = self.journal.pending()
+        if not names:
+            return
+        if messagebox.askyesno(
+            "Восстановление",
+            f"Найдены несохраненные документы ({len(names)}). Восстановить их?"
+        ):
+            for name in names:
+                recovered = self.journal.recover(name)
+                if recovered is None:
+                    continue
+                filepath, encoding, text = recovered
+                doc = self.new_doc()
+                doc.set_text(text)
+                doc.filepath = filepath
+                doc.encoding = encoding
+                doc.modified = True
+                doc.history.mark_unsaved()
+                self.documents.reindex(doc)
+                self.update_highlighter(doc)
+                self.ui.set_title(doc.tab_id, "*" + doc.short_name)
+                self.journal.checkpoint(doc)
+        for name in names:
+            self.journal.remove(name)
     
     def close_doc(self):
         """Закрывает текущий документ"""
@@ -333,38 +4818,49 @@ class TextEditor:
                 if response is None:  # Отмена
                     return
                 elif response:  # Да
-                    self.save_doc()
+                    self.save_doc(background=False)
+                    if self.current_doc.modified:  # Сохранение не удалось
+                        return
             
             # Закрываем вкладку
-            self.close_doc_by_index(self.current_doc.tab_index)
+            self.close_doc_by_id(self.current_doc.tab_id)
     
-    def close_doc_by_index(self, index):
-        """Закрывает документ по индексу"""
-        if 0 <= index < len(self.documents):
-            # Удаляем вкладку
-            self.tab_control.forget(index)
-            
-            # Удаляем документ из списка
-            del self.documents[index]
+    def close_doc_by_id(self, tab_id):
+        """Закрывает документ по идентификатору вкладки"""
+        doc = self.documents.get(tab_id)
+        if doc is not None:
+            # Запоминаем позицию курсора и историю отмены, освобождаем ресурсы
+            self.remember_cursor(doc)
+            doc.save_history()
+            doc.close()
+            self.journal.discard(doc)
+            if doc.has_name:
+                self.watcher.unwatch(doc.filepath)
+            self.view_pool.release(doc)
             
-            # Обновляем индексы оставшихся документов
-            for i in range(index, len(self.documents)):
-                self.documents[i].tab_index = i
+            # Удаляем вкладку и документ
+            self.ui.forget(tab_id)
+            self.tab_control.forget(tab_id)
+            self.documents.remove(doc)
+            doc.frame.destroy()
             
             # Если остались открытые документы, выбираем последний
-            if self.documents:
-                self.tab_control.select(len(self.documents) - 1)
+            last = self.documents.last()
+            if last is not None:
+                self.tab_control.select(last.tab_id)
+    
+    def remember_cursor(self, doc):
+        """Сохраняет позицию курсора документа в списке недавних"""
+        if doc.has_name and not doc.loading and not doc.read_only and not doc.deferred:
+            self.recent_list.update(doc.filepath, cursor=doc.cursor)
     
     def doc_opened(self, filename):
         """Проверяет, открыт ли уже файл"""
-        for doc in self.documents:
-            if doc.filepath == filename:
-                return True
-        return False
+        return self.documents.find(filename) is not None
     
     def open_doc_by_recent_index(self, index):
         """Открывает документ из списка последних файлов по индексу"""
-        files = self.recent_list.load_data()
+        files = self.recent_list.files()
         if 0 <= index < len(files):
             self.open_doc(files[index])
     
@@ -372,27 +4868,40 @@ class TextEditor:
         """Обработчик события изменения активной вкладки"""
         selected = self.tab_control.select()
         if selected:
-            tab_index = self.tab_control.index(selected)
-            if 0 <= tab_index < len(self.documents):
-                self.current_doc = self.documents[tab_index]
+            doc = self.documents.get(selected)
+            if doc is not None:
+                self.activate_doc(doc)
+                self.follow_var.set(doc.follow)
                 
                 # Обновляем статус бар
                 if self.current_doc.has_name:
-                    self.status_bar.config(text=f"{self.current_doc.full_name} - {len(self.documents)} документов")
+                    self.ui.set_status(f"{self.current_doc.full_name} - {len(self.documents)} документов")
                 else:
-                    self.status_bar.config(text=f"Без имени - {len(self.documents)} документов")
+                    self.ui.set_status(f"Без имени - {len(self.documents)} документов")
     
     def on_text_modified(self, doc):
         """Обработчик изменения текста"""
-        if doc.text_widget.edit_modified():
-            doc.modified = True
-            
-            # Добавляем звездочку к названию вкладки
-            tab_text = doc.short_name
-            if doc.modified:
-                tab_text = "*" + tab_text
-            
-            self.tab_control.tab(doc.tab_index, text=tab_text)
+        if doc.loading or doc.read_only:
+            return
+        self.find_replace.schedule_highlight()
+        # Флаг виджета сбрасывается только при обновлении, поэтому серия
+        # правок до него дает одно событие <<Modified>>
+        self.ui.call(("modified", doc), lambda: self.update_modified(doc))
+    
+    def update_modified(self, doc):
+        """Обновляет пометку изменений документа и заголовок его вкладки"""
+        if doc not in self.documents:
+            return
+        # Документ не изменен, если история вернулась к сохраненному состоянию
+        doc.modified = not doc.history.at_saved()
+        
+        # Добавляем звездочку к названию вкладки
+        tab_text = doc.short_name
+        if doc.modified:
+            tab_text = "*" + tab_text
+        
+        self.ui.set_title(doc.tab_id, tab_text)
+        if doc.view:
             doc.text_widget.edit_modified(False)
     
     def load_recent_files(self):
@@ -404,8 +4913,8 @@ class TextEditor:
         # Очищаем меню
         self.recent_menu.delete(0, tk.END)
         
-        # Загружаем список файлов
-        files = self.recent_list.load_data()
+        # Берем список файлов из памяти
+        files = self.recent_list.files()
         
         if files:
             for i, filepath in enumerate(files):
@@ -419,19 +4928,17 @@ class TextEditor:
     
     def undo(self):
         """Отмена последнего действия"""
-        if self.current_doc:
-            try:
-                self.current_doc.text_widget.edit_undo()
-            except:
-                pass
+        doc = self.current_doc
+        if doc and not doc.loading and not doc.read_only and not doc.bulk:
+            if doc.history.undo_stack and self.unlock_soft_breaks(doc):
+                doc.undo()
     
     def redo(self):
         """Повтор последнего действия"""
-        if self.current_doc:
-            try:
-                self.current_doc.text_widget.edit_redo()
-            except:
-                pass
+        doc = self.current_doc
+        if doc and not doc.loading and not doc.read_only and not doc.bulk:
+            if doc.history.redo_stack and self.unlock_soft_breaks(doc):
+                doc.redo()
     
     def cut(self):
         """Вырезать выделенный текст"""
@@ -448,6 +4955,79 @@ class TextEditor:
         if self.current_doc:
             self.current_doc.text_widget.event_generate("<<Paste>>")
     
+    def on_paste(self, widget):
+        """Обработчик <<Paste>>: большой текст вставляется частями"""
+        doc = self.current_doc
+        if doc is None or doc.text_widget is not widget:
+            widget.tk.call("tk_textPaste", widget._w)
+            return
+        if doc.loading or doc.read_only or doc.bulk:
+            return
+        try:
+            text = widget.clipboard_get()
+        except tk.TclError:
+            return
+        if not self.unlock_soft_breaks(doc):
+            return
+        if len(text) < BulkEdit.INLINE_LIMIT:
+            widget.tk.call("tk_textPaste", widget._w)
+            return
+        # Как tk_textPaste: выделение заменяется везде, кроме X11
+        ranges = widget.tag_ranges(tk.SEL)
+        if ranges and widget.tk.call("tk", "windowingsystem") != "x11":
+            start, end = doc.view.offset(ranges[0]), doc.view.offset(ranges[1])
+        else:
+            start = end = doc.view.offset(tk.INSERT)
+        self.start_bulk(doc, start, end, [text], "Вставка")
+    
+    def transform(self, kind):
+        """Преобразует выделенные строки (или весь документ) одним шагом отмены"""
+        doc = self.current_doc
+        if not doc or doc.view is None or doc.loading or doc.read_only or doc.bulk:
+            return
+        if not self.unlock_soft_breaks(doc):
+            return
+        buffer = doc.buffer
+        ranges = doc.text_widget.tag_ranges(tk.SEL)
+        if ranges:
+            first_line = buffer.position_of(doc.view.offset(ranges[0]))[0]
+            last_line, column = buffer.position_of(doc.view.offset(ranges[1]))
+            if column == 0 and last_line > first_line:
+                last_line -= 1
+            start = buffer.line_start(first_line)
+            end = buffer.line_start(last_line + 1) if last_line + 1 < buffer.line_count else len(buffer)
+        else:
+            start, end = 0, len(buffer)
+        text = buffer.get_text(start, end)
+        label, by_blocks = TRANSFORMS[kind]
+        if len(text) < BulkEdit.INLINE_LIMIT:
+            parts = [transform_text(text, kind)]
+            if parts[0] == text:
+                self.ui.set_status(f"{label}: без изменений")
+                return
+        else:
+            if self.transform_pool is None:
+                # spawn: рабочие процессы не наследуют состояние Tk
+                self.transform_pool = ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            blocks = split_blocks(text, BulkEdit.BLOCK_SIZE) if by_blocks else [text]
+            parts = [self.transform_pool.submit(transform_text, block, kind) for block in blocks]
+        self.start_bulk(doc, start, end, parts, label)
+    
+    def start_bulk(self, doc, start, end, parts, label):
+        """Запускает долгую правку документа с ходом выполнения в статус баре"""
+        bulk = BulkEdit(doc, start, end, parts, label, on_status=self.ui.set_status,
+                        on_done=lambda success: self.on_bulk_done(doc, success))
+        bulk.start()
+    
+    def on_bulk_done(self, doc, success):
+        """Обработчик завершения долгой правки"""
+        if doc not in self.documents:
+            return
+        self.update_modified(doc)
+        self.ui.set_status("Готово" if success else "Операция отменена")
+    
     def select_all(self):
         """Выделить весь текст"""
         if self.current_doc:
@@ -456,77 +5036,136 @@ class TextEditor:
             self.current_doc.text_widget.see(tk.INSERT)
             return "break"
     
+    def find(self):
+        """Открывает окно поиска"""
+        self.find_replace.show()
+    
+    def find_next(self):
+        """Находит следующее совпадение"""
+        self.find_replace.find_next()
+    
+    def replace(self):
+        """Открывает окно замены"""
+        self.find_replace.show(replace=True)
+    
+    def find_in_files(self):
+        """Открывает окно поиска в файлах"""
+        self.file_search.show()
+    
+    def goto_location(self, filepath, line, column=0):
+        """Открывает файл (если нужно) и ставит курсор на строку"""
+        cursor = f"{line}.{column}"
+        doc = self.documents.find(filepath)
+        if doc is None:
+            doc = self.open_doc(filepath)
+            if doc is not None:
+                doc.pending_cursor = cursor
+            return
+        self.tab_control.select(doc.tab_id)
+        self.activate_doc(doc)
+        if doc.loading:
+            doc.pending_cursor = cursor
+        elif not doc.read_only:
+            doc.text_widget.mark_set(tk.INSERT, cursor)
+            doc.text_widget.see(tk.INSERT)
+    
     def zoom_in(self):
         """Увеличить шрифт"""
-        for doc in self.documents:
-            current_font = doc.text_widget.cget("font")
-            font_parts = current_font.split()
-            if len(font_parts) >= 2:
-                try:
-                    size = int(font_parts[1])
-                    doc.text_widget.config(font=(font_parts[0], size + 1))
-                except:
-                    pass
+        self.styles.set_size(self.styles.size + 1)
     
     def zoom_out(self):
         """Уменьшить шрифт"""
-        for doc in self.documents:
-            current_font = doc.text_widget.cget("font")
-            font_parts = current_font.split()
-            if len(font_parts) >= 2:
-                try:
-                    size = int(font_parts[1])
-                    if size > 6:
-                        doc.text_widget.config(font=(font_parts[0], size - 1))
-                except:
-                    pass
+        self.styles.set_size(self.styles.size - 1)
     
     def zoom_reset(self):
         """Сбросить масштаб шрифта"""
-        for doc in self.documents:
-            doc.text_widget.config(font=("Consolas", 12))
+        self.styles.set_size(StyleRegistry.DEFAULT_SIZE)
+    
+    def set_theme(self):
+        """Применяет выбранную тему ко всем текстовым полям пула"""
+        self.styles.theme = self.theme_var.get()
+        for view in self.view_pool.views:
+            self.styles.apply(view.widget)
     
     def bind_hotkeys(self):
         """Привязывает горячие клавиши"""
         # Новый документ
-        self.root.bind("<Control-n>", lambda e: self.new_doc())
-        self.root.bind("<Control-N>", lambda e: self.new_doc())
+        self.hotkey("<Control-n>", lambda e: self.new_doc())
+        self.hotkey("<Control-N>", lambda e: self.new_doc())
         
         # Открыть документ
-        self.root.bind("<Control-o>", lambda e: self.open_doc())
-        self.root.bind("<Control-O>", lambda e: self.open_doc())
+        self.hotkey("<Control-o>", lambda e: self.open_doc())
+        self.hotkey("<Control-O>", lambda e: self.open_doc())
         
         # Сохранить документ
-        self.root.bind("<Control-s>", lambda e: self.save_doc())
-        self.root.bind("<Control-S>", lambda e: self.save_doc())
+        self.hotkey("<Control-s>", lambda e: self.save_doc())
+        self.hotkey("<Control-S>", lambda e: self.save_doc())
         
         # Закрыть документ
-        self.root.bind("<Control-w>", lambda e: self.close_doc())
-        self.root.bind("<Control-W>", lambda e: self.close_doc())
+        self.hotkey("<Control-w>", lambda e: self.close_doc())
+        self.hotkey("<Control-W>", lambda e: self.close_doc())
         
         # Отмена/повтор
-        self.root.bind("<Control-z>", lambda e: self.undo())
-        self.root.bind("<Control-y>", lambda e: self.redo())
+        self.hotkey("<Control-z>", lambda e: self.undo())
+        self.hotkey("<Control-y>", lambda e: self.redo())
         
         # Вырезать/копировать/вставить
-        self.root.bind("<Control-x>", lambda e: self.cut())
-        self.root.bind("<Control-c>", lambda e: self.copy())
-        self.root.bind("<Control-v>", lambda e: self.paste())
+        self.hotkey("<Control-x>", lambda e: self.cut())
+        self.hotkey("<Control-c>", lambda e: self.copy())
+        self.hotkey("<Control-v>", lambda e: self.paste())
         
         # Выделить все
-        self.root.bind("<Control-a>", lambda e: self.select_all())
+        self.hotkey("<Control-a>", lambda e: self.select_all())
+        
+        # Поиск и замена (в текстовом поле заменяем стандартные привязки Tk)
+        self.hotkey("<Control-f>", lambda e: self.find())
+        self.hotkey("<Control-h>", lambda e: self.replace())
+        self.hotkey("<Control-f>", lambda e: self.find() or "break", class_name="Text")
+        self.hotkey("<Control-h>", lambda e: self.replace() or "break", class_name="Text")
+        self.hotkey("<F3>", lambda e: self.find_next())
+        self.hotkey("<Control-F>", lambda e: self.find_in_files())
+        
+        # Вставка в текстовых полях (в том числе Ctrl+V); "break" не дает
+        # привязке окна к Ctrl+V вставить текст второй раз
+        self.hotkey("<<Paste>>", lambda e: self.on_paste(e.widget) or "break", class_name="Text")
         
         # Масштаб
-        self.root.bind("<Control-plus>", lambda e: self.zoom_in())
-        self.root.bind("<Control-minus>", lambda e: self.zoom_out())
-        self.root.bind("<Control-0>", lambda e: self.zoom_reset())
+        self.hotkey("<Control-plus>", lambda e: self.zoom_in())
+        self.hotkey("<Control-minus>", lambda e: self.zoom_out())
+        self.hotkey("<Control-0>", lambda e: self.zoom_reset())
+        
+        # Отмена загрузки
+        self.hotkey("<Escape>", lambda e: self.cancel_operation())
+        self.hotkey("<Button-1>", lambda e: self.cancel_operation(), widget=self.status_bar)
         
         # Выход
-        self.root.bind("<Alt-F4>", lambda e: self.exit_app())
+        self.hotkey("<Alt-F4>", lambda e: self.exit_app())
+    
+    def hotkey(self, sequence, handler, widget=None, class_name=None):
+        """Привязывает горячую клавишу; при трассировке замеряет обработчик"""
+        if self.tracer:
+            handler = self.tracer.wrap(f"key {sequence}", handler)
+        if class_name:
+            self.root.bind_class(class_name, sequence, handler)
+        else:
+            (widget or self.root).bind(sequence, handler)
+    
+    def on_stall(self, duration, location):
+        """Сообщает о зависании главного цикла в статус баре"""
+        self.ui.set_status(f"Интерфейс не отвечал {duration:.1f} с: {location}")
+    
+    def export_trace(self):
+        """Записывает трассу в файл формата Chrome trace"""
+        try:
+            path = self.tracer.export()
+            self.ui.set_status(f"Трасса записана: {os.path.abspath(path)}")
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось записать трассу: {e}")
     
     def exit_app(self):
         """Выход из приложения"""
         # Проверяем каждый документ на наличие несохраненных изменений
+        declined = set()
         for doc in self.documents:
             if doc.modified:
                 response = messagebox.askyesnocancel(
@@ -536,17 +5175,43 @@ class TextEditor:
                 
                 if response is None:  # Отмена
                     return
-                elif response:  # Да
+                elif not response:  # Нет
+                    declined.add(doc)
+                else:  # Да
                     # Делаем документ текущим
-                    self.tab_control.select(doc.tab_index)
+                    self.tab_control.select(doc.tab_id)
                     self.current_doc = doc
                     
                     if doc.has_name:
                         doc.save_file()
                     else:
-                        self.save_doc()
+                        self.save_doc(background=False)
         
-        # Закрываем приложение
+        # Дожидаемся фоновых сохранений
+        self.saver.flush()
+        
+        # Запоминаем сеанс, прерываем незавершенные загрузки и закрываем приложение
+        self.save_session()
+        for doc in self.documents:
+            self.remember_cursor(doc)
+            doc.save_history()
+            doc.close()
+            # Журнал документа, который не удалось сохранить, остается
+            # для восстановления при следующем запуске
+            if not doc.modified or doc in declined:
+                self.journal.discard(doc)
+        self.journal.close()
+        self.watcher.stop()
+        self.recent_list.flush()
+        self.file_search.shutdown()
+        if self.transform_pool:
+            self.transform_pool.shutdown(wait=False, cancel_futures=True)
+        if self.tracer:
+            self.tracer.stop()
+            try:
+                self.tracer.export()
+            except OSError:
+                pass
         self.root.destroy()
     
     def run(self):
@@ -0,0 +1,271 @@
+"""Регрессионные тесты частей редактора, которые работают без дисплея"""
+import os
+import threading
+import time
+import tkinter as tk
+
+import pytest
+
+import laba1
+from laba1 import PieceTable, py_column, tk_column
+
+
+def test_tk_column_round_trip_with_astral_characters():
+    line = "a😀b😀😀c"
+    tcl = tk.Tcl()
+    for column in range(len(line) + 1):
+        tk_col = tk_column(line, column)
+        # Столбец Tk равен длине префикса строки в символах Tcl
+        assert tk_col == int(tcl.call("string", "length", line[:column]))
+        assert py_column(line, tk_col) == column
+
+
+def test_buffer_tk_offsets_after_emoji():
+    buffer = PieceTable("x😀y\nq😀😀r\n")
+    assert buffer.astral
+    for offset in range(len(buffer) + 1):
+        line, column = buffer.tk_position(offset)
+        assert buffer.tk_offset(line, column) == offset
+    line, column = buffer.tk_position(buffer.get_text().index("r"))
+    assert (line, column) == (1, 1 + 2 * laba1.tcl_astral_width())
+
+
+def test_buffer_without_astral_characters_uses_plain_columns():
+    buffer = PieceTable("abc\ndef")
+    buffer.insert(1, "ж")
+    assert not buffer.astral
+    assert buffer.tk_position(6) == (1, 1)
+    assert buffer.tk_offset(1, 1) == 6
+
+
+def test_trimmed_history_does_not_report_saved_state():
+    history = laba1.UndoHistory(max_bytes=1000)
+    assert history.at_saved()
+    history.record(0, "", "x" * 600)
+    history.separator()
+    history.record(600, "", "y" * 600)
+    assert len(history.undo_stack) == 1
+    assert not history.at_saved()
+
+
+def test_history_keeps_newest_step_over_limit():
+    doc = laba1.Document(None)
+    doc.history.max_bytes = 1000
+    doc.set_text("abc")
+    doc.replace_matches([(1, 2, "x" * 5000)])
+    assert doc.history.size > doc.history.max_bytes
+    assert doc.undo()
+    assert doc.get_text() == "abc"
+    assert doc.history.at_saved()
+
+
+def test_write_atomic_writes_through_symlink(tmp_path):
+    real = tmp_path / "real"
+    real.mkdir()
+    target = real / "target.txt"
+    target.write_text("old")
+    link = tmp_path / "link.txt"
+    link.symlink_to(target)
+    laba1.write_atomic(str(link), ["new"])
+    assert link.is_symlink()
+    assert target.read_text() == "new"
+
+
+def test_large_file_opens_without_view(tmp_path):
+    path = tmp_path / "big.txt"
+    path.write_text("line\n" * 1000)
+    doc = laba1.Document(None)
+    assert doc.open_large(str(path))
+    assert doc.read_only and doc.large.widget is None
+    doc.close()
+
+
+def test_soft_break_document_stays_editable():
+    doc = laba1.Document(None)
+    doc.set_text("x" * 100 + "\n")
+    doc.open_soft_breaks()
+    assert not doc.read_only
+    doc.replace_range(0, 1, "y")
+    assert doc.soft_breaks is None
+    assert doc.get_text().startswith("yx")
+    doc.close()
+
+
+def test_piece_table_index_matches_text_after_edits():
+    text = "abc\ndef\n" * 20
+    buffer = PieceTable(text)
+    edits = [(5, "x\ny"), (len(text), "tail"), (0, "\n"), (40, ""), (17, "zz")]
+    for offset, inserted in edits:
+        buffer.insert(offset, inserted)
+        text = text[:offset] + inserted + text[offset:]
+        copy = buffer.snapshot()
+        buffer.delete(offset + 1, 3)
+        text = text[:offset + 1] + text[offset + 4:]
+        assert len(buffer) == len(text)
+        assert buffer.line_count == text.count("\n") + 1
+        for line, expected in enumerate(text.split("\n")):
+            assert buffer.line_text(line) == expected
+        assert copy.get_text() != buffer.get_text()
+
+
+def test_sniff_encoding_truncated_character_only_at_prefix_end():
+    assert laba1.sniff_encoding(b"hello world \xe6") == laba1.FALLBACK_ENCODING
+    # Полный префикс обрывается на первом байте буквы "ж"
+    prefix = "ж".encode("utf-8") * (laba1.SNIFF_SIZE // 2 - 1) + b"a\xd0"
+    assert len(prefix) == laba1.SNIFF_SIZE
+    assert laba1.sniff_encoding(prefix) == "utf-8"
+
+
+def test_recent_list_update_survives_flush_of_other_instance(tmp_path):
+    filename = str(tmp_path / "recent.json")
+    first = laba1.RecentList(filename, save_delay=60)
+    first.add("/a")
+    first.flush()
+    second = laba1.RecentList(filename, save_delay=60)
+    first.update("/a", cursor="3.4")
+    first.flush()
+    second.flush()
+    assert laba1.RecentList(filename).get("/a")["cursor"] == "3.4"
+
+
+def test_recent_list_saves_once_after_series_of_adds(tmp_path):
+    filename = tmp_path / "recent.json"
+    recent = laba1.RecentList(str(filename), save_delay=0.05)
+    for i in range(100):
+        recent.add(f"/file{i}")
+    worker = recent._worker
+    assert not filename.exists()
+    worker.join(5)
+    assert laba1.RecentList(str(filename)).files()[0] == "/file99"
+
+
+def test_inotify_is_not_used_outside_linux(monkeypatch):
+    monkeypatch.setattr(laba1.sys, "platform", "win32")
+    assert laba1.Inotify.create() is None
+
+
+def test_journal_writes_only_newest_checkpoint_of_batch(tmp_path, monkeypatch):
+    written = []
+    write_atomic = laba1.write_atomic
+
+    def counting_write(filepath, chunks):
+        written.append(os.path.basename(filepath))
+        write_atomic(filepath, chunks)
+
+    monkeypatch.setattr(laba1, "write_atomic", counting_write)
+    journal = laba1.RecoveryJournal(str(tmp_path))
+    doc = laba1.Document(None)
+    chunk = "x" * laba1.RecoveryJournal.CHECKPOINT_BYTES
+    for _ in range(5):
+        journal.on_edit(doc, 0, "", chunk)
+    journal.close()
+    assert sum(name.endswith(".snap") for name in written) == 1
+
+
+def test_journal_checkpoint_threshold_grows_with_document(tmp_path):
+    journal = laba1.RecoveryJournal(str(tmp_path))
+    doc = laba1.Document(None)
+    doc.set_text("x" * 3 * laba1.RecoveryJournal.CHECKPOINT_BYTES)
+    journal.on_edit(doc, 0, "", "y" * laba1.RecoveryJournal.CHECKPOINT_BYTES)
+    assert journal.entries[doc][1] == laba1.RecoveryJournal.CHECKPOINT_BYTES
+    journal.close()
+
+
+def test_piece_table_blocks_split_and_merge(monkeypatch):
+    monkeypatch.setattr(PieceTable, "BLOCK_SIZE", 2)
+    text = "0123456789\n" * 5
+    buffer = PieceTable(text)
+    # Вставки в разные места дробят буфер на много кусков и блоков
+    for offset in range(len(text), 0, -3):
+        buffer.insert(offset, "ab\n")
+        text = text[:offset] + "ab\n" + text[offset:]
+    assert len(buffer._blocks) > 2
+    buffer.delete(5, 40)
+    text = text[:5] + text[45:]
+    assert buffer.get_text() == text
+    assert buffer.line_count == text.count("\n") + 1
+    for offset in range(len(text) + 1):
+        line, column = buffer.position_of(offset)
+        assert line == text.count("\n", 0, offset)
+        assert buffer.offset_of(line, column) == offset
+
+
+def test_replace_all_is_one_small_undo_step():
+    doc = laba1.Document(None)
+    text = ("foo bar " * 100 + "\n") * 50
+    doc.set_text(text)
+    engine = laba1.SearchEngine()
+    engine.set_pattern("foo")
+    matches = engine.replace_all(doc.get_text(), "x")
+    assert len(matches) == 5000
+    doc.replace_matches(matches)
+    assert doc.get_text() == text.replace("foo", "x")
+    # В истории только замененные фрагменты, а не весь диапазон совпадений
+    assert len(doc.history.undo_stack) == 1
+    assert sum(len(removed) + len(inserted) for _, removed, inserted in doc.history.undo_stack[0].ops) == 4 * 5000
+    assert doc.undo()
+    assert doc.get_text() == text
+    assert not doc.undo()
+
+
+def test_is_binary_file(tmp_path):
+    binary = tmp_path / "data.bin"
+    binary.write_bytes(b"\x7fELF\0\0\1" * 100)
+    text = tmp_path / "text.txt"
+    text.write_text("hello\n")
+    assert laba1.is_binary_file(str(binary))
+    assert not laba1.is_binary_file(str(text))
+
+
+def test_loader_restarts_with_fallback_after_utf8_prefix(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"header\n" * 20000 + "Привет\n".encode("cp1251"))
+    loader = laba1.FileLoader(None, str(path))
+    loader._read()
+    items = []
+    while not loader.queue.empty():
+        items.append(loader.queue.get_nowait())
+    kinds = [kind for kind, _, _ in items]
+    assert "restart" in kinds and kinds[-1] == "done"
+    restart = kinds.index("restart")
+    text = "".join(payload[0] for kind, payload, _ in items[restart:] if kind == "chunk" and payload)
+    assert text.endswith("Привет\n")
+    assert loader.format.encoding == laba1.FALLBACK_ENCODING
+    assert laba1.read_text_file(str(path))[1].encoding == laba1.FALLBACK_ENCODING
+
+
+def test_large_file_lines_use_sniffed_encoding(tmp_path):
+    lines = ["первая", "вторая ੁ䄀", "третья"]
+    for encoding in ("utf-16", "cp1251", "utf-8-sig"):
+        path = tmp_path / f"big-{encoding}.txt"
+        text = "\n".join(lines if encoding != "cp1251" else [line[:6] for line in lines])
+        path.write_bytes(text.encode(encoding))
+        doc = laba1.Document(None)
+        assert doc.open_large(str(path))
+        index = doc.large.index
+        for _ in range(500):
+            if index.done:
+                break
+            time.sleep(0.01)
+        assert [doc.large._line_text(i) for i in range(index.line_count)] == text.split("\n")
+        doc.close()
+
+
+def test_recent_list_add_does_not_wait_for_file_lock(tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    filename = str(tmp_path / "recent.json")
+    recent = laba1.RecentList(filename, save_delay=60)
+    recent.add("/a")
+    # Другой экземпляр держит блокировку файла списка
+    with open(filename + ".lock", "w") as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        flusher = threading.Thread(target=recent.flush)
+        flusher.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        recent.add("/b")
+        assert time.monotonic() - started < 0.05
+        assert flusher.is_alive()
+    flusher.join(5)
+    recent.flush()
+    assert laba1.RecentList(filename).files() == ["/b", "/a"]